@@ -22,6 +22,7 @@ DEFAULT_PL_SAVE_DIR = join(DEFAULT_RESULTS_SAVE_DIR, 'polylidar')
 DEFAULT_CGAL_SAVE_DIR = join(DEFAULT_RESULTS_SAVE_DIR, 'cgal')
 DEFAULT_PG_SAVE_DIR = join(DEFAULT_RESULTS_SAVE_DIR, 'postgis')
 DEFAULT_SL_SAVE_DIR = join(DEFAULT_RESULTS_SAVE_DIR, 'spatialite')
+DEFAULT_HISTORY_DIR = join(DEFAULT_RESULTS_SAVE_DIR, 'history')
 
 
 DEFAULT_PG_CONN = "dbname=concave user=concave password=concave host=localhost"
@@ -2,13 +2,16 @@ from os import path
 import subprocess
 import logging
 import ast
+import atexit
+import struct
 
 import numpy as np
 from shapely.geometry import LineString
 import matplotlib.pyplot as plt
 logger = logging.getLogger("Concave")
 
-from concave_evaluation.helpers import plot_line, lines_to_polygon, plot_poly_make_fig, save_shapely, modified_fname, load_polygon, evaluate_l2
+from concave_evaluation.helpers import plot_line, lines_to_polygon, edges_to_polygon, plot_poly_make_fig, save_shapely, modified_fname, ground_truth, evaluate_l2, load_points
+from concave_evaluation.helpers.benchmark import benchmark, BENCHMARK_OPTIONS
 from concave_evaluation import DEFAULT_CGAL_SAVE_DIR, CGAL_BIN
 
 
@@ -39,29 +42,132 @@ def launch_cgal(point_fpath, edge_fpath, alpha=10, n=1):
     return timings
 
 
-def run_test(point_fpath, save_dir=DEFAULT_CGAL_SAVE_DIR, n=1, alpha=10, save_poly=True, gt_fpath=None, **kwargs):
+class CGALWorker(object):
+    """A long lived cgal_alpha process (--server mode)
+    Points are streamed as raw float64 buffers over stdin and the timings and alpha shape edges
+    are returned over stdout using a binary length prefixed protocol. Nothing touches the filesystem.
+    See serve() in cgal_alpha.cpp for the protocol.
+    """
+
+    def __init__(self, cgal_bin=CGAL_BIN):
+        self.args = [cgal_bin, '--server']
+        self.proc = subprocess.Popen(self.args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def is_alive(self):
+        return self.proc.poll() is None
+
+    def _read(self, num_bytes):
+        data = self.proc.stdout.read(num_bytes)
+        if len(data) != num_bytes:
+            raise ValueError("CGAL worker closed unexpectedly, return code {}".format(self.proc.poll()))
+        return data
+
+    def compute(self, points, alpha=10, n=1):
+        """Computes the alpha shape edges of points
+
+        Arguments:
+            points {ndarray} -- NX2 point array
+
+        Keyword Arguments:
+            alpha {float} -- CGAL alpha value (squared radius) (default: {10})
+            n {int} -- Number of timed iterations (default: {1})
+
+        Returns:
+            Tuple[ndarray, List] -- Mx4 array of edges (x0, y0, x1, y1) and the timings (ms) of each iteration
+        """
+        points = np.ascontiguousarray(points[:, :2], dtype=np.float64)
+        if points.shape[0] == 0:
+            # A request without points is the shutdown sentinel, an empty cloud has an empty alpha shape
+            return np.empty((0, 4), dtype=np.float64), []
+        self.proc.stdin.write(struct.pack('=QdI', points.shape[0], alpha, n))
+        self.proc.stdin.write(memoryview(points).cast('B'))
+        self.proc.stdin.flush()
+
+        status, = struct.unpack('=I', self._read(4))
+        if status != 0:
+            raise ValueError("CGAL worker returned error")
+        num_timings, = struct.unpack('=Q', self._read(8))
+        timings = np.frombuffer(self._read(num_timings * 8), dtype=np.float64).tolist()
+        num_edges, = struct.unpack('=Q', self._read(8))
+        edges = np.frombuffer(self._read(num_edges * 32), dtype=np.float64).reshape(num_edges, 4)
+        return edges, timings
+
+    def close(self):
+        if self.is_alive():
+            try:
+                self.proc.stdin.write(struct.pack('=Q', 0))
+                self.proc.stdin.close()
+                self.proc.wait(timeout=5)
+            except Exception:
+                self.proc.kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_WORKER = None
+
+
+def library_versions(cgal_bin=CGAL_BIN):
+    """Version of CGAL the binary was built against"""
+    result = subprocess.run([cgal_bin, '--version'], stdout=subprocess.PIPE, encoding='utf-8', timeout=10)
+    if result.returncode != 0:
+        raise ValueError("CGAL binary returned error")
+    return dict(cgal=result.stdout.strip())
+
+
+def get_cgal_worker():
+    """Returns the CGAL worker of this process, (re)launching it if needed"""
+    global _WORKER
+    if _WORKER is None or not _WORKER.is_alive():
+        _WORKER = CGALWorker()
+    return _WORKER
+
+
+@atexit.register
+def close_cgal_worker():
+    """Shuts down the CGAL worker of this process, if any"""
+    if _WORKER is not None:
+        _WORKER.close()
+
+
+def run_test(point_fpath, save_dir=DEFAULT_CGAL_SAVE_DIR, n=1, alpha=10, save_poly=True, gt_fpath=None,
+             persistent=False, **kwargs):
     # If we already passed in a numpy array, no need to load from file
     if isinstance(point_fpath, np.ndarray):
         points = point_fpath
-        # create a temporary file and write points to it, CGAL runner needs a file to operate
         point_fpath = path.join(save_dir, 'temp_points.csv')
-        np.savetxt(point_fpath, points)
+        text_fpath = None
     else:
-        points = np.loadtxt(point_fpath)
+        points = load_points(point_fpath)
+        text_fpath = None if str(point_fpath).endswith('.npy') else point_fpath
 
-    save_fname, test_name = modified_fname(point_fpath, save_dir)
-    edge_fpath = path.join(save_dir, 'output.csv')
-    # This launches the CGAL alpha shape C++ binary with appropriate parameters
-    timings = launch_cgal(point_fpath, edge_fpath, alpha=alpha, n=n)
+    if persistent:
+        # Points are streamed to the long lived CGAL worker, no files involved. Each call is timed by CGAL
+        worker = get_cgal_worker()
+        edges, timings = benchmark(lambda: worker.compute(points, alpha=alpha, n=1), n=n, internal=True)
+        timings = [timing[0] for timing in timings]
+    else:
+        if text_fpath is None:
+            # create a temporary file and write points to it, CGAL runner needs a text file to operate
+            text_fpath = path.join(save_dir, 'temp_points.csv')
+            np.savetxt(text_fpath, points)
+        edge_fpath = path.join(save_dir, 'output.csv')
+        # This launches the CGAL alpha shape C++ binary with appropriate parameters
+        # The binary repeats internally, warmup iterations are run first and dropped (no adaptive repetition)
+        warmup = BENCHMARK_OPTIONS['warmup']
+        timings = launch_cgal(text_fpath, edge_fpath, alpha=alpha, n=n + warmup)[warmup:]
 
-    # Load the edges file that CGAL created of the polygon
-    edges = np.loadtxt(edge_fpath)
+        # Load the edges file that CGAL created of the polygon
+        edges = np.loadtxt(edge_fpath)
 
-    # convert these edges to line strings and eventually to a polygon and save
+    # convert these edges to a polygon (polygonize the edges) and save
     # Note that this process is not timed! Nor does this process have anything to do
     # with Polylidar and its polygon creation algorithm.
-    all_lines = create_line_strings(edges)
-    union_lines_poly = lines_to_polygon(all_lines)
+    union_lines_poly = edges_to_polygon(edges)
     if save_poly:
         if (not union_lines_poly.is_valid):
             logger.error("CGAL polygon not valid %r", point_fpath)
@@ -71,18 +177,14 @@ def run_test(point_fpath, save_dir=DEFAULT_CGAL_SAVE_DIR, n=1, alpha=10, save_po
 
     l2_norm = np.NaN
     # Evaluate L2 Norm if we have the ground truth data
-    # if the path is a string (nominal) then load the polygon
-    if isinstance(gt_fpath, str):
-        gt_shape, _ = load_polygon(gt_fpath)
-        l2_norm = evaluate_l2(gt_shape, union_lines_poly)
-    elif gt_fpath is not None:
-        gt_shape = gt_fpath
-        l2_norm = evaluate_l2(gt_shape, union_lines_poly)
+    # gt_fpath may be a geojson path (parsed once per process), a polygon or a GroundTruth
+    if gt_fpath is not None:
+        l2_norm = evaluate_l2(ground_truth(gt_fpath), union_lines_poly)
 
     # fig = plt.figure(1, figsize=(5,5), dpi=180)
     # ax = fig.add_subplot(111)
     # ax.scatter(points[:, 0], points[:, 1])
-    # for index, line in enumerate(all_lines):
+    # for index, line in enumerate(create_line_strings(edges)):
     #     plot_line(ax, line, index=None)
     # plt.show()
 
@@ -1,14 +1,21 @@
 import logging
 import json
-from os import path
+import copy
+import pickle
+from os import path, walk
 from pathlib import Path
 import math
+from functools import lru_cache
 
 import click
 import numpy as np
 import ast
-from shapely.geometry import Polygon, shape, MultiPolygon, box, Point, LineString
+import shapely
+from shapely.geometry import Polygon, shape, MultiPolygon, box, Point, LineString, MultiLineString
 from shapely.affinity import scale
+from shapely.ops import polygonize, unary_union
+from shapely.strtree import STRtree
+from shapely.prepared import prep
 from descartes import PolygonPatch
 import matplotlib.pyplot as plt
 from shapely_geojson import dump, Feature
@@ -26,6 +33,9 @@ logger.addHandler(ch)
 BLUE = '#6699cc'
 GRAY = '#999999'
 
+# Shapely 2 exposes vectorized (array based) geometry constructors and predicates
+SHAPELY_2 = int(shapely.__version__.split('.')[0]) >= 2
+
 
 class PythonLiteralOption(click.Option):
 
@@ -162,14 +172,11 @@ def plot_poly_make_fig(poly):
 
 
 def load_polygon(poly_fpath):
-    """Attempts to load a polygon geojson file"""
+    """Attempts to load a polygon geojson file (parsed once per process, see load_ground_truth)"""
     try:
-        with open(poly_fpath) as f:
-            poly_geojson = json.load(f)
-        # print(poly_geojson)
-        poly = shape(poly_geojson['geometry'])
-        # print(poly)
-        return poly, poly_geojson
+        gt = load_ground_truth(poly_fpath)
+        # The geojson is modified by some callers, the cached copy must stay intact
+        return gt.shape, copy.deepcopy(gt.geojson)
     except Exception as e:
         logger.exception("Error loading %r", poly_fpath)
         return None, None
@@ -261,17 +268,199 @@ def save_shapely(shape, fname, uid="", alg='polylidar'):
 #     denominator = predicted_shape.area
 #     return numerator / denominator
 
+class PreparedGT(object):
+    def __init__(self, gt_shape):
+        """Ground truth shape prepared for (repeated) accuracy metrics
+        Every metric is derived from the intersection area, area(A xor B) = area(A) + area(B) - 2 * area(A and B)
+        and area(A or B) = area(A) + area(B) - area(A and B), so a predicted shape costs at most one overlay.
+        The overlay is skipped when the prepared ground truth contains, or is disjoint from, the prediction.
+        """
+        self.shape = gt_shape
+        self.area = gt_shape.area
+        if SHAPELY_2:
+            # Prepares in place, the geometry caches its index for every later predicate
+            shapely.prepare(gt_shape)
+            self.prepared = gt_shape
+        else:
+            self.prepared = prep(gt_shape)
+
+    def intersection_area(self, predicted_shape):
+        if self.prepared.disjoint(predicted_shape):
+            return 0.0
+        if self.prepared.contains(predicted_shape):
+            return predicted_shape.area
+        return self.shape.intersection(predicted_shape).area
+
+    def intersection_areas(self, predicted_shapes):
+        """Intersection area of each predicted shape, vectorized with shapely 2"""
+        if not SHAPELY_2:
+            return np.array([self.intersection_area(predicted) for predicted in predicted_shapes])
+        predicted_shapes = np.asarray(predicted_shapes, dtype=object)
+        areas = shapely.area(predicted_shapes)
+        contained = shapely.contains(self.shape, predicted_shapes)
+        disjoint = shapely.disjoint(self.shape, predicted_shapes)
+        overlay = ~(contained | disjoint)
+        intersection = np.where(contained, areas, 0.0)
+        intersection[overlay] = shapely.area(shapely.intersection(self.shape, predicted_shapes[overlay]))
+        return intersection
+
+    def l2(self, predicted_shape):
+        """Symmetric difference area normalized by the predicted area (see evaluate_l2)"""
+        area = predicted_shape.area
+        return (self.area + area - 2.0 * self.intersection_area(predicted_shape)) / area
+
+    def iou(self, predicted_shape):
+        intersection = self.intersection_area(predicted_shape)
+        return intersection / (self.area + predicted_shape.area - intersection)
+
+    def evaluate_batch(self, predicted_shapes):
+        """Returns the l2 and iou arrays of many predicted shapes"""
+        areas = np.array([predicted.area for predicted in predicted_shapes], dtype=np.float64)
+        intersection = self.intersection_areas(predicted_shapes)
+        l2 = (self.area + areas - 2.0 * intersection) / areas
+        iou = intersection / (self.area + areas - intersection)
+        return dict(l2=l2, iou=iou)
+
+
+def nominal_alpha(area, num_points):
+    """Nominal alpha (circumradius) for num_points spread over area, twice the mean point spacing"""
+    return math.sqrt(area / num_points) * 2
+
+
+class GroundTruth(PreparedGT):
+    def __init__(self, gt_shape, geojson=None):
+        """Prepared ground truth with the values derived from it by the benchmarks"""
+        super().__init__(gt_shape)
+        self.geojson = geojson
+        self.convex_hull = gt_shape.convex_hull
+        # Fraction of the convex hull covered by the shape, the target of PostGIS ST_ConcaveHull
+        self.target_percent = self.area / self.convex_hull.area
+
+    def alpha(self, num_points):
+        return nominal_alpha(self.area, num_points)
+
+
+GT_CACHE_SIZE = 64
+
+
+@lru_cache(maxsize=GT_CACHE_SIZE)
+def cached_ground_truth(poly_fpath, mtime):
+    with open(poly_fpath) as f:
+        poly_geojson = json.load(f)
+    return GroundTruth(shape(poly_geojson['geometry']), poly_geojson)
+
+
+def load_ground_truth(poly_fpath):
+    """Loads a ground truth geojson file, cached (LRU) per process by path and modification time"""
+    poly_fpath = path.abspath(str(poly_fpath))
+    return cached_ground_truth(poly_fpath, path.getmtime(poly_fpath))
+
+
+def ground_truth(gt):
+    """Returns the GroundTruth of a geojson path, a shapely geometry or an existing GroundTruth"""
+    if isinstance(gt, GroundTruth):
+        return gt
+    if isinstance(gt, (str, Path)):
+        return load_ground_truth(gt)
+    return GroundTruth(gt)
+
+
+def prepare_gt(gt_shape):
+    return gt_shape if isinstance(gt_shape, PreparedGT) else PreparedGT(gt_shape)
+
+
 def evaluate_l2(gt_shape, predicted_shape):
-    left = gt_shape.difference(predicted_shape)
-    right = predicted_shape.difference(gt_shape)
-    numerator = left.union(right).area
-    denominator = predicted_shape.area
-    l2 = numerator / denominator
-    return l2
+    """Area of the symmetric difference of gt and predicted shape normalized by the predicted area
+    gt_shape may be a PreparedGT to reuse its prepared geometry over many calls
+    """
+    return prepare_gt(gt_shape).l2(predicted_shape)
+
 
 def evaluate_iou(true_boundary, estimated):
-    iou = estimated.intersection(true_boundary).area / estimated.union(true_boundary).area
-    return iou
+    return prepare_gt(true_boundary).iou(estimated)
+
+
+def evaluate_batch(gt_shape, predicted_shapes):
+    """Evaluates many predicted shapes against one (prepared once) ground truth, returns l2 and iou arrays"""
+    return prepare_gt(gt_shape).evaluate_batch(predicted_shapes)
+
+
+def polygon_rings(shape):
+    """Returns every ring (exterior and interiors) of a Polygon or MultiPolygon as coordinate arrays"""
+    polygons = shape.geoms if shape.geom_type == 'MultiPolygon' else [shape]
+    return [np.asarray(ring.coords)[:, :2] for polygon in polygons
+            for ring in [polygon.exterior, *polygon.interiors]]
+
+
+def scanline_crossings(shape, origin_y, row_height, num_rows):
+    """Intersects every edge of a polygon with the center lines of a grid of rows
+
+    Arguments:
+        shape {Polygon|MultiPolygon} -- Shape to sample
+        origin_y {float} -- Bottom of the first row
+        row_height {float} -- Height of a row
+        num_rows {int} -- Number of rows
+
+    Returns:
+        Tuple[ndarray, ndarray] -- Row index and x coordinate of every crossing
+    """
+    rings = polygon_rings(shape)
+    start = np.concatenate([ring[:-1] for ring in rings])
+    end = np.concatenate([ring[1:] for ring in rings])
+    # Rows [row_start, row_end) have their center line crossed by an edge, horizontal edges cross none
+    y_min, y_max = np.minimum(start[:, 1], end[:, 1]), np.maximum(start[:, 1], end[:, 1])
+    row_start = np.clip(np.ceil((y_min - origin_y) / row_height - 0.5), 0, num_rows).astype(np.int64)
+    row_end = np.clip(np.ceil((y_max - origin_y) / row_height - 0.5), 0, num_rows).astype(np.int64)
+    num_crossings = row_end - row_start
+    edge_idx = np.repeat(np.arange(start.shape[0]), num_crossings)
+    first = np.cumsum(num_crossings) - num_crossings
+    row = np.repeat(row_start - first, num_crossings) + np.arange(num_crossings.sum())
+    y = origin_y + (row + 0.5) * row_height
+    t = (y - start[edge_idx, 1]) / (end[edge_idx, 1] - start[edge_idx, 1])
+    x = start[edge_idx, 0] + t * (end[edge_idx, 0] - start[edge_idx, 0])
+    return row, x
+
+
+def evaluate_scanline(gt_shape, predicted_shape, max_error=0.01, max_rows=1_000_000):
+    """Approximates l2 and iou by sampling the symmetric difference along the center lines of a grid of rows
+    Within a row the symmetric difference is where an odd number of boundary crossings (of either shape) lie to
+    the left, so its length is summed from the sorted crossings without any overlay. The area of a row is
+    approximated by height times center line length, the error of a row is bounded by its height times the
+    horizontal extent of the boundaries inside it. In total the area error is at most h * (perimeter of both shapes).
+    No geometry is constructed, the cost is linear in the number of crossings (~ perimeter / h).
+
+    Arguments:
+        gt_shape {Polygon|MultiPolygon|PreparedGT} -- Ground truth
+        predicted_shape {Polygon|MultiPolygon} -- Predicted shape
+
+    Keyword Arguments:
+        max_error {float} -- Requested bound of the absolute l2 error (default: {0.01})
+        max_rows {int} -- Upper limit of rows, coarsens the grid (and loosens the bound) if needed (default: {1_000_000})
+
+    Returns:
+        dict -- l2, iou and l2_error, the achieved bound of the absolute l2 error
+    """
+    if isinstance(gt_shape, PreparedGT):
+        gt_shape = gt_shape.shape
+    predicted_area = predicted_shape.area
+    perimeter = gt_shape.length + predicted_shape.length
+    _, min_y, _, max_y = get_max_bound(gt_shape.bounds, predicted_shape.bounds)
+
+    row_height = max(max_error * predicted_area / perimeter, (max_y - min_y) / max_rows)
+    num_rows = int(math.ceil((max_y - min_y) / row_height))
+    gt_row, gt_x = scanline_crossings(gt_shape, min_y, row_height, num_rows)
+    predicted_row, predicted_x = scanline_crossings(predicted_shape, min_y, row_height, num_rows)
+    row, x = np.concatenate([gt_row, predicted_row]), np.concatenate([gt_x, predicted_x])
+    # Every row has an even number of crossings, consecutive pairs delimit the symmetric difference
+    order = np.lexsort((x, row))
+    x = x[order]
+    symmetric_difference = row_height * np.sum(x[1::2] - x[0::2])
+
+    intersection = (gt_shape.area + predicted_area - symmetric_difference) / 2.0
+    union = (gt_shape.area + predicted_area + symmetric_difference) / 2.0
+    return dict(l2=symmetric_difference / predicted_area, iou=intersection / union,
+                l2_error=row_height * perimeter / predicted_area)
+
 
 def extract_shell(poly, allow_multiple=False):
     holes = [Polygon(interior) for interior in poly.interiors]
@@ -430,9 +619,161 @@ def lines_to_polygon(list_lines, buffer_amt=0.0001):
     return final_poly
 
 
+def face_depths(faces):
+    """Returns how many other faces enclose each face of a polygonized planar graph
+    Uses an STRtree over the face exteriors and a single representative point per face
+    """
+    exteriors = [Polygon(face.exterior) for face in faces]
+    tree = STRtree(exteriors)
+    if SHAPELY_2:
+        rep_points = shapely.point_on_surface(np.array(faces, dtype=object))
+        face_idx, _ = tree.query(rep_points, predicate='within')
+        return np.bincount(face_idx, minlength=len(faces)) - 1
+    # shapely 1.x, the tree only filters by bounding box
+    depths = []
+    for face in faces:
+        rep_point = face.representative_point()
+        depths.append(sum(1 for exterior in tree.query(rep_point) if exterior.contains(rep_point)) - 1)
+    return np.array(depths)
+
+
+def edges_to_polygon(edges):
+    """Converts an unordered set of boundary edges (e.g. CGAL alpha shape edges) into a polygon
+    All edges are noded and polygonized in one pass. Every face of the planar graph already carries its
+    holes, faces nested at an even depth (0 - outer shells, 2 - islands inside holes, ...) form the shape
+    while faces at an odd depth are the holes. Unlike lines_to_polygon nothing is buffered and
+    disconnected regions are handled.
+
+    Arguments:
+        edges {ndarray} -- Mx4 array of edges (x0, y0, x1, y1)
+
+    Returns:
+        (Multi)Polygon -- Returns a Polygon with holes
+    """
+    segments = np.asarray(edges, dtype=np.float64).reshape(-1, 2, 2)
+    if SHAPELY_2:
+        lines = shapely.multilinestrings(shapely.linestrings(segments))
+    else:
+        lines = MultiLineString([segment for segment in segments])
+    faces = list(polygonize(unary_union(lines)))
+    if not faces:
+        logger.error("Could not polygonize edges")
+        return Polygon()
+
+    depths = face_depths(faces)
+    polygons = [face for face, depth in zip(faces, depths) if depth % 2 == 0]
+    polygons.sort(key=lambda poly: poly.area, reverse=True)
+    if len(polygons) == 1:
+        return polygons[0]
+    return MultiPolygon(polygons)
+
+
 def modified_fname(fname, base_dir=None, suffix='.geojson'):
     if base_dir is None:
         base_dir = path.dirname(fname)
     fname = Path(fname).stem
     save_fname = path.join(base_dir, fname + suffix)
     return save_fname, fname
+
+
+TEXT_POINT_SUFFIXES = ['.csv', '.txt']
+BINARY_POINT_SUFFIX = '.npy'
+
+
+def binary_points_fpath(fpath):
+    """Returns the binary (.npy) sibling of a text or pickle point fixture"""
+    return path.splitext(str(fpath))[0] + BINARY_POINT_SUFFIX
+
+
+def has_binary_points(fpath):
+    """True if an up to date binary sibling exists for this fixture"""
+    bin_fpath = binary_points_fpath(fpath)
+    return path.exists(bin_fpath) and (not path.exists(fpath) or path.getmtime(bin_fpath) >= path.getmtime(fpath))
+
+
+def save_points(fpath, points):
+    """Saves a point cloud as a binary .npy fixture (header plus contiguous float64 block)"""
+    np.save(str(fpath), np.ascontiguousarray(points, dtype=np.float64))
+
+
+def resolve_point_file(ctx, param, value):
+    """Click callback of point file options, accepts a text fixture that only exists as its .npy sibling"""
+    if value is None or path.exists(value):
+        return value
+    if path.exists(binary_points_fpath(value)):
+        return binary_points_fpath(value)
+    raise click.BadParameter("Neither {!r} nor its {} sibling exist".format(value, BINARY_POINT_SUFFIX))
+
+
+def load_points(fpath, mmap=True):
+    """Loads a point cloud fixture
+    Binary .npy fixtures are memory mapped (zero copy, read only). For a text fixture (.csv, .txt)
+    its binary sibling is used if it is up to date, otherwise the text is parsed.
+    """
+    fpath = str(fpath)
+    if fpath.endswith(BINARY_POINT_SUFFIX) or has_binary_points(fpath):
+        return np.load(binary_points_fpath(fpath), mmap_mode='r' if mmap else None)
+    return np.loadtxt(fpath)
+
+
+def save_points_records(fpath, records):
+    """Saves the point records generated for a list of polygons (see points_pkl command)
+    All point clouds must be the same size and are stacked into one (num_polys, num_points, 2) .npy fixture.
+    The per polygon parameters are stored next to it as json.
+    """
+    save_points(fpath, np.stack([record['points'] for record in records]))
+    meta = [dict(poly_param=record['poly_param'], np=record['np']) for record in records]
+    with open(path.splitext(str(fpath))[0] + '.json', 'w') as f:
+        # numpy scalars (e.g. from np.arange) are not json serializable
+        json.dump(meta, f, default=lambda value: value.item())
+
+
+def load_points_records(fpath, mmap=True):
+    """Loads point records of polygons, from a stacked .npy fixture if available, else from the pickle file"""
+    fpath = str(fpath)
+    if not (fpath.endswith(BINARY_POINT_SUFFIX) or has_binary_points(fpath)):
+        with open(fpath, 'rb') as f:
+            return pickle.load(f)
+    points = np.load(binary_points_fpath(fpath), mmap_mode='r' if mmap else None)
+    with open(path.splitext(fpath)[0] + '.json') as f:
+        meta = json.load(f)
+    return [dict(points=points[i], **meta_) for i, meta_ in enumerate(meta)]
+
+
+def convert_points_file(fpath):
+    """Converts a text or pickle point fixture into its binary .npy sibling, returns the new path or None
+    A pickle of point clouds differing in size is converted into its dataset (.ds) sibling instead.
+    """
+    fpath = str(fpath)
+    suffix = path.splitext(fpath)[1]
+    bin_fpath = binary_points_fpath(fpath)
+    if suffix in TEXT_POINT_SUFFIXES:
+        save_points(bin_fpath, np.loadtxt(fpath))
+    elif suffix == '.pkl':
+        with open(fpath, 'rb') as f:
+            records = pickle.load(f)
+        # Polygon pickles are a tuple of (polygons, params), only point record lists are converted
+        if not isinstance(records, list) or not records or 'points' not in records[0]:
+            logger.info("Skipping %r, not a point record pickle", fpath)
+            return None
+        if len(set(np.shape(record['points']) for record in records)) > 1:
+            # Clouds of different sizes can not be stacked, the dataset format stores them by offset
+            from concave_evaluation.test_generation.dataset import save_points_dataset
+            logger.warning("Point clouds of %r differ in size, converting to a dataset instead of .npy", fpath)
+            return save_points_dataset(fpath, records)
+        save_points_records(bin_fpath, records)
+    else:
+        return None
+    return bin_fpath
+
+
+def convert_points_dir(directory):
+    """Converts every text and pickle point fixture (recursively) in directory into binary .npy fixtures"""
+    converted = []
+    for root, _, fnames in walk(str(directory)):
+        for fname in sorted(fnames):
+            bin_fpath = convert_points_file(path.join(root, fname))
+            if bin_fpath is not None:
+                logger.info("Converted %r", path.join(root, fname))
+                converted.append(bin_fpath)
+    return converted
@@ -0,0 +1,136 @@
+"""Benchmark harness shared by the algorithm runners
+Every timed call goes through benchmark(), which times with perf_counter_ns, runs warmup calls, optionally disables
+the garbage collector and pins the process to a core, and (adaptive mode) repeats until the confidence interval of
+the median is tight. The options are process wide (see configure_benchmark), worker pools inherit them when forked.
+"""
+import os
+import gc
+import math
+import time
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger("Concave")
+
+BENCHMARK_OPTIONS = dict(
+    warmup=0,           # Untimed calls before measuring
+    adaptive=False,     # Repeat beyond n until the median's confidence interval is within rel_ci
+    rel_ci=0.05,        # Target width of the 95% confidence interval of the median, relative to the median
+    max_repeat=100,     # Upper limit of repetitions in adaptive mode
+    max_time_s=30.0,    # Upper limit of measuring time in adaptive mode
+    core=None,          # Pin the process to this core while measuring
+    disable_gc=False,   # Disable the garbage collector while measuring
+)
+
+
+def configure_benchmark(**options):
+    unknown = set(options) - set(BENCHMARK_OPTIONS)
+    if unknown:
+        raise ValueError("Unknown benchmark options {}".format(sorted(unknown)))
+    BENCHMARK_OPTIONS.update(options)
+
+
+def median_ci(samples, z=1.96):
+    """Distribution free confidence interval of the median from order statistics (normal approximation)"""
+    samples = np.sort(samples)
+    n = samples.size
+    half_width = z * math.sqrt(n) / 2.0
+    low = max(int(math.floor(n / 2.0 - half_width)), 0)
+    high = min(int(math.ceil(n / 2.0 + half_width)), n - 1)
+    return samples[low], samples[high]
+
+
+def summarize(timings):
+    """Robust summary (ms) of repeated timings, sequences of sub timings are summed per repetition"""
+    timings = np.array([np.sum(timing) for timing in timings], dtype=np.float64)
+    q1, median, q3 = np.percentile(timings, [25, 50, 75])
+    ci_low, ci_high = median_ci(timings)
+    return dict(median=median, iqr=q3 - q1, min=timings.min(), max=timings.max(), n=timings.size,
+                ci_low=ci_low, ci_high=ci_high)
+
+
+def pin_measurement(core):
+    """Pins the process to core for a measurement, returns the affinity to restore or None if not pinned
+    A process already pinned to a single core (e.g. a pool worker pinned by the scheduler) keeps its core, so
+    concurrent workers never pile onto the same core. A core outside the allowed set is ignored.
+    """
+    if core is None or not hasattr(os, 'sched_setaffinity'):
+        return None
+    affinity = os.sched_getaffinity(0)
+    if len(affinity) == 1:
+        return None
+    if core not in affinity:
+        logger.warning("Core %d is not in the allowed cores %s, measuring unpinned", core, sorted(affinity))
+        return None
+    try:
+        os.sched_setaffinity(0, {core})
+    except OSError:
+        logger.warning("Could not pin to core %d, measuring unpinned", core)
+        return None
+    return affinity
+
+
+@contextmanager
+def measuring(core=None, disable_gc=False):
+    """Pins to a core and disables garbage collection for the duration of a measurement"""
+    affinity = pin_measurement(core)
+    gc_enabled = gc.isenabled()
+    if disable_gc:
+        gc.collect()
+        gc.disable()
+    try:
+        yield
+    finally:
+        if disable_gc and gc_enabled:
+            gc.enable()
+        if affinity is not None:
+            os.sched_setaffinity(0, affinity)
+
+
+def is_converged(timings, rel_ci):
+    if len(timings) < 3:
+        return False
+    summary = summarize(timings)
+    return (summary['ci_high'] - summary['ci_low']) <= rel_ci * summary['median']
+
+
+def benchmark(fn, n=1, internal=False, **options):
+    """Times repeated calls of fn
+
+    Arguments:
+        fn {Callable} -- Called without arguments
+
+    Keyword Arguments:
+        n {int} -- Number of timed calls, the minimum in adaptive mode (default: {1})
+        internal {bool} -- fn returns (result, timing) and measures itself (e.g. in C++), the timing (ms) may be a
+                           sequence of sub timings. Else every call is timed with perf_counter_ns (default: {False})
+        options -- Overrides of BENCHMARK_OPTIONS
+
+    Returns:
+        Tuple[Any, List] -- Result of the last call and the timing (ms) of every timed call
+    """
+    options = dict(BENCHMARK_OPTIONS, **options)
+
+    def call():
+        if internal:
+            return fn()
+        t0 = time.perf_counter_ns()
+        result = fn()
+        return result, (time.perf_counter_ns() - t0) / 1e6
+
+    result = None
+    timings = []
+    with measuring(options['core'], options['disable_gc']):
+        for _ in range(options['warmup']):
+            fn()
+        start = time.perf_counter()
+        while len(timings) < n or (options['adaptive'] and len(timings) < options['max_repeat'] and
+                                   time.perf_counter() - start < options['max_time_s'] and
+                                   not is_converged(timings, options['rel_ci'])):
+            result, timing = call()
+            timings.append(timing)
+    if options['adaptive'] and not is_converged(timings, options['rel_ci']):
+        logger.debug("Benchmark stopped after %d repetitions before the confidence interval converged", len(timings))
+    return result, timings
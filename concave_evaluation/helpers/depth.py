@@ -0,0 +1,105 @@
+"""Point clouds from raw depth images
+A depth image is deprojected with the pinhole model of its camera intrinsics into an organized (H, W, 3) cloud in
+the camera frame (x right, y down, z forward), pixels without depth are NaN. Lens distortion is ignored, the
+RealSense depth stream is rectified. Keeping the image layout lets segmentation use image space neighborhoods.
+"""
+import logging
+import warnings
+
+import numpy as np
+
+logger = logging.getLogger("Concave")
+
+# RealSense depth units are millimeters unless meta.json says otherwise
+DEFAULT_DEPTH_SCALE = 0.001
+INTRINSIC_KEYS = ['fx', 'fy', 'ppx', 'ppy']
+INTRINSIC_ALIASES = dict(ppx='cx', ppy='cy')
+
+
+def camera_intrinsics(meta):
+    """Reads fx, fy, ppx, ppy and depth_scale from a scene's meta.json
+    The intrinsics may be top level or nested under 'depth_intrinsics' or 'intrinsics', cx / cy are accepted for
+    ppx / ppy.
+    """
+    intrinsics = meta.get('depth_intrinsics', meta.get('intrinsics', meta))
+    result = dict()
+    for key in INTRINSIC_KEYS:
+        value = intrinsics.get(key, intrinsics.get(INTRINSIC_ALIASES.get(key)))
+        if value is None:
+            raise ValueError("Camera intrinsics are missing {!r}, found {}".format(key, sorted(intrinsics)))
+        result[key] = float(value)
+    result['depth_scale'] = float(meta.get('depth_scale', intrinsics.get('depth_scale', DEFAULT_DEPTH_SCALE)))
+    return result
+
+
+def deproject_depth(depth, intrinsics, stride=1):
+    """Deprojects a depth image into an organized point cloud
+
+    Arguments:
+        depth {ndarray} -- (H, W) raw depth, 0 marks missing depth
+        intrinsics {dict} -- fx, fy, ppx, ppy and depth_scale (see camera_intrinsics)
+
+    Keyword Arguments:
+        stride {int} -- Keeps every stride-th row and column of the image (default: {1})
+
+    Returns:
+        ndarray -- (ceil(H / stride), ceil(W / stride), 3) points, NaN where the depth is missing
+    """
+    depth = np.asarray(depth)[::stride, ::stride]
+    z = depth.astype(np.float64) * intrinsics['depth_scale']
+    z[depth <= 0] = np.nan
+    # Pixel coordinates of the kept rows and columns in the full resolution image
+    u = np.arange(0, depth.shape[1] * stride, stride, dtype=np.float64)
+    v = np.arange(0, depth.shape[0] * stride, stride, dtype=np.float64)
+    x = (u[np.newaxis, :] - intrinsics['ppx']) / intrinsics['fx'] * z
+    y = (v[:, np.newaxis] - intrinsics['ppy']) / intrinsics['fy'] * z
+    return np.stack([x, y, z], axis=2)
+
+
+def row_band_medians(values, band=16):
+    """Median of the valid (not NaN) values of every band of rows, interpolated to each row
+
+    Returns:
+        ndarray -- (H) median per row, NaN if no band has a valid value
+    """
+    num_rows = values.shape[0]
+    num_bands = -(-num_rows // band)
+    # Pads the last band with NaN so all bands reshape into rows of equal length
+    padded = np.full((num_bands * band,) + values.shape[1:], np.nan)
+    padded[:num_rows] = values
+    with warnings.catch_warnings():
+        # Bands without a valid value are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        medians = np.nanmedian(padded.reshape(num_bands, -1), axis=1)
+    centers = np.minimum(np.arange(num_bands) * band + (band - 1) / 2.0, num_rows - 1)
+    valid = ~np.isnan(medians)
+    if not valid.any():
+        return np.full(num_rows, np.nan)
+    return np.interp(np.arange(num_rows), centers[valid], medians[valid])
+
+
+def segment_organized(organized, z_thresh=.035, band=16):
+    """Segments an organized cloud like segment_points, but against the local instead of a global median
+    The ground depth changes with the image row under perspective, so each pixel is compared with the median depth
+    of its band of rows. Pixels no more than z_thresh behind that median are kept.
+
+    Arguments:
+        organized {ndarray} -- (H, W, 3) organized cloud (see deproject_depth)
+
+    Keyword Arguments:
+        z_thresh {float} -- Tolerance above the local median (default: {.035})
+        band {int} -- Rows per neighborhood (default: {16})
+
+    Returns:
+        ndarray -- (N, 3) kept points in row major order
+    """
+    z = organized[:, :, 2]
+    local_median = row_band_medians(z, band=band)
+    with np.errstate(invalid='ignore'):
+        mask = z < local_median[:, np.newaxis] + z_thresh
+    return np.ascontiguousarray(organized[mask])
+
+
+def valid_points(organized):
+    """(N, 3) points of an organized cloud with depth, in row major order"""
+    return np.ascontiguousarray(organized[~np.isnan(organized[:, :, 2])])
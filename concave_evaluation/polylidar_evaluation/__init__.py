@@ -1,56 +1,122 @@
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from os import path
 from pathlib import Path
 from shapely.geometry import Polygon, MultiPolygon
 from polylidar import extractPolygons, extractPolygonsAndTimings
 import numpy as np
-from concave_evaluation.helpers import get_poly_coords, save_shapely, modified_fname, load_polygon, evaluate_l2
+import shapely
+from concave_evaluation.helpers import SHAPELY_2, get_poly_coords, save_shapely, modified_fname, ground_truth, evaluate_l2, load_points
+from concave_evaluation.helpers.benchmark import benchmark, measuring, BENCHMARK_OPTIONS
 from concave_evaluation import DEFAULT_PL_SAVE_DIR
 
 logger = logging.getLogger("Concave")
 
 
-def convert_to_shapely_polygons(polygons, points, return_first=False):
-    """Converts a list of C++ polygon to shapely polygon
-    If more than one polygon is returned turn into a MultiPolygon
-    unless return_first is set
-    """
-    polygons.sort(key=lambda poly: len(poly.shell), reverse=True)
-    if not polygons:
-        logger.warn("No polygons returned")
-        return None
-    if len(polygons) > 1:
-        pass
-        #logger.info("More than one polygon returned")
-    shapely_polygons = []
+def polylidar_rings(polygons):
+    """Returns the vertex index arrays of every ring (shell first, then holes) and the number of rings per polygon"""
+    rings = []
+    rings_per_poly = []
     for poly in polygons:
-        shell_coords = get_poly_coords(poly.shell, points)
-        hole_coords = [get_poly_coords(hole, points) for hole in poly.holes]
-        poly_shape = Polygon(shell=shell_coords, holes=hole_coords)
-        if hole_coords:
-            pass
-            #logger.info("Holes inside the polygon")
+        rings.append(np.asarray(poly.shell, dtype=np.int64))
+        rings.extend([np.asarray(hole, dtype=np.int64) for hole in poly.holes])
+        rings_per_poly.append(len(poly.holes) + 1)
+    return rings, rings_per_poly
+
+
+def create_shapely_polygons(polygons, points, is_3D=False):
+    """Creates shapely polygons from polylidar polygons
+    Ring coordinates are gathered with numpy fancy indexing. With shapely 2 all rings and polygons
+    are built in bulk with the vectorized constructors.
+    """
+    coords = points[:, :3] if is_3D else points[:, :2]
+    if not SHAPELY_2:
+        return [Polygon(shell=coords[np.asarray(poly.shell, dtype=np.int64)],
+                        holes=[coords[np.asarray(hole, dtype=np.int64)] for hole in poly.holes]) for poly in polygons]
+
+    rings, rings_per_poly = polylidar_rings(polygons)
+    ring_ids = np.repeat(np.arange(len(rings)), [len(ring) for ring in rings])
+    linear_rings = shapely.linearrings(coords[np.concatenate(rings)], indices=ring_ids)
+    # The first ring of each polygon is its shell, the rest are holes
+    poly_ids = np.repeat(np.arange(len(polygons)), rings_per_poly)
+    return list(shapely.polygons(linear_rings, indices=poly_ids))
+
+
+def combine_polygons(shapely_polygons, return_first=False):
+    """Drops invalid polygons and returns the largest polygon, or a MultiPolygon of all of them"""
+    valid_polygons = []
+    for poly_shape in shapely_polygons:
         if not poly_shape.is_valid:
             logger.warn("Invalid Polygon Generated by polylidar")
             continue
-        shapely_polygons.append(poly_shape)
+        valid_polygons.append(poly_shape)
 
     # Return only the largest polygon (the "best")
-    if shapely_polygons and return_first:
-        return shapely_polygons[0]
+    if valid_polygons and return_first:
+        return valid_polygons[0]
 
     # Check if a multipolygon
-    if len(shapely_polygons) == 1:
-        return shapely_polygons[0]
-    elif len(shapely_polygons) > 1:
-        return MultiPolygon(shapely_polygons)
+    if len(valid_polygons) == 1:
+        return valid_polygons[0]
+    elif len(valid_polygons) > 1:
+        return MultiPolygon(valid_polygons)
     else:
         # Whoa nothing inside!
         logger.error("No polygons returned for polylidar")
         raise ValueError("No polygons returned for polylidar")
 
-    return shapely_polygons
+
+def convert_to_shapely_polygons(polygons, points, return_first=False, is_3D=False):
+    """Converts a list of C++ polygon to shapely polygon
+    If more than one polygon is returned turn into a MultiPolygon
+    unless return_first is set
+    """
+    polygons.sort(key=lambda poly: len(poly.shell), reverse=True)
+    if not polygons:
+        logger.warn("No polygons returned")
+        return None
+    return combine_polygons(create_shapely_polygons(polygons, points, is_3D=is_3D), return_first=return_first)
+
+
+def convert_to_shapely_polygons_batch(polygon_lists, points, offsets):
+    """Converts the C++ polygons of every cloud of a batch (see get_polygons) to shapely
+    With shapely 2 the rings of all clouds are built by a single vectorized call. Clouds without a valid
+    polygon are None.
+    """
+    shapely_lists = []
+    if SHAPELY_2:
+        all_polygons, cloud_ids = [], []
+        for cloud, polygons in enumerate(polygon_lists):
+            polygons.sort(key=lambda poly: len(poly.shell), reverse=True)
+            all_polygons.extend(polygons)
+            cloud_ids.extend([cloud] * len(polygons))
+        rings, rings_per_poly = polylidar_rings(all_polygons)
+        # Ring vertex indices are local to their cloud, shift them into the concatenated points
+        ring_offsets = np.repeat(offsets[:-1][np.asarray(cloud_ids, dtype=np.int64)], rings_per_poly)
+        created = []
+        if rings:
+            ring_ids = np.repeat(np.arange(len(rings)), [len(ring) for ring in rings])
+            vertices = np.concatenate(rings) + np.repeat(ring_offsets, [len(ring) for ring in rings])
+            linear_rings = shapely.linearrings(points[vertices, :2], indices=ring_ids)
+            created = list(shapely.polygons(linear_rings, indices=np.repeat(np.arange(len(all_polygons)), rings_per_poly)))
+        bounds = np.r_[0, np.cumsum([len(polygons) for polygons in polygon_lists])]
+        shapely_lists = [created[bounds[i]:bounds[i + 1]] for i in range(len(polygon_lists))]
+    else:
+        for cloud, polygons in enumerate(polygon_lists):
+            polygons.sort(key=lambda poly: len(poly.shell), reverse=True)
+            shapely_lists.append(create_shapely_polygons(polygons, points[offsets[cloud]:offsets[cloud + 1]]))
+
+    results = np.empty(len(polygon_lists), dtype=object)
+    for cloud, shapely_polygons in enumerate(shapely_lists):
+        if not shapely_polygons:
+            logger.warn("No polygons returned")
+            continue
+        try:
+            results[cloud] = combine_polygons(shapely_polygons)
+        except ValueError:
+            pass
+    return results
 
 
 def get_polygon(points, noise=2.0, alpha=0.0, xyThresh=0.0, add_noise=False, **kwargs):
@@ -68,20 +134,83 @@ def get_polygon(points, noise=2.0, alpha=0.0, xyThresh=0.0, add_noise=False, **k
     return polygons, timings
 
 
-def run_test(point_fpath, save_dir=DEFAULT_PL_SAVE_DIR, n=1, alpha=0.0, xyThresh=10, save_poly=True, gt_fpath=None, **kwargs):
+def get_polygons(points, offsets, alpha=0.0, xyThresh=0.0, n=1, workers=0, add_noise=False, noise=2.0, **kwargs):
+    """Runs polylidar on a ragged batch of point clouds
+
+    Arguments:
+        points {ndarray} -- (N, 2) point clouds concatenated along the first axis
+        offsets {ndarray} -- (M + 1) row offsets, cloud i is points[offsets[i]:offsets[i + 1]]
+
+    Keyword Arguments:
+        alpha {float|ndarray} -- Alpha of every cloud or (M) alphas (default: {0.0})
+        xyThresh {float|ndarray} -- xyThresh of every cloud or (M) thresholds, only used where alpha is 0 (default: {0.0})
+        n {int} -- Timed calls per cloud, the minimum in adaptive mode (default: {1})
+        workers {int} -- Threads running the clouds, 0 runs them back to back. Only faster when polylidar
+                         releases the GIL (default: {0})
+        add_noise {bool} -- Adds fresh gaussian noise to x and y of a cloud before every (untimed) call, the
+                            polygon is built from the noisy cloud of the last call (default: {False})
+        noise {float} -- Standard deviation of the noise (default: {2.0})
+
+    Returns:
+        Tuple[ndarray, ndarray] -- (M) polygons (None where polylidar found no valid polygon) and (M, R, S) sub
+                                   timings (ms) of R calls, NaN padded if the clouds were repeated a different
+                                   number of times
+    """
+    if kwargs:
+        logger.warning("Ignoring options %r not supported by polylidar", sorted(kwargs))
+    points = np.ascontiguousarray(points)
+    # Noisy copy of the clouds as passed to polylidar by the last call, the polygons index into it
+    noisy_points = np.array(points, dtype=np.float64) if add_noise else None
+    offsets = np.asarray(offsets, dtype=np.int64)
+    num_clouds = offsets.size - 1
+    alphas = np.broadcast_to(np.asarray(alpha, dtype=np.float64), (num_clouds,))
     # Choose alpha parameter or xyThresh
-    if alpha > 0:
-        xyThresh = 0.0
+    xy_threshs = np.where(alphas > 0, 0.0, np.broadcast_to(np.asarray(xyThresh, dtype=np.float64), (num_clouds,)))
+    # Pinning and garbage collection are process wide, with threads they are applied once around the whole pool
+    bench_options = dict(core=None, disable_gc=False) if workers > 0 else dict()
+
+    def run_cloud(i):
+        cloud = points[offsets[i]:offsets[i + 1]]
+        polylidar_kwargs = dict(alpha=float(alphas[i]), xyThresh=float(xy_threshs[i]))
+
+        def call():
+            cloud_ = cloud
+            if add_noise:
+                cloud_ = noisy_points[offsets[i]:offsets[i + 1]]
+                cloud_[:, :2] = cloud[:, :2] + np.random.randn(cloud.shape[0], 2) * noise
+            return extractPolygonsAndTimings(cloud_, **polylidar_kwargs)
+        # Only polylidar is repeated and timed, clouds are converted to shapely once for the whole batch
+        return benchmark(call, n=n, internal=True, **bench_options)
+
+    if workers > 0:
+        with measuring(None, BENCHMARK_OPTIONS['disable_gc']), ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_cloud, range(num_clouds)))
+    else:
+        results = [run_cloud(i) for i in range(num_clouds)]
+
+    polygons = convert_to_shapely_polygons_batch([result for result, _ in results],
+                                                 points if noisy_points is None else noisy_points, offsets)
+    repeats = max([len(cloud_timings) for _, cloud_timings in results], default=0)
+    sections = max([len(timing) for _, cloud_timings in results for timing in cloud_timings], default=0)
+    timings = np.full((num_clouds, repeats, sections), np.nan)
+    for i, (_, cloud_timings) in enumerate(results):
+        for j, timing in enumerate(cloud_timings):
+            timings[i, j, :len(timing)] = timing
+    return polygons, timings
+
+
+def run_test(point_fpath, save_dir=DEFAULT_PL_SAVE_DIR, n=1, alpha=0.0, xyThresh=10, save_poly=True, gt_fpath=None, **kwargs):
     # If we already passed in a numpy array, no need to load from file
     if isinstance(point_fpath, np.ndarray):
         points = point_fpath
     else:
-        points = np.loadtxt(point_fpath)
-    time_ms = []
-    for i in range(n):
-        polygons, ms = get_polygon(
-            points, alpha=alpha, xyThresh=xyThresh, **kwargs)
-        time_ms.append(ms)
+        points = load_points(point_fpath)
+    # A batch of one cloud, polylidar reports its own sub timings (delaunay, mesh, polygon) of every call
+    polygons, timings = get_polygons(points, [0, points.shape[0]], alpha=alpha, xyThresh=xyThresh, n=n, **kwargs)
+    polygons = polygons[0]
+    if polygons is None:
+        raise ValueError("No polygons returned for polylidar")
+    time_ms = timings[0].tolist()
 
     if save_poly:
         save_fname, _ = path.join(save_dir, save_poly + '.geojson'), None if isinstance(save_poly,
@@ -90,12 +219,8 @@ def run_test(point_fpath, save_dir=DEFAULT_PL_SAVE_DIR, n=1, alpha=0.0, xyThresh
 
     l2_norm = np.NaN
     # Evaluate L2 Norm if we have the ground truth data
-    # if the path is a string (nominal) then load the polygon
-    if isinstance(gt_fpath, str):
-        gt_shape, _ = load_polygon(gt_fpath)
-        l2_norm = evaluate_l2(gt_shape, polygons)
-    elif gt_fpath is not None:
-        gt_shape = gt_fpath
-        l2_norm = evaluate_l2(gt_shape, polygons)
+    # gt_fpath may be a geojson path (parsed once per process), a polygon or a GroundTruth
+    if gt_fpath is not None:
+        l2_norm = evaluate_l2(ground_truth(gt_fpath), polygons)
 
     return polygons, time_ms, l2_norm
@@ -0,0 +1,136 @@
+"""Parameter sweeps over a single Delaunay triangulation
+The alpha shape of a point set for alpha is the union of the Delaunay triangles whose circumradius is below alpha.
+Triangles are therefore triangulated (and intersected with the ground truth) once and sorted by circumradius, the
+area, accuracy and boundary size of every alpha then follow from cumulative sums and binary searches.
+
+The same holds for the spatialite concave hull, which drops triangles with an edge longer than
+mean + factor * std of the Delaunay edge lengths, so its factor is swept from the longest edge of each triangle.
+Note that polylidar additionally filters regions by minTriangles, the curves are those of the plain alpha shape.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import Polygon
+from polylidar import extractPlanesAndPolygons
+
+from concave_evaluation.helpers import SHAPELY_2, ground_truth
+
+logger = logging.getLogger("Concave")
+
+
+def delaunay_triangles(points):
+    """Returns the (T, 3) vertex indices of the Delaunay triangulation of points (polylidar)"""
+    delaunay, _, _ = extractPlanesAndPolygons(np.ascontiguousarray(points[:, :2]), alpha=0.0, xyThresh=0.0)
+    return np.asarray(delaunay.triangles, dtype=np.int64).reshape(-1, 3)
+
+
+def triangle_polygons(coords):
+    """Shapely triangles of a (T, 3, 2) coordinate array"""
+    if SHAPELY_2:
+        return shapely.polygons(np.concatenate([coords, coords[:, :1]], axis=1))
+    return [Polygon(triangle) for triangle in coords]
+
+
+class TriangleSweep(object):
+    def __init__(self, points, gt, triangles=None):
+        """Triangulates points once and evaluates alpha shapes of any parameter against a ground truth
+
+        Arguments:
+            points {ndarray} -- (N, 2) points, further columns are ignored
+            gt {str|Polygon|GroundTruth} -- Ground truth geojson path or shape
+
+        Keyword Arguments:
+            triangles {ndarray} -- (T, 3) triangulation of points, polylidar's Delaunay triangulation if None (default: {None})
+        """
+        points = np.asarray(points)[:, :2]
+        self.gt = ground_truth(gt)
+        self.triangles = delaunay_triangles(points) if triangles is None else np.asarray(triangles, dtype=np.int64)
+        coords = points[self.triangles]
+        a = np.linalg.norm(coords[:, 1] - coords[:, 2], axis=1)
+        b = np.linalg.norm(coords[:, 0] - coords[:, 2], axis=1)
+        c = np.linalg.norm(coords[:, 0] - coords[:, 1], axis=1)
+        self.edge_lengths = np.stack([a, b, c], axis=1)
+        ab, ac = coords[:, 1] - coords[:, 0], coords[:, 2] - coords[:, 0]
+        self.areas = np.abs(ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0]) / 2.0
+        with np.errstate(divide='ignore'):
+            # R = abc / 4K, degenerate (zero area) triangles never belong to an alpha shape
+            self.circumradius = np.where(self.areas > 0, a * b * c / (4.0 * self.areas), np.inf)
+        self.gt_areas = self.gt.intersection_areas(triangle_polygons(coords))
+        self.edge_ids = self.unique_edges()
+        # Spatialite thresholds on the statistics of the unique Delaunay edges
+        unique_lengths = np.zeros(self.edge_ids.max() + 1)
+        unique_lengths[self.edge_ids.ravel()] = self.edge_lengths.ravel()
+        self.edge_mean, self.edge_std = unique_lengths.mean(), unique_lengths.std()
+
+    def unique_edges(self):
+        """Returns the (T, 3) ids of the unique edge opposite to each vertex of every triangle"""
+        tri = self.triangles
+        start = np.stack([tri[:, 1], tri[:, 0], tri[:, 0]], axis=1).ravel()
+        end = np.stack([tri[:, 2], tri[:, 2], tri[:, 1]], axis=1).ravel()
+        codes = np.minimum(start, end) * (tri.max() + 1) + np.maximum(start, end)
+        _, edge_ids = np.unique(codes, return_inverse=True)
+        return edge_ids.reshape(-1, 3)
+
+    def edge_intervals(self, keys):
+        """An edge is on the boundary while exactly one of its triangles is kept, i.e. for thresholds in (low, high]
+        where low and high are the smaller and larger key of its (one or two) triangles
+        """
+        edge_ids = self.edge_ids.ravel()
+        edge_keys = np.repeat(keys, 3)
+        order = np.lexsort((edge_keys, edge_ids))
+        edge_ids, edge_keys = edge_ids[order], edge_keys[order]
+        first = np.flatnonzero(np.r_[True, edge_ids[1:] != edge_ids[:-1]])
+        counts = np.diff(np.r_[first, edge_ids.size])
+        low = edge_keys[first]
+        high = np.where(counts > 1, edge_keys[np.minimum(first + 1, edge_keys.size - 1)], np.inf)
+        return np.sort(low), np.sort(high)
+
+    def curve(self, keys, thresholds):
+        """Evaluates the shapes made of the triangles with key < threshold for every threshold
+
+        Returns:
+            dict -- Arrays of triangles, area, l2, iou and boundary_edges per threshold
+        """
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        order = np.argsort(keys)
+        sorted_keys = keys[order]
+        area = np.r_[0.0, np.cumsum(self.areas[order])]
+        gt_area = np.r_[0.0, np.cumsum(self.gt_areas[order])]
+        num_triangles = np.searchsorted(sorted_keys, thresholds, side='left')
+        area, intersection = area[num_triangles], gt_area[num_triangles]
+        low, high = self.edge_intervals(keys)
+        boundary_edges = np.searchsorted(low, thresholds, side='left') - np.searchsorted(high, thresholds, side='left')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            l2 = (self.gt.area + area - 2.0 * intersection) / area
+            iou = intersection / (self.gt.area + area - intersection)
+        return dict(triangles=num_triangles, area=area, l2=l2, iou=iou, boundary_edges=boundary_edges)
+
+    def alpha_curve(self, alphas):
+        """Accuracy of the alpha shape (circumradius < alpha) for every alpha"""
+        df = pd.DataFrame(self.curve(self.circumradius, alphas))
+        df.insert(0, 'alpha', alphas)
+        # Comparable to the PostGIS target_percent
+        df['hull_percent'] = df['area'] / self.gt.convex_hull.area
+        return df
+
+    def factor_curve(self, factors):
+        """Accuracy of the spatialite concave hull (longest edge <= mean + factor * std) for every factor"""
+        factors = np.asarray(factors, dtype=np.float64)
+        thresholds = self.edge_mean + factors * self.edge_std
+        # Kept if the longest edge is <= threshold, nextafter turns the strict comparison of curve inclusive
+        df = pd.DataFrame(self.curve(self.edge_lengths.max(axis=1), np.nextafter(thresholds, np.inf)))
+        df.insert(0, 'factor', factors)
+        return df
+
+
+def sweep_alpha(points, gt, alphas, factors=None):
+    """Accuracy vs alpha (and optionally spatialite factor) curves of a point set from one triangulation
+
+    Returns:
+        Tuple[DataFrame, DataFrame] -- The alpha curve and the factor curve (None without factors)
+    """
+    sweep = TriangleSweep(points, gt)
+    factor_df = sweep.factor_curve(factors) if factors is not None else None
+    return sweep.alpha_curve(alphas), factor_df
@@ -0,0 +1,173 @@
+"""Out of core alpha shapes of point clouds larger than RAM
+The bounding box of a (memory mapped) cloud is split into a grid of tiles. Every tile triangulates its own points
+plus a halo of the points within alpha of it, and keeps the triangles of circumradius < alpha whose circumcenter
+lies inside the tile. The circumdisk of such a triangle lies within alpha of the tile, so it is empty of all points
+if and only if it is empty of the tile's points: the tile keeps exactly the alpha shape triangles it owns, and
+every triangle of the monolithic alpha shape is owned by exactly one tile.
+
+Tiles only return the boundary edges (global point indices) of their triangles. An edge between triangles of two
+tiles is a boundary edge of both and cancels when the tiles are merged, the remaining edges are polygonized into
+one polygon with holes. Points are assumed to be in general position (no four cocircular points on a tile border).
+"""
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from concave_evaluation.helpers import load_points, edges_to_polygon
+from concave_evaluation.polylidar_evaluation.sweep import delaunay_triangles
+
+logger = logging.getLogger("Concave")
+
+# The halo is slightly wider than alpha so rounding never drops a point of a circumdisk
+HALO_MARGIN = 1.05
+CHUNK_SIZE = 1 << 22
+
+
+def as_points(points):
+    """Memory maps a point fixture path, arrays are returned as is"""
+    return points if isinstance(points, np.ndarray) else load_points(points)
+
+
+def point_bounds(points, chunk_size=CHUNK_SIZE):
+    """(min x, min y, max x, max y) of a cloud, read in chunks"""
+    lows, highs = [], []
+    for start in range(0, points.shape[0], chunk_size):
+        chunk = np.asarray(points[start:start + chunk_size, :2])
+        lows.append(chunk.min(axis=0))
+        highs.append(chunk.max(axis=0))
+    return np.r_[np.min(lows, axis=0), np.max(highs, axis=0)]
+
+
+def tile_edges(bounds, tiles):
+    """Tile borders along x and y, the outer borders are infinite so every circumcenter has a tile"""
+    x_edges = np.linspace(bounds[0], bounds[2], tiles[0] + 1)
+    y_edges = np.linspace(bounds[1], bounds[3], tiles[1] + 1)
+    x_edges[[0, -1]], y_edges[[0, -1]] = [-np.inf, np.inf], [-np.inf, np.inf]
+    return x_edges, y_edges
+
+
+def select_points(points, low, high, chunk_size=CHUNK_SIZE):
+    """Global indices of the points inside the box [low, high], read in chunks"""
+    indices = []
+    for start in range(0, points.shape[0], chunk_size):
+        chunk = np.asarray(points[start:start + chunk_size, :2])
+        mask = np.all((chunk >= low) & (chunk <= high), axis=1)
+        indices.append(np.flatnonzero(mask) + start)
+    return np.concatenate(indices) if indices else np.empty(0, dtype=np.int64)
+
+
+def circumcircles(coords):
+    """Circumcenters and circumradii of a (T, 3, 2) coordinate array, degenerate triangles have an infinite radius"""
+    b, c = coords[:, 1] - coords[:, 0], coords[:, 2] - coords[:, 0]
+    d = 2.0 * (b[:, 0] * c[:, 1] - b[:, 1] * c[:, 0])
+    b_sq, c_sq = (b ** 2).sum(axis=1), (c ** 2).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = np.stack([(c[:, 1] * b_sq - b[:, 1] * c_sq) / d, (b[:, 0] * c_sq - c[:, 0] * b_sq) / d], axis=1)
+    radius = np.where(d != 0, np.linalg.norm(u, axis=1), np.inf)
+    return coords[:, 0] + u, radius
+
+
+def boundary_edges(triangles):
+    """Edges (sorted vertex pairs) belonging to exactly one of the triangles"""
+    edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    return cancel_edges(edges)
+
+
+def cancel_edges(edges):
+    """Removes every edge that occurs more than once, edges are (K, 2) vertex pairs in any orientation"""
+    edges = np.sort(edges, axis=1)
+    unique, counts = np.unique(edges, axis=0, return_counts=True)
+    return unique[counts == 1]
+
+
+def tile_boundary_edges(points, alpha, x_edges, y_edges, tile, chunk_size=CHUNK_SIZE):
+    """Boundary edges (global point indices) of the alpha shape triangles owned by a tile
+
+    Arguments:
+        points {str|ndarray} -- Point fixture path (memory mapped) or (N, 2+) array
+        alpha {float} -- Triangles of circumradius < alpha form the shape
+        x_edges {ndarray} -- Tile borders along x
+        y_edges {ndarray} -- Tile borders along y
+        tile {Tuple[int, int]} -- Column and row of the tile
+
+    Returns:
+        ndarray -- (K, 2) global point indices
+    """
+    points = as_points(points)
+    i, j = tile
+    low, high = np.array([x_edges[i], y_edges[j]]), np.array([x_edges[i + 1], y_edges[j + 1]])
+    halo = HALO_MARGIN * alpha
+    indices = select_points(points, low - halo, high + halo, chunk_size)
+    if indices.size < 3:
+        return np.empty((0, 2), dtype=np.int64)
+    local_points = np.ascontiguousarray(points[indices, :2], dtype=np.float64)
+    triangles = delaunay_triangles(local_points)
+    centers, radius = circumcircles(local_points[triangles])
+    # Half open ownership, a circumcenter on a border belongs to the tile above / right of it
+    owned = (radius < alpha) & np.all((centers >= low) & (centers < high), axis=1)
+    return indices[boundary_edges(triangles[owned])]
+
+
+def run_tile(args):
+    return tile_boundary_edges(*args)
+
+
+def tiled_boundary_edges(points, alpha, tiles=(4, 4), workers=0, chunk_size=CHUNK_SIZE):
+    """Boundary edges (global point indices) of the alpha shape of a cloud computed tile by tile
+
+    Arguments:
+        points {str|ndarray} -- Point fixture path or array, workers memory map a path themselves
+        alpha {float} -- Triangles of circumradius < alpha form the shape
+
+    Keyword Arguments:
+        tiles {Tuple[int, int]} -- Number of tiles along x and y (default: {(4, 4)})
+        workers {int} -- Processes computing tiles, 0 runs them serially (default: {0})
+        chunk_size {int} -- Points read at once when scanning the cloud (default: {CHUNK_SIZE})
+
+    Returns:
+        ndarray -- (K, 2) global point indices
+    """
+    bounds = point_bounds(as_points(points), chunk_size)
+    x_edges, y_edges = tile_edges(bounds, tiles)
+    tasks = [(points, alpha, x_edges, y_edges, (i, j), chunk_size) for i in range(tiles[0]) for j in range(tiles[1])]
+    if workers > 0:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            edge_lists = list(executor.map(run_tile, tasks))
+    else:
+        edge_lists = [run_tile(task) for task in tasks]
+    # An edge between triangles of two tiles was returned by both
+    edges = cancel_edges(np.concatenate(edge_lists))
+    logger.debug("Merged %d boundary edges of %d tiles", edges.shape[0], len(tasks))
+    return edges
+
+
+def edge_coordinates(points, edges):
+    """(K, 4) coordinates (x0, y0, x1, y1) of vertex index pairs, gathered in sorted order from a memory map"""
+    vertices, inverse = np.unique(edges, return_inverse=True)
+    coords = np.asarray(points[vertices, :2], dtype=np.float64)[inverse.reshape(-1)]
+    return coords.reshape(-1, 4)
+
+
+def tiled_concave_hull(points, alpha, tiles=(4, 4), workers=0, chunk_size=CHUNK_SIZE):
+    """Alpha shape of a cloud (see tiled_boundary_edges) as one (Multi)Polygon with holes"""
+    edges = tiled_boundary_edges(points, alpha, tiles=tiles, workers=workers, chunk_size=chunk_size)
+    return edges_to_polygon(edge_coordinates(as_points(points), edges))
+
+
+def check_tiled(points, alpha, tiles=(4, 4), workers=0, rel_tol=1e-9):
+    """Compares the tiled alpha shape with the monolithic one (a single tile), meant for small clouds
+
+    Returns:
+        dict -- Number of boundary edges of both, the number of differing edges, the area of their symmetric
+                difference relative to the monolithic area and whether they match
+    """
+    points = as_points(points)
+    tiled_edges = tiled_boundary_edges(points, alpha, tiles=tiles, workers=workers)
+    mono_edges = tiled_boundary_edges(points, alpha, tiles=(1, 1))
+    differing = cancel_edges(np.concatenate([tiled_edges, mono_edges])).shape[0]
+    tiled_poly = edges_to_polygon(edge_coordinates(points, tiled_edges))
+    mono_poly = edges_to_polygon(edge_coordinates(points, mono_edges))
+    rel_area = tiled_poly.symmetric_difference(mono_poly).area / mono_poly.area if mono_poly.area > 0 else 0.0
+    return dict(tiled_edges=tiled_edges.shape[0], monolithic_edges=mono_edges.shape[0], differing_edges=differing,
+                rel_area_difference=rel_area, match=differing == 0 and rel_area <= rel_tol)
@@ -1,16 +1,21 @@
 
-import time
 from os import path
 import sqlite3
 import sys
+import atexit
+import weakref
+import logging
+from contextlib import contextmanager
 
 import numpy as np
 from shapely.geometry import asMultiPoint, asPoint, MultiPolygon
 from shapely.wkb import dumps, loads
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 
-from concave_evaluation.helpers import save_shapely, modified_fname, load_polygon, evaluate_l2
+from concave_evaluation.helpers import save_shapely, modified_fname, ground_truth, evaluate_l2, load_points
+from concave_evaluation.helpers.benchmark import benchmark
 from concave_evaluation import (DEFAULT_TEST_FILE, DEFAULT_PG_SAVE_DIR, DEFAULT_PG_CONN)
 
 INIT_TABLE = """
@@ -22,6 +27,17 @@ CREATE TABLE concave (
 
 """
 
+# Session tables are temporary, private to a connection (safe for parallel workers) and shadow public.concave
+INIT_TEMP_TABLE = """
+CREATE TEMP TABLE IF NOT EXISTS concave (
+    ID SERIAL PRIMARY KEY,
+    test_name TEXT, Geometry geometry(MultiPoint, 0) );
+"""
+
+CLEAR_TABLE = "TRUNCATE concave;"
+
+logger = logging.getLogger("Concave")
+
 
 def insert_multipoint(connection, points, test_name='test'):
     multipoint = asMultiPoint(points)
@@ -47,20 +63,16 @@ def extract_concave_hull(connection, test_name, n=1, target_percent=1.0):
     FROM concave
     WHERE test_name = %s
     """
-    # Start Timing here
-    timings = []
     with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-        for i in range(n):
-            try:
-                t0 = time.time()
-                cursor.execute(query, (target_percent, test_name))
-                result = cursor.fetchone()
-                t1 = time.time()
-                time_ms = (t1 - t0) * 1000
-                timings.append(time_ms)
-            except Exception as e:
-                print("POSTGIS error", e)
-                return None, [np.NaN]
+        # Only the query and fetching its result are timed
+        def execute():
+            cursor.execute(query, (target_percent, test_name))
+            return cursor.fetchone()
+        try:
+            result, timings = benchmark(execute, n=n)
+        except Exception as e:
+            print("POSTGIS error", e)
+            return None, [np.NaN]
     # load the actual polygon into a shapely geometry, not timed
     # print("Size of Polygon:", sys.getsizeof(result['polygon']))
     final_geometry = loads(result['polygon'], hex=True)
@@ -76,6 +88,39 @@ def extract_concave_hull(connection, test_name, n=1, target_percent=1.0):
     return final_geometry, timings
 
 
+def measure_latency(connection, n=10):
+    """Median client round trip (ms) of a trivial query, the cost paid by every query regardless of work"""
+    with connection.cursor() as cursor:
+        def execute():
+            cursor.execute("SELECT 1")
+            return cursor.fetchone()
+        _, timings = benchmark(execute, n=n)
+    return float(np.median(timings))
+
+
+def latency_split(connection, test_name, target_percent=1.0, n=1):
+    """Splits the client side concave hull timing into server execution and client/transfer overhead
+    Server execution time is taken from EXPLAIN ANALYZE, the client time from the normal timed query.
+    """
+    _, client_timings = extract_concave_hull(connection, test_name, n=n, target_percent=target_percent)
+    query = """
+    EXPLAIN (ANALYZE, FORMAT JSON)
+    SELECT ST_ConcaveHull(Geometry, %s, true) as polygon
+    FROM concave
+    WHERE test_name = %s
+    """
+    server_timings = []
+    with connection.cursor() as cursor:
+        for i in range(n):
+            cursor.execute(query, (target_percent, test_name))
+            plan = cursor.fetchone()[0][0]
+            server_timings.append(plan['Execution Time'])
+    client_ms = float(np.median(client_timings))
+    server_ms = float(np.median(server_timings))
+    return dict(client_ms=client_ms, server_ms=server_ms, overhead_ms=client_ms - server_ms,
+                latency_ms=measure_latency(connection))
+
+
 class DBConnPostGIS(object):
     def __init__(self, db_path=DEFAULT_PG_CONN):
         """ Sets up Database connection to postgis"""
@@ -84,6 +129,67 @@ class DBConnPostGIS(object):
         self.cursor = self.conn.cursor()
         self.cursor.execute(INIT_TABLE)
 
+    def close(self):
+        self.cursor.close()
+        self.conn.close()
+
+
+class PostGISPool(object):
+    def __init__(self, db_path=DEFAULT_PG_CONN, maxconn=4):
+        """Pool of PostGIS connections, each with its own session table created only once"""
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, maxconn, db_path)
+        # Held weakly, so a connection closed by the pool can never be mistaken for a new one
+        self.initialized = weakref.WeakSet()
+
+    @contextmanager
+    def session(self):
+        """Yields a connection with an empty concave table, rows are truncated when the session ends"""
+        conn = self.pool.getconn()
+        broken = False
+        try:
+            if conn not in self.initialized:
+                with conn.cursor() as cursor:
+                    cursor.execute(INIT_TEMP_TABLE)
+                conn.commit()
+                self.initialized.add(conn)
+            yield conn
+        finally:
+            try:
+                # A failed query leaves the transaction aborted, reset before clearing
+                conn.rollback()
+                with conn.cursor() as cursor:
+                    cursor.execute(CLEAR_TABLE)
+                conn.commit()
+            except psycopg2.Error:
+                logger.exception("Discarding broken PostGIS connection")
+                self.initialized.discard(conn)
+                broken = True
+            self.pool.putconn(conn, close=broken)
+
+    def close(self):
+        if not self.pool.closed:
+            self.pool.closeall()
+
+
+_POOLS = dict()
+
+
+def get_postgis_pool(db_path=DEFAULT_PG_CONN):
+    """Returns the connection pool of this process for db_path, created on first use"""
+    if db_path not in _POOLS:
+        _POOLS[db_path] = PostGISPool(db_path)
+        atexit.register(_POOLS[db_path].close)
+    return _POOLS[db_path]
+
+
+def library_versions(db_path=DEFAULT_PG_CONN):
+    """Versions of PostgreSQL and PostGIS (including its GEOS) of the server"""
+    with get_postgis_pool(db_path).session() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT version(), postgis_full_version()")
+            postgres, postgis = cursor.fetchone()
+    return dict(postgres=postgres, postgis=postgis)
+
 
 def run_test(point_fpath, save_dir=DEFAULT_PG_SAVE_DIR, db_path=DEFAULT_PG_CONN, n=1,
              target_percent=0.90, save_poly=True, gt_fpath=None, **kwargs):
@@ -91,14 +197,13 @@ def run_test(point_fpath, save_dir=DEFAULT_PG_SAVE_DIR, db_path=DEFAULT_PG_CONN,
         points = point_fpath
         point_fpath = path.join(save_dir, 'temp_points.csv')
     else:
-        points = np.loadtxt(point_fpath)
-    db = DBConnPostGIS(db_path)
-
+        points = load_points(point_fpath)
     save_fname, test_name = modified_fname(point_fpath, save_dir)
-    insert_multipoint(db.conn, points, test_name=test_name)
+    with get_postgis_pool(db_path).session() as conn:
+        insert_multipoint(conn, points, test_name=test_name)
 
-    polygon, timings = extract_concave_hull(
-        db.conn, test_name, target_percent=target_percent, n=n)
+        polygon, timings = extract_concave_hull(
+            conn, test_name, target_percent=target_percent, n=n)
     if save_poly:
         save_fname, _ = path.join(save_dir, save_poly + '.geojson'), None if isinstance(save_poly,
                                                                                         str) else modified_fname(point_fpath, save_dir)
@@ -108,12 +213,8 @@ def run_test(point_fpath, save_dir=DEFAULT_PG_SAVE_DIR, db_path=DEFAULT_PG_CONN,
 
     if polygon is not None:
         # Evaluate L2 Norm if we have the ground truth data
-        # if the path is a string (nominal) then load the polygon
-        if isinstance(gt_fpath, str):
-            gt_shape, _ = load_polygon(gt_fpath)
-            l2_norm = evaluate_l2(gt_shape, polygon)
-        elif gt_fpath is not None:
-            gt_shape = gt_fpath
-            l2_norm = evaluate_l2(gt_shape, polygon)
+        # gt_fpath may be a geojson path (parsed once per process), a polygon or a GroundTruth
+        if gt_fpath is not None:
+            l2_norm = evaluate_l2(ground_truth(gt_fpath), polygon)
 
     return polygon, timings, l2_norm
@@ -0,0 +1,182 @@
+"""Incremental, resumable storage of benchmark records
+Records are appended to a CSV file every few records instead of being held in memory until the end of a sweep.
+Every record is keyed by (dataset, polygon index, algorithm, parameter hash). Once the records of a job are synced
+to disk its key is appended to a completion file next to the CSV (<csv>.done), so a job whose records were only
+partially written (e.g. the process was killed mid flush) is never mistaken for a finished one. Reopening the file
+with resume drops such partial records and loads the completed keys so a rerun skips finished work.
+
+The CSV holds the key columns first, followed by the columns of the records (see create_records). A record with a
+column missing from the header (e.g. an algorithm reporting extra metrics) extends the header, earlier rows leave
+the column empty.
+"""
+import os
+import csv
+import json
+import hashlib
+import logging
+from os import path
+
+import pandas as pd
+
+logger = logging.getLogger("Concave")
+
+KEY_COLUMNS = ['dataset', 'poly_idx', 'alg', 'params_hash']
+
+
+def params_hash(params):
+    """Short stable hash of a (json serializable) parameter dictionary"""
+    text = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+class CheckpointWriter(object):
+    def __init__(self, fpath, resume=False, flush_every=100):
+        """Append only CSV writer of benchmark records
+
+        Arguments:
+            fpath {str} -- CSV file path
+
+        Keyword Arguments:
+            resume {bool} -- Keep the records of an existing file and skip its completed keys,
+                             else an existing file is replaced (default: {False})
+            flush_every {int} -- Number of buffered records that triggers a write (default: {100})
+        """
+        self.fpath = fpath
+        self.done_fpath = fpath + '.done'
+        self.flush_every = flush_every
+        self.buffer = []
+        self.buffer_keys = []
+        self.columns = None
+        self.completed = set()
+        # Records already in the file when it was opened, later ones were written by this session
+        self.num_resumed = 0
+        if resume and (path.exists(fpath) or path.exists(self.done_fpath)):
+            self.load_completed()
+        else:
+            for fpath_ in [fpath, self.done_fpath]:
+                if path.exists(fpath_):
+                    os.remove(fpath_)
+
+    def load_completed(self):
+        """Loads the completed keys and drops the records of jobs that never completed"""
+        df = pd.DataFrame(columns=KEY_COLUMNS)
+        # Missing or empty if no job wrote records (yet)
+        if path.exists(self.fpath) and drop_partial_line(self.fpath) > 0:
+            df = pd.read_csv(self.fpath, on_bad_lines='skip', dtype={'dataset': str, 'params_hash': str})
+            missing = [column for column in KEY_COLUMNS if column not in df.columns]
+            if missing:
+                raise ValueError("Can not resume {}, it is missing the key columns {}".format(self.fpath, missing))
+            self.columns = list(df.columns)
+        if path.exists(self.done_fpath):
+            drop_partial_line(self.done_fpath)
+            done = pd.read_csv(self.done_fpath, names=KEY_COLUMNS, dtype={'dataset': str, 'params_hash': str})
+            self.completed = set(done.itertuples(index=False, name=None))
+        else:
+            # Written before completion files existed, every job with records is assumed complete
+            logger.warning("No completion file for %r, treating every job with records as complete", self.fpath)
+            self.completed = set(df[KEY_COLUMNS].itertuples(index=False, name=None))
+        keep = [key in self.completed for key in df[KEY_COLUMNS].itertuples(index=False, name=None)]
+        if not all(keep):
+            logger.warning("Dropping %d records of unfinished jobs from %r", len(keep) - sum(keep), self.fpath)
+            tmp_fpath = self.fpath + '.tmp'
+            df[keep].to_csv(tmp_fpath, index=False)
+            os.replace(tmp_fpath, self.fpath)
+        self.num_resumed = int(sum(keep))
+        logger.info("Resuming %r, %d completed jobs", self.fpath, len(self.completed))
+
+    def is_done(self, dataset, poly_idx, alg, params_hash):
+        return (dataset, poly_idx, alg, params_hash) in self.completed
+
+    def write(self, records, dataset, poly_idx, params_hash, algs=None):
+        """Buffers the records of one finished job
+
+        Arguments:
+            records {List[dict]} -- Records of the job, may be empty
+            dataset {str} -- Dataset of the job
+            poly_idx {int} -- Polygon index of the job
+            params_hash {str} -- Parameter hash of the job
+
+        Keyword Arguments:
+            algs {List[str]} -- Algorithms the job ran, marked complete even without records. Taken from the
+                                'alg' of the records if None (default: {None})
+        """
+        algs = sorted(set(record['alg'] for record in records)) if algs is None else algs
+        for record in records:
+            self.buffer.append(dict(dataset=dataset, poly_idx=poly_idx, params_hash=params_hash, **record))
+        for alg in algs:
+            key = (dataset, poly_idx, alg, params_hash)
+            if key in self.completed:
+                continue
+            self.completed.add(key)
+            self.buffer_keys.append(key)
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Appends the buffered records, then marks their jobs complete once the records are on disk"""
+        if self.buffer:
+            df = pd.DataFrame.from_records(self.buffer)
+            write_header = self.columns is None
+            if write_header:
+                self.columns = KEY_COLUMNS + [column for column in df.columns if column not in KEY_COLUMNS]
+            extra = [column for column in df.columns if column not in self.columns]
+            if extra:
+                self.add_columns(extra)
+            with open(self.fpath, 'a') as f:
+                df.reindex(columns=self.columns).to_csv(f, header=write_header, index=False)
+                f.flush()
+                os.fsync(f.fileno())
+            self.buffer = []
+        if self.buffer_keys:
+            with open(self.done_fpath, 'a', newline='') as f:
+                csv.writer(f).writerows(self.buffer_keys)
+                f.flush()
+                os.fsync(f.fileno())
+            self.buffer_keys = []
+
+    def add_columns(self, columns):
+        """Rewrites the file with columns appended to its header, earlier records leave them empty"""
+        logger.info("Adding columns %r to the header of %r", columns, self.fpath)
+        # Read as text so the existing values are written back unchanged
+        df = pd.read_csv(self.fpath, dtype=str, keep_default_na=False)
+        if list(df.columns) != self.columns:
+            raise ValueError("Header of {} changed while writing, expected {}".format(self.fpath, self.columns))
+        self.columns = self.columns + list(columns)
+        tmp_fpath = self.fpath + '.tmp'
+        with open(tmp_fpath, 'w') as f:
+            df.reindex(columns=self.columns, fill_value='').to_csv(f, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_fpath, self.fpath)
+
+    def session_records(self):
+        """Records written since the file was opened, without those of resumed sessions"""
+        self.flush()
+        if self.columns is None:
+            return pd.DataFrame(columns=KEY_COLUMNS)
+        df = pd.read_csv(self.fpath, dtype={'dataset': str, 'params_hash': str})
+        return df.iloc[self.num_resumed:].reset_index(drop=True)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def drop_partial_line(fpath):
+    """Truncates a file after its last newline, removing a line cut short by an interrupted write
+
+    Returns:
+        int -- Size of the file in bytes
+    """
+    with open(fpath, 'rb+') as f:
+        data = f.read()
+        size = len(data)
+        if data and not data.endswith(b'\n'):
+            size = data.rfind(b'\n') + 1
+            f.truncate(size)
+    return size
@@ -27,9 +27,13 @@ import hvplot.pandas
 
 from concave_evaluation import DEFAULT_SHAPE_FILE, DEFAULT_SAVED_RANDOM_POLYS
 from concave_evaluation.helpers import (round_dict, measure_concavity, PythonLiteralOption, plot_poly_make_fig,
-                                        get_max_bounds_polys, plot_poly, scale_axes, load_polygon, measure_convexity_simple)
+                                        get_max_bounds_polys, plot_poly, scale_axes, load_polygon, measure_convexity_simple,
+                                        save_points, save_points_records, convert_points_file, convert_points_dir)
 from concave_evaluation.test_generation.polygen import generatePolygon
-from concave_evaluation.test_generation import random_points_within_mp, scale_poly, holes_poly, random_points_within
+from concave_evaluation.test_generation import (random_points_within_mp, scale_poly, holes_poly,
+                                                random_points_polygon_worker, DEFAULT_CHUNK_SIZE)
+from concave_evaluation.test_generation.dataset import (save_polygons_dataset, save_points_dataset, load_polygons,
+                                                        convert_pickle_dataset)
 from concave_evaluation.scripts.testrunner import evaluate
 
 logger = logging.getLogger("Concave")
@@ -96,11 +100,18 @@ def holes(input_file, output_file, number_holes, hole_radius, plot):
 #               show_default=True, help="Point Density to Generate of Polygon.")
 @click.option('-np', '--number-points', cls=PythonLiteralOption, default="[2000, 4000, 8000, 16000, 32000, 64000]", required=False,
               show_default=True, help="Number of points in polygon")           
-@click.option('-d', '--distribution', type=click.Choice(['uniform']), default='uniform')
+@click.option('-d', '--distribution', type=click.Choice(['uniform', 'triangulated']), default='uniform',
+              help="Rejection sampling (uniform) or exact area weighted sampling of a constrained triangulation (triangulated)")
 @click.option('-sd', '--save-directory', type=click.Path(exists=True), default='test_fixtures/points')
+@click.option('-f', '--file-format', type=click.Choice(['npy', 'csv']), default='npy',
+              help="Binary (memory mappable) or text point files")
+@click.option('-w', '--workers', type=int, default=4, help="Number of processes, output does not depend on it")
+@click.option('-cs', '--chunk-size', type=click.IntRange(min=1), default=DEFAULT_CHUNK_SIZE,
+              help="Points per independently seeded chunk")
+@click.option('-s', '--seed', type=int, default=0, help="Root seed of the chunk streams")
 @click.option('-p', '--plot', default=False, is_flag=True, required=False,
               help="Plot polygons")
-def points(input_file, number_points, distribution, save_directory, plot):
+def points(input_file, number_points, distribution, save_directory, file_format, workers, chunk_size, seed, plot):
     """Generates random points within the polygon provided    
     """
     fname = Path(input_file).stem
@@ -109,12 +120,16 @@ def points(input_file, number_points, distribution, save_directory, plot):
     records = []
     for num_points in number_points:
         # num_points = int(poly_area * point_density)
-        points = random_points_within_mp(poly, num_points, processes=4)
+        points = random_points_within_mp(poly, num_points, processes=workers, chunk_size=chunk_size, seed=seed,
+                                         distribution=distribution)
         record = dict(points=points, np=num_points)
         records.append(record)
-        fname_record = "{}_{}.csv".format(fname, num_points)
+        fname_record = "{}_{}.{}".format(fname, num_points, file_format)
         fpath_record = path.join(save_directory, fname_record)
-        np.savetxt(fpath_record, points)
+        if file_format == 'npy':
+            save_points(fpath_record, points)
+        else:
+            np.savetxt(fpath_record, points)
     if plot:
         for record in records:
             points = record['points']
@@ -136,11 +151,15 @@ def points(input_file, number_points, distribution, save_directory, plot):
               help="How many times to repeatedly geneate a polygon of the same parameters")
 @click.option('-p', '--plot', default=False, is_flag=True, required=False,
               help="Plot polygons")
-@click.option('-pp', '--plot-pickle', type=click.Path(exists=True), required=False)
+@click.option('-pp', '--plot-pickle', type=click.Path(exists=True), required=False,
+              help="Plot previously generated polygons (pickle or dataset)")
 @click.option('-o', '--output', type=click.Path(exists=False), default='test_fixtures/generated/polygons.pkl')
+@click.option('-f', '--file-format', type=click.Choice(['dataset', 'pkl']), default='dataset',
+              help="Chunked dataset directory (output with .ds suffix) or pickle")
 @cli.command()
 def polygon(
-        number_vertices, polygon_radius, polygon_irregularity, polygon_spikeness, repeat, plot, plot_pickle, output):
+        number_vertices, polygon_radius, polygon_irregularity, polygon_spikeness, repeat, plot, plot_pickle, output,
+        file_format):
     """Generates random polygons 
     """
     print("Arguments: ", number_vertices, polygon_radius, polygon_irregularity, polygon_spikeness)
@@ -151,7 +170,7 @@ def polygon(
     poly_params = []
     # Either generate the polygons or load them from a serialized pickle file
     if plot_pickle:
-        starting_poly_list, poly_params = pickle.load(open(plot_pickle, 'rb'))
+        starting_poly_list, poly_params = load_polygons(plot_pickle)
         plot = True
     else:
         for nv in range(*number_vertices):
@@ -168,8 +187,11 @@ def polygon(
                                 poly_params.append(poly_param)
                             except Exception:
                                 logger.exception("Could not generate polygon with these params: %r", poly_param)
-                        
-        pickle.dump((starting_poly_list, poly_params), open(output, "wb"))
+
+        if file_format == 'dataset':
+            save_polygons_dataset(output, starting_poly_list, poly_params)
+        else:
+            pickle.dump((starting_poly_list, poly_params), open(output, "wb"))
     print("Generated/Loaded {} polygons".format(len(poly_params)))
     if plot:
         map_bounds = get_max_bounds_polys(starting_poly_list)
@@ -194,30 +216,47 @@ def seed_np():
     return np.random.seed(seed)
 
 @cli.command()
-@click.option('-i', '--input-file', type=click.Path(exists=True), default=DEFAULT_SAVED_RANDOM_POLYS)
+@click.option('-i', '--input-file', type=click.Path(), default=DEFAULT_SAVED_RANDOM_POLYS,
+              help="Polygon pickle, its dataset sibling (.ds) is used if up to date")
 # @click.option('-pd', '--point-densities', cls=PythonLiteralOption, default="[0.1, 0.5, 1.0, 1.5, 2.0]", required=False,
 #               show_default=True, help="Point Density to Generate of Polygon.")
 @click.option('-np', '--number-points', cls=PythonLiteralOption, default="[2000]", required=False,
               show_default=True, help="Number of points in polygon")           
-@click.option('-d', '--distribution', type=click.Choice(['uniform']), default='uniform')
+@click.option('-d', '--distribution', type=click.Choice(['uniform', 'triangulated']), default='uniform',
+              help="Rejection sampling (uniform) or exact area weighted sampling of a constrained triangulation (triangulated)")
 @click.option('-sd', '--save-directory', type=click.Path(exists=True), default='test_fixtures/points')
+@click.option('-f', '--file-format', type=click.Choice(['dataset', 'npy', 'pkl']), default='dataset',
+              help="Chunked dataset directory, binary (memory mappable, equal sized) or pickled point records")
+@click.option('-w', '--workers', type=int, default=6, help="Number of processes, output does not depend on it")
+@click.option('-cs', '--chunk-size', type=click.IntRange(min=1), default=DEFAULT_CHUNK_SIZE,
+              help="Points per independently seeded chunk")
+@click.option('-s', '--seed', type=int, default=0, help="Root seed of the chunk streams")
 @click.option('-p', '--plot', default=False, is_flag=True, required=False,
               help="Plot polygons")
-def points_pkl(input_file, number_points, distribution, save_directory, plot):
-    """Generates random points in polygons provided by a pickle file
+def points_pkl(input_file, number_points, distribution, save_directory, file_format, workers, chunk_size, seed, plot):
+    """Generates random points in polygons provided by a pickle file or dataset
+    Polygon i with num_points points is sampled from the streams of the SeedSequence (seed, num_points, i), the
+    output does not depend on the number of workers.
     """
-    polys, poly_params = pickle.load(open(input_file, 'rb'))
+    polys, poly_params = load_polygons(input_file)
     fname = Path(input_file).stem
     records = []
     # polys = polys[:2]
     num_polys = len(polys)
 
     for num_points in number_points:
-        with mp.Pool(processes=6, initializer=seed_np, initargs=()) as pool:
-            for i, poly_points in enumerate(tqdm(pool.imap(partial(random_points_within, num_points=num_points, seed=None), polys), total=num_polys)):
+        tasks = [(poly, num_points, chunk_size, (seed, num_points, i), distribution) for i, poly in enumerate(polys)]
+        with mp.Pool(processes=max(workers, 1)) as pool:
+            for i, poly_points in enumerate(tqdm(pool.imap(random_points_polygon_worker, tasks), total=num_polys)):
                 records.append(dict(points=poly_points, poly_param=poly_params[i], np=num_points))
-        output = path.join(save_directory, "{}_{}.pkl".format(fname,num_points))
-        pickle.dump(records, open(output, "wb"))
+        suffix = 'ds' if file_format == 'dataset' else file_format
+        output = path.join(save_directory, "{}_{}.{}".format(fname, num_points, suffix))
+        if file_format == 'dataset':
+            save_points_dataset(output, records[-num_polys:])
+        elif file_format == 'npy':
+            save_points_records(output, records[-num_polys:])
+        else:
+            pickle.dump(records, open(output, "wb"))
 
 
     if plot:
@@ -230,7 +269,27 @@ def points_pkl(input_file, number_points, distribution, save_directory, plot):
 
 
 @cli.command()
-@click.option('-i', '--input-file', type=click.Path(exists=True), default=DEFAULT_SAVED_RANDOM_POLYS)
+@click.option('-i', '--input-path', type=click.Path(exists=True), default='test_fixtures/points')
+@click.option('-f', '--file-format', type=click.Choice(['npy', 'dataset']), default='npy',
+              help="Convert text and point pickles to .npy, or polygon and point pickles to datasets")
+def convert(input_path, file_format):
+    """Converts text (.csv, .txt) and pickled point fixtures into binary .npy fixtures
+    The input path may be a single file or a directory which is searched recursively.
+    With the dataset format every pickle (polygons or point records) is converted into a dataset directory.
+    """
+    if file_format == 'dataset':
+        pickles = [input_path] if not path.isdir(input_path) else sorted(str(p) for p in Path(input_path).rglob('*.pkl'))
+        converted = [fpath for fpath in map(convert_pickle_dataset, pickles) if fpath is not None]
+    elif path.isdir(input_path):
+        converted = convert_points_dir(input_path)
+    else:
+        converted = [fpath for fpath in [convert_points_file(input_path)] if fpath is not None]
+    logger.info("Converted %d point fixtures", len(converted))
+
+
+@cli.command()
+@click.option('-i', '--input-file', type=click.Path(), default=DEFAULT_SAVED_RANDOM_POLYS,
+              help="Polygon pickle, its dataset sibling (.ds) is used if up to date")
 # @click.option('-pd', '--point-densities', cls=PythonLiteralOption, default="[0.1, 0.5, 1.0, 1.5, 2.0]", required=False,
 #               show_default=True, help="Point Density to Generate of Polygon.")
 @click.option('-o', '--output-file', type=click.Path(exists=False), default='test_fixtures/generated/polygons_holes.pkl')
@@ -238,12 +297,14 @@ def points_pkl(input_file, number_points, distribution, save_directory, plot):
               show_default=True, help="Number of holes")
 @click.option('-hr', '--hole-radius', type=float, default=7.5, required=False,
               show_default=True, help="Hole Radius")
+@click.option('-f', '--file-format', type=click.Choice(['dataset', 'pkl']), default='dataset',
+              help="Chunked dataset directory (output with .ds suffix) or pickle")
 @click.option('-p', '--plot', default=False, is_flag=True, required=False,
               help="Plot polygons")
-def polygon_holes(input_file, output_file, number_holes, hole_radius, plot):
-    """Generates holes inside polygons given by a list of polygons from a pickle file
+def polygon_holes(input_file, output_file, number_holes, hole_radius, file_format, plot):
+    """Generates holes inside polygons given by a list of polygons from a pickle file or dataset
     """
-    polys, poly_params = pickle.load(open(input_file, 'rb'))
+    polys, poly_params = load_polygons(input_file)
     polys_hole = []
     # polys = polys[:100]
     num_polys = len(polys)
@@ -253,7 +314,10 @@ def polygon_holes(input_file, output_file, number_holes, hole_radius, plot):
         for i, poly_hole in enumerate(tqdm(pool.imap(partial(holes_poly, num_holes=number_holes, hole_radius=hole_radius), polys), total=num_polys)):
             polys_hole.append(poly_hole)
 
-    pickle.dump((polys_hole, poly_params), open(output_file, "wb"))
+    if file_format == 'dataset':
+        save_polygons_dataset(output_file, polys_hole, poly_params)
+    else:
+        pickle.dump((polys_hole, poly_params), open(output_file, "wb"))
 
 
     if plot:
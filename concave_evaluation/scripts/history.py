@@ -0,0 +1,248 @@
+"""Benchmark history store for catching performance regressions
+Every recorded run is a directory under results/history holding the timing records (timings.csv) and the
+environment the run was measured in (env.json): library versions (polylidar, shapely, GEOS, CGAL, spatialite,
+PostGIS), CPU and git commit. Two runs are compared per (alg, params_hash, shape, points, section) with a one
+sided Mann-Whitney U test on the individual timings, p values are Holm corrected over all groups.
+"""
+import os
+import json
+import shutil
+import platform
+import subprocess
+import logging
+from datetime import datetime
+from os import path
+
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.stats import mannwhitneyu
+
+from concave_evaluation import MAIN_DIR, DEFAULT_HISTORY_DIR
+from concave_evaluation.helpers.benchmark import BENCHMARK_OPTIONS
+
+logger = logging.getLogger("Concave")
+
+HISTORY_KEYS = ['alg', 'params_hash', 'shape', 'points', 'section']
+PACKAGES = ['polylidar', 'shapely', 'numpy', 'scipy', 'psycopg2']
+
+
+def package_version(name):
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        return None
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+def git_commit(repo_dir=MAIN_DIR):
+    """Commit of the repository and whether the working tree has uncommitted changes"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_dir, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, encoding='utf-8', check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo_dir,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8', check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return dict(commit=None, dirty=None)
+    return dict(commit=commit, dirty=bool(status.strip()))
+
+
+def cpu_info():
+    info = dict(model=platform.processor() or None, count=os.cpu_count(), machine=platform.machine())
+    if path.exists('/proc/cpuinfo'):
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    info['model'] = line.split(':', 1)[1].strip()
+                    break
+    return info
+
+
+def backend_versions(alg, params=None):
+    """Versions of the libraries behind alg, None if the backend is unavailable"""
+    params = params or {}
+    try:
+        if alg == 'cgal':
+            from concave_evaluation.cgal_evaluation import library_versions
+            return library_versions()
+        elif alg == 'spatialite':
+            from concave_evaluation.spatialite_evaluation import library_versions
+        elif alg == 'postgis':
+            from concave_evaluation.postgis_evaluation import library_versions
+        else:
+            return dict()
+        return library_versions(params['db_path']) if 'db_path' in params else library_versions()
+    except Exception:
+        logger.warning("Could not query the %s version", alg)
+        return None
+
+
+def collect_environment(algs=('polylidar', 'cgal', 'spatialite', 'postgis'), alg_params=None):
+    """Describes the environment of a benchmark run
+
+    Keyword Arguments:
+        algs {List[str]} -- Algorithms whose backend versions are queried
+        alg_params {dict} -- Parameters of each algorithm, a db_path selects the database to query (default: {None})
+
+    Returns:
+        dict -- Json serializable environment
+    """
+    alg_params = alg_params or {}
+    libraries = {name: package_version(name) for name in PACKAGES}
+    libraries['shapely'] = shapely.__version__
+    libraries['geos'] = getattr(shapely, 'geos_version_string', None)
+    for alg in algs:
+        versions = backend_versions(alg, alg_params.get(alg))
+        if versions:
+            libraries.update(versions)
+    return dict(created=datetime.now().isoformat(timespec='seconds'), python=platform.python_version(),
+                platform=platform.platform(), cpu=cpu_info(), git=git_commit(), libraries=libraries,
+                benchmark=dict(BENCHMARK_OPTIONS))
+
+
+def save_run(records, env, name=None, history_dir=DEFAULT_HISTORY_DIR):
+    """Records the timings of a run with its environment
+
+    Arguments:
+        records {str|DataFrame} -- Timing records or the csv they were saved to
+        env {dict} -- Environment of the run (see collect_environment)
+
+    Keyword Arguments:
+        name {str} -- Label appended to the run id (default: {None})
+        history_dir {str} -- Directory of the history store (default: {DEFAULT_HISTORY_DIR})
+
+    Returns:
+        str -- Run id
+    """
+    commit = env['git']['commit'][:8] if env['git']['commit'] else 'nogit'
+    run_id = "{}_{}".format(datetime.now().strftime('%Y%m%d-%H%M%S'), commit)
+    if name:
+        run_id += '_' + name
+    run_dir = path.join(history_dir, run_id)
+    os.makedirs(run_dir, exist_ok=True)
+    if isinstance(records, pd.DataFrame):
+        records.to_csv(path.join(run_dir, 'timings.csv'), index=False)
+    else:
+        shutil.copyfile(str(records), path.join(run_dir, 'timings.csv'))
+    with open(path.join(run_dir, 'env.json'), 'w') as f:
+        json.dump(env, f, indent=2)
+    logger.info("Recorded run %s", run_id)
+    return run_id
+
+
+def list_runs(history_dir=DEFAULT_HISTORY_DIR):
+    """Summary of the recorded runs, oldest first"""
+    records = []
+    if path.isdir(history_dir):
+        for run_id in sorted(os.listdir(history_dir)):
+            env_fpath = path.join(history_dir, run_id, 'env.json')
+            if not path.exists(env_fpath):
+                continue
+            with open(env_fpath) as f:
+                env = json.load(f)
+            libraries = env.get('libraries', {})
+            records.append(dict(run=run_id, created=env.get('created'), commit=(env['git']['commit'] or '')[:8],
+                                dirty=env['git']['dirty'], cpu=env['cpu']['model'], polylidar=libraries.get('polylidar'),
+                                geos=libraries.get('geos'), cgal=libraries.get('cgal')))
+    return pd.DataFrame(records, columns=['run', 'created', 'commit', 'dirty', 'cpu', 'polylidar', 'geos', 'cgal'])
+
+
+def resolve_run(run, history_dir=DEFAULT_HISTORY_DIR):
+    """Directory of a run given as a directory, a run id or 'latest' / 'previous'"""
+    if path.isdir(str(run)):
+        return str(run)
+    if run in ['latest', 'previous']:
+        runs = list_runs(history_dir)['run'].tolist()
+        offset = 1 if run == 'latest' else 2
+        if len(runs) < offset:
+            raise ValueError("History {} has fewer than {} runs".format(history_dir, offset))
+        run = runs[-offset]
+    run_dir = path.join(history_dir, run)
+    if not path.isdir(run_dir):
+        raise ValueError("Unknown run {}".format(run))
+    return run_dir
+
+
+def load_run(run, history_dir=DEFAULT_HISTORY_DIR):
+    """Returns the timing records and environment of a recorded run"""
+    run_dir = resolve_run(run, history_dir)
+    with open(path.join(run_dir, 'env.json')) as f:
+        env = json.load(f)
+    return pd.read_csv(path.join(run_dir, 'timings.csv')), env
+
+
+def flatten(env, prefix=''):
+    flat = dict()
+    for key, value in env.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def environment_changes(base_env, new_env, ignore=('created',)):
+    """Returns {key: (base value, new value)} of every environment entry that differs between two runs"""
+    base, new = flatten(base_env), flatten(new_env)
+    return {key: (base.get(key), new.get(key)) for key in sorted(set(base) | set(new))
+            if key not in ignore and base.get(key) != new.get(key)}
+
+
+def holm_correction(p_values):
+    """Holm-Bonferroni adjusted p values, controls the family wise error rate over all compared groups"""
+    p_values = np.asarray(p_values, dtype=np.float64)
+    order = np.argsort(p_values)
+    m = p_values.size
+    adjusted = np.maximum.accumulate((m - np.arange(m)) * p_values[order])
+    result = np.empty(m)
+    result[order] = np.minimum(adjusted, 1.0)
+    return result
+
+
+def compare_runs(base, new, keys=HISTORY_KEYS, alpha=0.01, min_slowdown=0.05):
+    """Flags statistically significant slowdowns of new relative to base
+
+    Arguments:
+        base {DataFrame} -- Timing records of the baseline run
+        new {DataFrame} -- Timing records of the new run
+
+    Keyword Arguments:
+        keys {List[str]} -- Columns identifying a benchmark (default: {HISTORY_KEYS})
+        alpha {float} -- Family wise significance level (default: {0.01})
+        min_slowdown {float} -- Relative increase of the median below which a slowdown is not flagged (default: {0.05})
+
+    Returns:
+        DataFrame -- Median timings, ratio, p values and regression flag of every benchmark in both runs
+    """
+    missing = [key for key in keys if key not in base.columns or key not in new.columns]
+    if missing:
+        # e.g. runs imported from a csv without a params_hash, their groups may mix parameters
+        logger.warning("Comparing without the keys %r missing from a run", missing)
+        keys = [key for key in keys if key not in missing]
+    # Accuracy only records (time is NaN) carry no timing
+    base_groups = base.dropna(subset=['time']).groupby(keys)['time']
+    new_groups = new.dropna(subset=['time']).groupby(keys)['time']
+    new_timings = dict(list(new_groups))
+    records = []
+    for key, base_times in base_groups:
+        if key not in new_timings:
+            continue
+        new_times = new_timings[key]
+        base_median, new_median = float(np.median(base_times)), float(np.median(new_times))
+        # A single sample per run can not be tested, the group is reported but never flagged
+        p_value = np.nan
+        if len(base_times) > 1 and len(new_times) > 1:
+            p_value = mannwhitneyu(new_times, base_times, alternative='greater').pvalue
+        records.append(dict(zip(keys, key), base_median=base_median, new_median=new_median,
+                            ratio=new_median / base_median if base_median > 0 else np.nan,
+                            base_n=len(base_times), new_n=len(new_times), p_value=p_value))
+    df = pd.DataFrame(records, columns=keys + ['base_median', 'new_median', 'ratio', 'base_n', 'new_n', 'p_value'])
+    tested = df['p_value'].notna()
+    df['p_adjusted'] = np.nan
+    if tested.any():
+        df.loc[tested, 'p_adjusted'] = holm_correction(df.loc[tested, 'p_value'])
+    df['regression'] = (df['p_adjusted'] < alpha) & (df['ratio'] >= 1.0 + min_slowdown)
+    return df.sort_values('ratio', ascending=False).reset_index(drop=True)
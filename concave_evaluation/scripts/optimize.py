@@ -0,0 +1,194 @@
+"""Automatic search of the parameter of each algorithm minimizing l2 for a (shape, number of points) fixture
+Every evaluation is a lookup in a TriangleSweep of the fixture (see polylidar_evaluation.sweep), so a search costs
+one triangulation plus a few dozen binary searches. The parameter is bracketed on a coarse grid, then refined by
+golden-section search. Results are cached on disk keyed by a hash of the fixture (points and ground truth).
+
+The spatialite factor and PostGIS target_percent are searched on their approximations by the sweep: triangles with
+an edge longer than mean + factor * std removed, and the alpha shape covering target_percent of the convex hull.
+"""
+import json
+import math
+import hashlib
+import logging
+import os
+from os import path
+
+import numpy as np
+
+from concave_evaluation import DEFAULT_RESULTS_SAVE_DIR
+from concave_evaluation.helpers import load_points, load_ground_truth
+from concave_evaluation.polylidar_evaluation.sweep import TriangleSweep
+
+logger = logging.getLogger("Concave")
+
+DEFAULT_CACHE_FILE = path.join(DEFAULT_RESULTS_SAVE_DIR, 'optimal_params.json')
+INV_PHI = (math.sqrt(5) - 1) / 2
+SEARCH_VERSION = 1
+
+# Search interval of each algorithm's parameter, alpha in multiples of the nominal alpha
+SEARCH_BOUNDS = dict(polylidar=(0.25, 8.0), cgal=(0.25, 8.0), spatialite=(0.0, 6.0), postgis=(0.3, 1.0))
+PARAM_NAMES = dict(polylidar='alpha', cgal='alpha', spatialite='factor', postgis='target_percent')
+
+
+def golden_section(fn, low, high, tol=1e-3, max_iter=60):
+    """Minimizes a unimodal function over [low, high]
+
+    Returns:
+        Tuple[float, float, int] -- Argument, value and number of evaluations
+    """
+    a, b = low, high
+    c, d = b - INV_PHI * (b - a), a + INV_PHI * (b - a)
+    fc, fd = fn(c), fn(d)
+    evaluations = 2
+    while b - a > tol * max(1.0, abs(a) + abs(b)) and evaluations < max_iter:
+        if fc <= fd:
+            b, d, fd = d, c, fc
+            c = b - INV_PHI * (b - a)
+            fc = fn(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + INV_PHI * (b - a)
+            fd = fn(d)
+        evaluations += 1
+    return (c, fc, evaluations) if fc <= fd else (d, fd, evaluations)
+
+
+def bracket_minimum(fn, low, high, num=12):
+    """Evaluates fn on a grid and returns the interval around the best grid point
+    Guards the golden-section search against the local minima of l2 curves
+    """
+    grid = np.linspace(low, high, num)
+    values = [fn(x) for x in grid]
+    best = int(np.nanargmin(values))
+    return grid[max(best - 1, 0)], grid[min(best + 1, num - 1)], num
+
+
+def minimize(fn, low, high, num=12, tol=1e-3):
+    """Brackets then refines the minimum of fn over [low, high], NaN values are treated as infinite"""
+    def fn_(x):
+        value = fn(x)
+        return np.inf if np.isnan(value) else value
+    a, b, evaluations = bracket_minimum(fn_, low, high, num)
+    x, value, refine_evaluations = golden_section(fn_, a, b, tol=tol)
+    return x, value, evaluations + refine_evaluations
+
+
+def sweep_objective(sweep, alg, num_points):
+    """Returns the l2 of alg as a function of its (searched) parameter, and the mapping to the run_test value"""
+    nominal = sweep.gt.alpha(num_points)
+    if alg in ['polylidar', 'cgal']:
+        def l2(multiple):
+            return sweep.curve(sweep.circumradius, [multiple * nominal])['l2'][0]
+        to_param = (lambda multiple: multiple * nominal) if alg == 'polylidar' else (lambda multiple: (multiple * nominal) ** 2)
+        return l2, to_param
+    elif alg == 'spatialite':
+        longest_edge = sweep.edge_lengths.max(axis=1)
+
+        def l2(factor):
+            threshold = np.nextafter(sweep.edge_mean + factor * sweep.edge_std, np.inf)
+            return sweep.curve(longest_edge, [threshold])['l2'][0]
+        return l2, float
+    elif alg == 'postgis':
+        order = np.argsort(sweep.circumradius)
+        cumulative_area = np.cumsum(sweep.areas[order])
+        hull_area = sweep.gt.convex_hull.area
+
+        def l2(target_percent):
+            # Smallest alpha shape covering target_percent of the convex hull
+            idx = min(np.searchsorted(cumulative_area, target_percent * hull_area), order.size - 1)
+            return sweep.curve(sweep.circumradius, [np.nextafter(sweep.circumradius[order[idx]], np.inf)])['l2'][0]
+        return l2, float
+    raise ValueError("Unknown algorithm {}".format(alg))
+
+
+def file_hash(fpath, block_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(str(fpath), 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def fixture_hash(point_fpath, gt_fpath):
+    """Hash of the content of a point fixture and its ground truth"""
+    return hashlib.sha1((file_hash(point_fpath) + file_hash(gt_fpath)).encode('utf-8')).hexdigest()[:16]
+
+
+class ParamCache(object):
+    def __init__(self, fpath=DEFAULT_CACHE_FILE):
+        """Json file of search results keyed by fixture hash, algorithm and search settings"""
+        self.fpath = fpath
+        self.entries = dict()
+        if path.exists(fpath):
+            with open(fpath) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(fixture, alg, bounds):
+        return "{}:{}:{}:{}".format(fixture, alg, list(bounds), SEARCH_VERSION)
+
+    def get(self, fixture, alg, bounds):
+        return self.entries.get(self.key(fixture, alg, bounds))
+
+    def set(self, fixture, alg, bounds, result):
+        self.entries[self.key(fixture, alg, bounds)] = result
+        # Written to a temporary file first so an interrupted write does not corrupt the cache
+        tmp_fpath = self.fpath + '.tmp'
+        with open(tmp_fpath, 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_fpath, self.fpath)
+
+
+def optimize_params(point_fpath, gt_fpath, algs=('polylidar', 'cgal', 'spatialite', 'postgis'), cache=None,
+                    bounds=SEARCH_BOUNDS):
+    """Searches the parameter of every algorithm minimizing l2 on a point fixture
+
+    Arguments:
+        point_fpath {str} -- Point fixture
+        gt_fpath {str} -- Ground truth geojson
+
+    Keyword Arguments:
+        algs {List[str]} -- Algorithms to optimize
+        cache {ParamCache} -- Disk cache of results, no caching if None (default: {None})
+        bounds {dict} -- Search interval of each algorithm (default: {SEARCH_BOUNDS})
+
+    Returns:
+        dict -- {alg: dict(param=name, value=run_test value, l2=approximate l2, evaluations=n)}
+    """
+    fixture = fixture_hash(point_fpath, gt_fpath) if cache is not None else None
+    results = dict()
+    sweep = None
+    for alg in algs:
+        cached = cache.get(fixture, alg, bounds[alg]) if cache is not None else None
+        if cached is not None:
+            results[alg] = cached
+            continue
+        if sweep is None:
+            points = load_points(point_fpath)
+            sweep = TriangleSweep(points, load_ground_truth(gt_fpath))
+        l2, to_param = sweep_objective(sweep, alg, points.shape[0])
+        x, value, evaluations = minimize(l2, *bounds[alg])
+        results[alg] = dict(param=PARAM_NAMES[alg], value=float(to_param(x)), l2=float(value), evaluations=evaluations)
+        logger.info("Optimal %s %s=%.4f (l2=%.4f, %d evaluations) for %r", alg, PARAM_NAMES[alg],
+                    results[alg]['value'], value, evaluations, path.basename(str(point_fpath)))
+        if cache is not None:
+            cache.set(fixture, alg, bounds[alg], results[alg])
+    return results
+
+
+def optimize_plan(plan, config, cache=None):
+    """Replaces the planned parameter of every algorithm of a sweep plan (see planner) with its optimum
+    Tests without a point fixture in config['points_dir'] keep their planned parameters.
+    """
+    for (shape_name, num_points), test_plan in plan.items():
+        stem = "{}_{}".format(shape_name, num_points)
+        point_fpaths = [path.join(config['points_dir'], stem + suffix) for suffix in ['.npy', '.csv']]
+        point_fpaths = [fpath for fpath in point_fpaths if path.exists(fpath)]
+        if not point_fpaths:
+            logger.warning("No point fixture for %s, keeping planned parameters", stem)
+            continue
+        gt_fpath = next(iter(test_plan.values()))['gt_fpath']
+        optimal = optimize_params(point_fpaths[0], gt_fpath, algs=list(test_plan), cache=cache)
+        for alg, result in optimal.items():
+            test_plan[alg][result['param']] = result['value']
+    return plan
@@ -0,0 +1,150 @@
+"""Staged producer/consumer pipeline for replaying recorded frames
+Every stage runs in its own thread and hands frames to the next through a bounded queue, so the I/O of frame k+1
+overlaps the compute of frame k while at most queue_size frames wait between two stages. The source can be paced
+at a camera frame rate; every frame records its arrival time and the time spent in each stage, from which
+latency_budget reports whether the pipeline keeps up with that frame rate.
+"""
+import time
+import queue
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger("Concave")
+
+_STOP = object()
+
+
+class Frame(object):
+    def __init__(self, index, item, arrival):
+        """An item flowing through the pipeline with its arrival time (perf_counter) and stage timings (ms)"""
+        self.index = index
+        self.item = item
+        self.arrival = arrival
+        self.stage_ms = dict()
+        self.done = None
+
+
+def _put(q, value, cancel):
+    # Blocks while the queue is full, but gives up once another stage failed
+    while not cancel.is_set():
+        try:
+            q.put(value, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, cancel):
+    while not cancel.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _STOP
+
+
+def run_pipeline(items, stages, queue_size=2, fps=None):
+    """Passes every item through the stages, each stage in its own thread
+
+    Arguments:
+        items {Iterable} -- Source of the pipeline, consumed lazily in the source thread
+        stages {List[Tuple[str, Callable]]} -- Named stages, each maps the output of the previous stage to its own
+
+    Keyword Arguments:
+        queue_size {int} -- Frames allowed to wait between two stages (default: {2})
+        fps {float} -- Releases items at this rate like a camera would, as fast as possible if None (default: {None})
+
+    Returns:
+        List[Frame] -- Finished frames in source order, item holds the output of the last stage
+    """
+    cancel = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    def source():
+        try:
+            start = time.perf_counter()
+            for index, item in enumerate(items):
+                if fps:
+                    # A camera delivers frame index at start + index / fps, whether or not we are ready for it
+                    time.sleep(max(start + index / fps - time.perf_counter(), 0.0))
+                arrival = start + index / fps if fps else time.perf_counter()
+                if not _put(queues[0], Frame(index, item, arrival), cancel):
+                    return
+        except Exception as e:
+            errors.append(('source', e))
+            cancel.set()
+        finally:
+            _put(queues[0], _STOP, cancel)
+
+    def worker(name, fn, in_q, out_q):
+        try:
+            while True:
+                frame = _get(in_q, cancel)
+                if frame is _STOP:
+                    break
+                t0 = time.perf_counter()
+                frame.item = fn(frame.item)
+                frame.stage_ms[name] = (time.perf_counter() - t0) * 1000
+                if not _put(out_q, frame, cancel):
+                    break
+        except Exception as e:
+            logger.exception("Pipeline stage %s failed", name)
+            errors.append((name, e))
+            cancel.set()
+        finally:
+            _put(out_q, _STOP, cancel)
+
+    threads = [threading.Thread(target=source, name='pipeline-source', daemon=True)]
+    for (name, fn), in_q, out_q in zip(stages, queues[:-1], queues[1:]):
+        threads.append(threading.Thread(target=worker, args=(name, fn, in_q, out_q), name='pipeline-' + name,
+                                        daemon=True))
+    for thread in threads:
+        thread.start()
+
+    frames = []
+    while True:
+        frame = _get(queues[-1], cancel)
+        if frame is _STOP:
+            break
+        frame.done = time.perf_counter()
+        frames.append(frame)
+    for thread in threads:
+        thread.join()
+    if errors:
+        name, error = errors[0]
+        raise RuntimeError("Pipeline stage {} failed".format(name)) from error
+    return frames
+
+
+def latency_budget(frames, fps, rel_tol=0.02):
+    """Per stage timings of the frames against the frame budget (1000 / fps ms)
+    A stage keeps up if its median time fits in the budget, the pipeline keeps up if the median interval between
+    finished frames does (its throughput is that of the slowest stage). Latency is from arrival to leaving the last
+    stage, including the time spent waiting in queues, and may exceed the budget while the pipeline keeps up.
+    Replayed at fps the frame interval equals the budget, rel_tol absorbs its jitter.
+
+    Returns:
+        DataFrame -- median, p95 and max (ms) of every stage, the frame interval and the frame latency
+    """
+    budget_ms = 1000.0 / fps
+    columns = dict()
+    for name in frames[0].stage_ms if frames else []:
+        columns[name] = np.array([frame.stage_ms[name] for frame in frames])
+    if len(frames) > 1:
+        columns['interval'] = np.diff([frame.done for frame in frames]) * 1000
+    records = []
+    for name, values in columns.items():
+        records.append(dict(stage=name, median=np.median(values), p95=np.percentile(values, 95), max=values.max(),
+                            budget=budget_ms, keeps_up=bool(np.median(values) <= budget_ms * (1 + rel_tol)),
+                            over_budget=float(np.mean(values > budget_ms))))
+    if frames:
+        latency = np.array([(frame.done - frame.arrival) * 1000 for frame in frames])
+        records.append(dict(stage='latency', median=np.median(latency), p95=np.percentile(latency, 95),
+                            max=latency.max(), budget=budget_ms, keeps_up=None,
+                            over_budget=float(np.mean(latency > budget_ms))))
+    return pd.DataFrame.from_records(records)
@@ -0,0 +1,118 @@
+"""Plans the parameters of every algorithm before a sweep runs
+Parameters derived from the ground truth (alpha from the point density, PostGIS target_percent from the convex hull)
+are computed once per (shape, number of points) and stored in a table. Jobs only look up their parameters, the
+table can be dumped to json and reused by later runs.
+"""
+import json
+import logging
+from os import path
+
+from concave_evaluation.helpers import load_ground_truth, nominal_alpha
+
+logger = logging.getLogger("Concave")
+
+ALGS = ['polylidar', 'cgal', 'spatialite', 'postgis']
+
+# Parameters of the monte carlo and realsense runs which are not derived from the ground truth
+DEFAULT_ALG_PARAMS = dict(polylidar=dict(), cgal=dict(), spatialite=dict(factor=3.0), postgis=dict())
+
+
+def density_params(alg, area, num_points):
+    """Parameters of alg that scale with the point density
+    alpha can be smaller for cgal and polylidar when the point density is higher, spatialite and postgis
+    parameters are already normalized with point density.
+    """
+    alpha = nominal_alpha(area, num_points)
+    if alg == 'polylidar':
+        return dict(alpha=alpha)
+    elif alg == 'cgal':
+        # CGAL alpha is the squared radius
+        return dict(alpha=alpha ** 2)
+    return dict()
+
+
+def plan_test_params(config, shape_name, num_points, algs=None):
+    """Plans the parameters of a (shape, number of points) test of a sweep config (see test_fixtures/config.json)
+    The global alg_params are replaced by the shape specific ones of config['tests'], alpha of cgal and polylidar
+    is derived from the point density of the ground truth.
+
+    Returns:
+        dict -- Keyword arguments of every algorithm's run_test
+    """
+    algs = config['algs'] if algs is None else algs
+    common_params = dict(config['common_alg_params'])
+    if not common_params.get('gt_fpath'):
+        common_params['gt_fpath'] = path.join(config['gt_dir'], shape_name + '.geojson')
+    gt = load_ground_truth(common_params['gt_fpath'])
+    test_params = config['tests'].get(shape_name) or {}
+
+    plan = dict()
+    for alg in algs:
+        alg_params = test_params.get(alg, config['alg_params'][alg])
+        plan[alg] = dict(common_params, **alg_params)
+        plan[alg].update(density_params(alg, gt.area, num_points))
+    return plan
+
+
+def plan_polygon_params(gt, num_points, algs=ALGS, alg_params=None):
+    """Plans the parameters of a single polygon run (monte carlo, realsense)
+
+    Arguments:
+        gt {GroundTruth} -- Ground truth of the polygon
+        num_points {int} -- Number of points
+
+    Keyword Arguments:
+        algs {List[str]} -- Algorithms to plan (default: {ALGS})
+        alg_params {dict} -- Parameters of each algorithm overriding DEFAULT_ALG_PARAMS (default: {None})
+
+    Returns:
+        dict -- Keyword arguments of every algorithm's run_test
+    """
+    alg_params = alg_params or {}
+    plan = dict()
+    for alg in algs:
+        plan[alg] = dict(DEFAULT_ALG_PARAMS[alg], **density_params(alg, gt.area, num_points))
+        if alg == 'postgis':
+            plan[alg]['target_percent'] = gt.target_percent
+        plan[alg].update(alg_params.get(alg, {}))
+    return plan
+
+
+def plan_config(config):
+    """Plans every (shape, number of points) test of a sweep config
+
+    Returns:
+        dict -- {(shape, num_points): {alg: params}}
+    """
+    plan = dict()
+    for shape_name in config['shapes']:
+        for num_points in config['n_points']:
+            plan[(shape_name, num_points)] = plan_test_params(config, shape_name, num_points)
+    logger.info("Planned parameters of %d tests", len(plan))
+    return plan
+
+
+def plan_records(plan):
+    """Flattens a plan into one record per (shape, num_points, alg)"""
+    return [dict(shape=shape_name, n=num_points, alg=alg, params=params)
+            for (shape_name, num_points), test_plan in plan.items() for alg, params in test_plan.items()]
+
+
+def save_plan(fpath, plan):
+    with open(fpath, 'w') as f:
+        json.dump(plan_records(plan), f, indent=2)
+
+
+def missing_plan_params(plan, tests, algs):
+    """Returns the (shape, num_points, alg) of the tests a plan has no parameters for"""
+    return [(shape_name, num_points, alg) for shape_name, num_points in tests for alg in algs
+            if alg not in plan.get((shape_name, num_points), {})]
+
+
+def load_plan(fpath):
+    with open(fpath) as f:
+        records = json.load(f)
+    plan = dict()
+    for record in records:
+        plan.setdefault((record['shape'], record['n']), dict())[record['alg']] = record['params']
+    return plan
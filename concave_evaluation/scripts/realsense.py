@@ -17,17 +17,19 @@ from concave_evaluation.polylidar_evaluation import run_test as run_test_polylid
 from concave_evaluation.cgal_evaluation import run_test as run_test_cgal
 from concave_evaluation.spatialite_evaluation import run_test as run_test_spatialite
 from concave_evaluation.postgis_evaluation import run_test as run_test_postgis
-from concave_evaluation.helpers import load_polygon
+from concave_evaluation.helpers import load_polygon, load_points, load_ground_truth, evaluate_batch, evaluate_scanline
+from concave_evaluation.scripts.planner import plan_polygon_params
+from concave_evaluation.helpers.benchmark import summarize
+from concave_evaluation.scripts.pipeline import run_pipeline, latency_budget
 from concave_evaluation.helpers import measure_convexity_simple
+from concave_evaluation.helpers.depth import deproject_depth, camera_intrinsics, segment_organized, valid_points
 
 logger = logging.getLogger("Concave")
 
 
-def calc_mean_and_std(timings, l2, alg='polylidar'):
-    mean = np.mean(timings)
-    std = np.std(timings)
-    max_ = np.max(timings)
-    return dict(mean=mean, std=std, max=max_, l2=l2, alg=alg)
+def summarize_timings(timings, l2, alg='polylidar'):
+    """Median, IQR and min of the timings, robust to the outliers of a noisy machine"""
+    return dict(summarize(timings), l2=l2, alg=alg)
 
 
 @click.group()
@@ -44,22 +46,87 @@ def segment_points(points, z_thresh=.035):
     return points_2d
 
 
-def get_data_from_scene(scene: dict):
-    scene_data = dict()
-    scene_data['points3d'] = np.loadtxt(scene['point_fpath'])
-    scene_data['points3d_segmented'] = segment_points(scene_data['points3d'])
-    scene_data['points2d'] = np.ascontiguousarray(scene_data['points3d_segmented'][:, :2])
-    scene_data['gt_shape'] = load_polygon(scene['gt_fpath'])
-    scene_data['color'] = Image.open(scene['color_fpath'])
-    scene_data['depth'] = Image.open(scene['depth_fpath'])
-    with open(scene['meta_fpath']) as f:
-        scene_data['meta'] = json.load(f)
-    scene_data['depth_raw'] = np.loadtxt(scene['depth_raw_fpath'])
-    scene_data['scene_name'] = scene['scene_name']
-    scene_data['scene_idx'] = scene['scene_idx']
-    scene_data['scene_dir'] = scene['scene_dir']
-
-    return scene_data
+def load_json(fpath):
+    with open(fpath) as f:
+        return json.load(f)
+
+
+def scene_points3d(scene):
+    if scene.source == 'depth':
+        return valid_points(scene['organized'])
+    return load_points(scene.files['point_fpath'])
+
+
+def scene_segmented(scene):
+    if scene.source == 'depth':
+        return segment_organized(scene['organized'])
+    return segment_points(scene['points3d'])
+
+
+# How every field of a scene is loaded, derived fields (segmentation) read the fields they depend on
+SCENE_FIELDS = dict(
+    points3d=scene_points3d,
+    points3d_segmented=scene_segmented,
+    points2d=lambda scene: np.ascontiguousarray(scene['points3d_segmented'][:, :2]),
+    organized=lambda scene: deproject_depth(scene['depth_raw'], camera_intrinsics(scene['meta']), stride=scene.stride),
+    gt_shape=lambda scene: load_polygon(scene.files['gt_fpath']),
+    gt=lambda scene: load_ground_truth(scene.files['gt_fpath']),
+    color=lambda scene: Image.open(scene.files['color_fpath']),
+    depth=lambda scene: Image.open(scene.files['depth_fpath']),
+    meta=lambda scene: load_json(scene.files['meta_fpath']),
+    depth_raw=lambda scene: load_points(scene.files['depth_raw_fpath']),
+)
+ALL_FIELDS = list(SCENE_FIELDS)
+# Fields read by the benchmarks (hulls and accuracy) and by view
+BENCHMARK_FIELDS = ['points2d', 'gt']
+VIEW_FIELDS = ['points3d', 'points3d_segmented']
+# Fields read from disk by the load stage of the stream pipeline, derived fields are computed by later stages
+IO_FIELDS = dict(points=['points3d', 'gt'], depth=['depth_raw', 'meta', 'gt'])
+SOURCES = list(IO_FIELDS)
+# Exact overlay (evaluate_batch) or scanline approximation (evaluate_scanline) of l2
+METRICS = ['exact', 'scanline']
+
+
+class LazyScene(dict):
+    def __init__(self, scene: dict, source='points', stride=1):
+        """Scene data loaded field by field (see SCENE_FIELDS) on first access and cached
+        Used like the dict of every field, only fields that are read cost I/O and memory.
+
+        Arguments:
+            scene {dict} -- Scene files and names (see get_realsense_scenes)
+
+        Keyword Arguments:
+            source {str} -- Build the 3D cloud from the exported points.txt ('points') or by deprojecting
+                            depth_raw.txt with the intrinsics of meta.json ('depth') (default: {'points'})
+            stride {int} -- Decimation of the depth image, only for the depth source (default: {1})
+        """
+        super().__init__(scene_name=scene['scene_name'], scene_idx=scene['scene_idx'], scene_dir=scene['scene_dir'])
+        if source not in SOURCES:
+            raise ValueError("Unknown scene source {}".format(source))
+        self.files = scene
+        self.source = source
+        self.stride = stride
+
+    def __missing__(self, field):
+        if field not in SCENE_FIELDS:
+            raise KeyError(field)
+        value = self[field] = SCENE_FIELDS[field](self)
+        return value
+
+    def load(self, fields):
+        """Loads the fields now instead of on first access"""
+        for field in fields:
+            self[field]
+        return self
+
+
+def get_data_from_scene(scene: dict, fields=BENCHMARK_FIELDS, source='points', stride=1):
+    """Returns the lazy data of a scene with fields already loaded, other fields load on first access"""
+    return LazyScene(scene, source=source, stride=stride).load(fields)
+
+
+def segment_scene(scene_data: LazyScene):
+    return scene_data.load(['points2d'])
 
 
 def get_realsense_scenes(realsense_dir):
@@ -84,7 +151,12 @@ def get_realsense_scenes(realsense_dir):
 
 @realsense.command()
 @click.option('-cf', '--config-file', type=click.Path(exists=True), default=REALSENSE_CONFIG)
-def view(config_file):
+@click.option('-fl', '--fields', type=click.Choice(ALL_FIELDS), multiple=True, default=VIEW_FIELDS,
+              help="Scene fields loaded up front, the others load on first access")
+@click.option('-sr', '--source', type=click.Choice(SOURCES), default='points',
+              help="Exported points.txt or the deprojected depth_raw.txt")
+@click.option('-st', '--stride', default=1, help="Decimation of the depth image with --source depth")
+def view(config_file, fields, source, stride):
     """Visualize the 3D and 2D point from the Realsense Camera"""
     import open3d as o3d
     with open(config_file) as f:
@@ -93,7 +165,7 @@ def view(config_file):
     for scene in scenes:
         # if scene['scene_name'] != "Scene_004":
         #     continue
-        scene_data = get_data_from_scene(scene)
+        scene_data = get_data_from_scene(scene, fields=fields, source=source, stride=stride)
         logger.info("Visualizing - %s", scene['scene_name'])
         pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(scene_data['points3d']))
         o3d.visualization.draw_geometries_with_editing([pcd])
@@ -103,16 +175,23 @@ def view(config_file):
 
 @realsense.command()
 @click.option('-cf', '--config-file', type=click.Path(exists=True), default=REALSENSE_CONFIG)
-def all(config_file):
+@click.option('-fl', '--fields', type=click.Choice(ALL_FIELDS), multiple=True, default=BENCHMARK_FIELDS,
+              help="Scene fields loaded up front, the others load on first access")
+@click.option('-sr', '--source', type=click.Choice(SOURCES), default='points',
+              help="Exported points.txt or the deprojected depth_raw.txt")
+@click.option('-st', '--stride', default=1, help="Decimation of the depth image with --source depth")
+@click.option('-m', '--metric', type=click.Choice(METRICS), default='exact',
+              help="Exact l2 of the overlay or its scanline approximation")
+def all(config_file, fields, source, stride, metric):
     """Runs all Realsense Benchmarks"""
     with open(config_file) as f:
         config = json.load(f)
     scenes = get_realsense_scenes(config['realsense_dir'])
     all_dfs = []
     for scene in scenes:
-        scene_data = get_data_from_scene(scene)
+        scene_data = get_data_from_scene(scene, fields=fields, source=source, stride=stride)
         logger.info("Evaluating - %s", scene['scene_name'])
-        df = run_test_on_scene(scene_data, config)
+        df = run_test_on_scene(scene_data, config, metric=metric)
         all_dfs.append(df)
 
     df = pd.concat(all_dfs, axis=0)
@@ -121,33 +200,74 @@ def all(config_file):
     df.to_csv(config['save_csv'])
 
 
-def run_test_on_scene(scene_data: dict, config: dict):
-    gt_shape, _ = scene_data['gt_shape']
+@realsense.command()
+@click.option('-cf', '--config-file', type=click.Path(exists=True), default=REALSENSE_CONFIG)
+@click.option('-fps', '--fps', default=30.0, help="Camera frame rate the per frame budget is derived from")
+@click.option('-rp', '--replay', default=False, is_flag=True,
+              help="Release the recorded scenes at --fps like the camera would, else as fast as possible")
+@click.option('-qs', '--queue-size', default=2, help="Scenes allowed to wait between two stages")
+@click.option('-bf', '--budget-file', type=click.Path(exists=False), default=None, help="Save the budget as csv")
+@click.option('-fl', '--fields', type=click.Choice(ALL_FIELDS), multiple=True, default=None,
+              help="Scene fields loaded in the load stage, the files of --source and the ground truth by default")
+@click.option('-sr', '--source', type=click.Choice(SOURCES), default='points',
+              help="Exported points.txt or the deprojected depth_raw.txt")
+@click.option('-st', '--stride', default=1, help="Decimation of the depth image with --source depth")
+@click.option('-m', '--metric', type=click.Choice(METRICS), default='exact',
+              help="Exact l2 of the overlay or its scanline approximation")
+def stream(config_file, fps, replay, queue_size, budget_file, fields, source, stride, metric):
+    """Runs the Realsense benchmarks as a pipeline (load, segment, hulls, metrics) with overlapped stages"""
+    with open(config_file) as f:
+        config = json.load(f)
+    scenes = get_realsense_scenes(config['realsense_dir'])
+    save_csv = config.get('stream_save_csv', config['save_csv'])
+    fields = fields or IO_FIELDS[source]
+    stages = [('load', lambda scene: get_data_from_scene(scene, fields=fields, source=source, stride=stride)),
+              ('segment', segment_scene), ('hulls', lambda data: run_hulls_on_scene(data, config)),
+              ('metrics', lambda data: score_scene(data, metric=metric))]
+    frames = run_pipeline(scenes, stages, queue_size=queue_size, fps=fps if replay else None)
+    if not frames:
+        logger.warning("No scenes in %r, nothing to stream", config['realsense_dir'])
+        return
+
+    df = pd.concat([frame.item for frame in frames], axis=0).reset_index()
+    print(df)
+    df.to_csv(save_csv)
+    budget = latency_budget(frames, fps)
+    print(budget.to_string())
+    # Algorithms are alternatives, each one alone has to fit in the frame budget next to loading and segmenting
+    stage_ms = np.median([frame.stage_ms['load'] + frame.stage_ms['segment'] for frame in frames])
+    alg_ms = df.groupby('alg')['median'].median()
+    print((alg_ms + stage_ms <= 1000.0 / fps).rename('fits_budget').to_string())
+    if budget_file:
+        budget.to_csv(budget_file, index=False)
+
+
+REALSENSE_ALG_PARAMS = dict(polylidar=dict(minTriangles=1), spatialite=dict(factor=3))
+
+
+def run_test_on_scene(scene_data: dict, config: dict, metric='exact'):
+    return score_scene(run_hulls_on_scene(scene_data, config), metric=metric)
+
+
+def run_hulls_on_scene(scene_data: dict, config: dict):
+    """Runs every backend on the segmented points of a scene, accuracy is evaluated by score_scene"""
+    gt = scene_data['gt']
     points = scene_data['points2d']
 
     num_points = int(points.shape[0])
 
     # Global algorithm parameters
-    global_kwargs = config['common_alg_params']
-    global_kwargs['gt_fpath'] = gt_shape
+    global_kwargs = dict(config['common_alg_params'])
+    global_kwargs['gt_fpath'] = None
     global_kwargs['save_poly'] = scene_data['scene_name']
 
-    polylidar_kwargs = dict(minTriangles=1)
-    cgal_kwargs = dict()
-    spatialite_kwargs = dict(factor=3)
-    postgis_kwargs = dict()
-
-    point_density = gt_shape.area / num_points
-    alpha = math.sqrt(point_density) * 2
-    cgal_kwargs['alpha'] = alpha ** 2
-    polylidar_kwargs['alpha'] = alpha
-    postgis_kwargs['target_percent'] = gt_shape.area / gt_shape.convex_hull.area
+    plan = plan_polygon_params(gt, num_points, alg_params=REALSENSE_ALG_PARAMS)
 
     # Final params for this test
-    polylidar_kwargs = dict(**global_kwargs, **polylidar_kwargs)
-    cgal_kwargs = dict(**global_kwargs, **cgal_kwargs)
-    spatialite_kwargs = dict(**global_kwargs, **spatialite_kwargs)
-    postgis_kwargs = dict(**global_kwargs, **postgis_kwargs)
+    polylidar_kwargs = dict(**global_kwargs, **plan['polylidar'])
+    cgal_kwargs = dict(**global_kwargs, **plan['cgal'])
+    spatialite_kwargs = dict(**global_kwargs, **plan['spatialite'])
+    postgis_kwargs = dict(**global_kwargs, **plan['postgis'])
 
     logger.info("Running Polylidar")
     pl_data = run_test_polylidar(points, **polylidar_kwargs)
@@ -160,12 +280,30 @@ def run_test_on_scene(scene_data: dict, config: dict):
 
     # collapse polylidar subtimings
     timings_pl = np.sum(np.array(pl_data[1]), axis=1)
-    pl_data = (None, timings_pl, pl_data[2])
+    pl_data = (pl_data[0], timings_pl)
+
+    scene_data['hulls'] = dict(polylidar=pl_data[:2], cgal=cgal_data[:2], spatialite=sl_data[:2],
+                               postgis=post_data[:2])
+    return scene_data
+
 
-    records = [calc_mean_and_std(timings, error, alg=alg) for (_, timings, error), alg in [
-        (pl_data, 'polylidar'), (cgal_data, 'cgal'), (sl_data, 'spatialite'), (post_data, 'postgis')]]
+def score_scene(scene_data: dict, metric='exact'):
+    """Accuracy and timing summary of every backend's hull of a scene
+    With the 'exact' metric all hulls are scored against the ground truth at once (see evaluate_batch), 'scanline'
+    approximates l2 without any overlay (see evaluate_scanline).
+    """
+    gt = scene_data['gt']
+    hulls = scene_data['hulls']
+    polygons = {alg: polygon for alg, (polygon, _) in hulls.items() if polygon is not None}
+    if metric == 'scanline':
+        l2_norms = {alg: evaluate_scanline(gt, polygon)['l2'] for alg, polygon in polygons.items()}
+    else:
+        l2_norms = dict(zip(polygons, evaluate_batch(gt, list(polygons.values()))['l2'])) if polygons else {}
+    records = []
+    for alg, (_, timings) in hulls.items():
+        records.append(summarize_timings(timings, l2_norms.get(alg, np.nan), alg=alg))
 
     df = pd.DataFrame.from_records(records)
     df['scene_name'] = scene_data['scene_name']
-    df['num_points'] = num_points
+    df['num_points'] = int(scene_data['points2d'].shape[0])
     return df
@@ -0,0 +1,135 @@
+"""Schedules benchmark jobs over process pools
+CPU bound algorithms (polylidar, cgal) run in their own pool, each worker pinned to a distinct core so that
+concurrently running jobs do not contaminate each others timings. Database backed algorithms (spatialite, postgis)
+are throttled by a separate pool with its own concurrency limit, started once the CPU pool is done.
+"""
+import os
+import logging
+import queue
+import multiprocessing as mp
+from concurrent.futures import wait, as_completed, FIRST_COMPLETED
+
+from concave_evaluation.helpers.benchmark import configure_benchmark
+
+logger = logging.getLogger("Concave")
+
+CPU_ALGS = ['polylidar', 'cgal']
+DB_ALGS = ['spatialite', 'postgis']
+
+
+def available_cores():
+    """Returns the list of cores this process is allowed to run on"""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def pin_worker(core_queue=None):
+    """Pool initializer, pins the worker process to the next free core
+    The measuring core (-pc) is a single core of the parent process, a worker drops it so that concurrent workers
+    are not all moved onto that core.
+    """
+    configure_benchmark(core=None)
+    try:
+        core = core_queue.get_nowait()
+        os.sched_setaffinity(0, {core})
+    except (queue.Empty, AttributeError, OSError):
+        # Platform does not support affinity or we ran out of cores, run unpinned
+        pass
+
+
+def create_core_queue(num_workers):
+    """Queue of the cores workers pin themselves to (see pin_worker)"""
+    cores = available_cores()
+    if num_workers > len(cores):
+        logger.warning("Requested %d workers but only %d cores available, timings may be contaminated",
+                       num_workers, len(cores))
+    core_queue = mp.Queue()
+    for core in cores:
+        core_queue.put(core)
+    return core_queue
+
+
+def imap_bounded(executor, fn, iterable, max_in_flight):
+    """Submits fn(*args) for every args tuple of iterable, yields results as they complete (unordered)
+    The iterable is consumed lazily, never more than max_in_flight tasks are pending at once.
+    """
+    in_flight = set()
+    for args in iterable:
+        if len(in_flight) >= max_in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        in_flight.add(executor.submit(fn, *args))
+    for future in as_completed(in_flight):
+        yield future.result()
+
+
+def create_pool(processes, core_queue=None):
+    if processes < 1:
+        return None
+    return mp.Pool(processes=processes, initializer=pin_worker, initargs=(core_queue,))
+
+
+def run_pool(pool, job_fn, indexed_jobs, collect):
+    """Runs (index, job) pairs on a pool, collect(index, job, result) is called in job order
+    On error the pool is terminated, the remaining jobs are not waited for.
+    """
+    try:
+        pending = [(i, job, pool.apply_async(job_fn, job)) for i, job in indexed_jobs]
+        for i, job, async_result in pending:
+            collect(i, job, async_result.get())
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+
+def run_jobs(job_fn, jobs, cpu_workers=1, db_workers=1, pin_cpu=True, pbar=None, on_result=None):
+    """Executes jobs over a CPU and a DB process pool, returns the results in the same order as jobs
+
+    Arguments:
+        job_fn {Callable} -- Module level (picklable) function called as job_fn(*job)
+        jobs {List[Tuple]} -- Each job is an argument tuple whose first element is the algorithm name
+
+    Keyword Arguments:
+        cpu_workers {int} -- Processes for CPU bound algorithms, 0 runs them serially in this process (default: {1})
+        db_workers {int} -- Processes for database backed algorithms, 0 runs them serially in this process (default: {1})
+        pin_cpu {bool} -- Pin every CPU worker to its own core (default: {True})
+        pbar {tqdm} -- Optional progress bar updated as jobs finish (default: {None})
+        on_result {Callable} -- Called as on_result(job, result) as soon as each job's result is collected (default: {None})
+
+    Returns:
+        List -- The result of each job
+    """
+    results = [None] * len(jobs)
+
+    def collect(i, job, result):
+        results[i] = result
+        if on_result:
+            on_result(job, result)
+        if pbar:
+            pbar.update(1)
+
+    cpu_jobs = [(i, job) for i, job in enumerate(jobs) if job[0] not in DB_ALGS]
+    db_jobs = [(i, job) for i, job in enumerate(jobs) if job[0] in DB_ALGS]
+    # The pools run one after another, spatialite is CPU bound and would compete with the pinned CPU workers.
+    # Only the CPU workers are pinned, each to its own core.
+    inline = []
+    for processes, pool_jobs, pinned in [(cpu_workers, cpu_jobs, pin_cpu), (db_workers, db_jobs, False)]:
+        if processes < 1:
+            inline.extend(pool_jobs)
+        elif pool_jobs:
+            core_queue = create_core_queue(processes) if pinned else None
+            run_pool(create_pool(processes, core_queue), job_fn, pool_jobs, collect)
+
+    # Jobs without a pool run in this process only once the pools are done, so they are not timed while
+    # workers compete for the CPU
+    for i, job in sorted(inline):
+        collect(i, job, job_fn(*job))
+
+    return results
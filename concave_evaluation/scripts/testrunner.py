@@ -4,7 +4,8 @@ import json
 from pathlib import Path
 from os import listdir, path
 import math
-import pickle
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 import click
 import pandas as pd
 import numpy as np
@@ -14,29 +15,50 @@ from tqdm import tqdm
 # All the algorithmic implementations for generating a concave shape from a point set
 from concave_evaluation import (DEFAULT_PG_CONN, DEFAULT_SPATIALITE_DB, DEFAULT_TEST_FILE, DEFAULT_RESULTS_SAVE_DIR,
                                 DEFAULT_PG_SAVE_DIR, DEFAULT_PL_SAVE_DIR, DEFAULT_SL_SAVE_DIR, DEFAULT_CGAL_SAVE_DIR,
-                                GENERATED_DIR, POINTS_DIR, ALPHABET_DIR)
-from concave_evaluation.polylidar_evaluation import run_test as run_test_polylidar
-from concave_evaluation.cgal_evaluation import run_test as run_test_cgal
-from concave_evaluation.spatialite_evaluation import run_test as run_test_spatialite
-from concave_evaluation.postgis_evaluation import run_test as run_test_postgis
-from concave_evaluation.helpers import load_polygon
-from concave_evaluation.helpers import measure_convexity_simple
+                                GENERATED_DIR, POINTS_DIR, ALPHABET_DIR, DEFAULT_GT_DIR)
+from concave_evaluation.polylidar_evaluation import run_test as run_test_polylidar, get_polygons
+from concave_evaluation.cgal_evaluation import run_test as run_test_cgal, get_cgal_worker
+from concave_evaluation.spatialite_evaluation import run_test as run_test_spatialite, get_spatialite_session
+from concave_evaluation.postgis_evaluation import run_test as run_test_postgis, get_postgis_pool
+from concave_evaluation.helpers import load_points_records, load_ground_truth, ground_truth, evaluate_l2
+from concave_evaluation.helpers import measure_convexity_simple, PythonLiteralOption, load_points, save_shapely
+from concave_evaluation.helpers import resolve_point_file
+from concave_evaluation.polylidar_evaluation.sweep import TriangleSweep
+from concave_evaluation.polylidar_evaluation.tiled import tiled_concave_hull, check_tiled
+from concave_evaluation.scripts.optimize import optimize_params, optimize_plan, ParamCache
+from concave_evaluation.helpers.benchmark import configure_benchmark, benchmark
+from concave_evaluation.test_generation.dataset import Dataset, has_dataset, load_polygons
 from concave_evaluation.scripts.realsense import realsense
+from concave_evaluation.scripts.scheduler import run_jobs, imap_bounded, create_core_queue, pin_worker
+from concave_evaluation.scripts.checkpoint import CheckpointWriter, params_hash
+from concave_evaluation.scripts.planner import (plan_test_params, plan_polygon_params, plan_config, save_plan,
+                                                load_plan, plan_records, missing_plan_params)
+from concave_evaluation.scripts.history import (collect_environment, save_run, list_runs, load_run, compare_runs,
+                                                environment_changes)
 
 logger = logging.getLogger("Concave")
 
 
 @click.group()
-def evaluate():
+@click.option('-wu', '--warmup', default=0, help="Untimed calls before every measurement")
+@click.option('-ad', '--adaptive', default=False, is_flag=True,
+              help="Repeat beyond -n until the 95% confidence interval of the median is within --rel-ci")
+@click.option('-rc', '--rel-ci', default=0.05, help="Target confidence interval width relative to the median")
+@click.option('-mr', '--max-repeat', default=100, help="Upper limit of repetitions in adaptive mode")
+@click.option('-pc', '--pin-core', type=int, default=None,
+              help="Pin the measuring process to this core, pool workers keep the core the scheduler pinned them to")
+@click.option('-ngc', '--no-gc', default=False, is_flag=True, help="Disable the garbage collector while measuring")
+def evaluate(warmup, adaptive, rel_ci, max_repeat, pin_core, no_gc):
     """Evaluates conave hull implementations"""
-    pass
+    configure_benchmark(warmup=warmup, adaptive=adaptive, rel_ci=rel_ci, max_repeat=max_repeat, core=pin_core,
+                        disable_gc=no_gc)
 
 
 evaluate.add_command(realsense)
 
 
 @evaluate.command()
-@click.option('-i', '--input-file', type=click.Path(exists=True), default=DEFAULT_TEST_FILE)
+@click.option('-i', '--input-file', type=click.Path(), default=DEFAULT_TEST_FILE, callback=resolve_point_file)
 @click.option('-sd', '--save-directory', type=click.Path(exists=True), default=DEFAULT_PL_SAVE_DIR)
 @click.option('-xy', '--xy-thresh', default=10.0)
 @click.option('-a', '--alpha', default=0.0)
@@ -51,7 +73,7 @@ def polylidar(input_file, save_directory, alpha, xy_thresh, number_iter, plot):
 
 
 @evaluate.command()
-@click.option('-i', '--input-file', type=click.Path(exists=True), default=DEFAULT_TEST_FILE)
+@click.option('-i', '--input-file', type=click.Path(), default=DEFAULT_TEST_FILE, callback=resolve_point_file)
 @click.option('-sd', '--save-directory', type=click.Path(exists=True), default=DEFAULT_CGAL_SAVE_DIR)
 @click.option('-a', '--alpha', default=100.0)
 @click.option('-n', '--number-iter', default=1)
@@ -63,7 +85,7 @@ def cgal(input_file, save_directory, alpha, number_iter, plot):
 
 
 @evaluate.command()
-@click.option('-i', '--input-file', type=click.Path(exists=True), default=DEFAULT_TEST_FILE)
+@click.option('-i', '--input-file', type=click.Path(), default=DEFAULT_TEST_FILE, callback=resolve_point_file)
 @click.option('-sd', '--save-directory', type=click.Path(exists=True), default=DEFAULT_SL_SAVE_DIR)
 @click.option('-db', '--database', type=click.Path(exists=False), default=DEFAULT_SPATIALITE_DB)
 @click.option('-f', '--factor', default=3.0)
@@ -75,7 +97,7 @@ def spatialite(input_file, save_directory, database, factor, number_iter):
 
 
 @evaluate.command()
-@click.option('-i', '--input-file', type=click.Path(exists=True), default=DEFAULT_TEST_FILE)
+@click.option('-i', '--input-file', type=click.Path(), default=DEFAULT_TEST_FILE, callback=resolve_point_file)
 @click.option('-sd', '--save-directory', type=click.Path(exists=True), default=DEFAULT_PG_SAVE_DIR)
 @click.option('-db', '--database', default=DEFAULT_PG_CONN)
 @click.option('-tp', '--target-percent', default=0.90)
@@ -88,13 +110,21 @@ def postgis(input_file, save_directory, database, target_percent, number_iter):
 
 @evaluate.command()
 @click.option('-cf', '--config-file', type=click.Path(exists=True))
-@click.option('-i', '--input-file', type=click.Path(exists=True), default=DEFAULT_TEST_FILE)
+@click.option('-i', '--input-file', type=click.Path(), default=DEFAULT_TEST_FILE, callback=resolve_point_file)
 @click.option('-n', '--number-iter', default=1)
+@click.option('-w', '--workers', default=1, help="Processes for CPU bound algorithms (polylidar, cgal), 0 is serial")
+@click.option('-dw', '--db-workers', default=1, help="Processes for database algorithms (spatialite, postgis), 0 is serial")
+@click.option('-r', '--resume', default=False, is_flag=True, help="Skip jobs already completed in the results csv")
+@click.option('-p', '--plan-file', type=click.Path(exists=True), help="Reuse a parameter plan saved by 'evaluate plan'")
+@click.option('-hs', '--history', default=False, is_flag=True,
+              help="Record the timings and environment of the run in the benchmark history")
+@click.option('-rn', '--run-name', default=None, help="Label of the run in the benchmark history")
 @click.pass_context
-def all(ctx, config_file, input_file, number_iter):
+def all(ctx, config_file, input_file, number_iter, workers, db_workers, resume, plan_file, history, run_name):
     """Evaluates all concave hull algorithms on state shapes"""
     if config_file is not None:
-        run_as_config(config_file)
+        run_as_config(config_file, cpu_workers=workers, db_workers=db_workers, resume=resume, plan_file=plan_file,
+                      history=history, run_name=run_name)
 
     else:
         ctx.forward(polylidar)
@@ -103,6 +133,123 @@ def all(ctx, config_file, input_file, number_iter):
         ctx.forward(postgis)
 
 
+@evaluate.command()
+@click.option('-cf', '--config-file', type=click.Path(exists=True), required=True)
+@click.option('-o', '--output-file', type=click.Path(exists=False), default=None,
+              help="Save the plan as json, reusable with 'evaluate all -p'")
+@click.option('-op', '--optimize', default=False, is_flag=True,
+              help="Replace the hand tuned parameters with the ones minimizing l2 (see evaluate optimize)")
+def plan(config_file, output_file, optimize):
+    """Plans the parameters of every (shape, number of points, algorithm) of a config"""
+    with open(config_file) as f:
+        config = json.load(f)
+    planned = plan_config(config)
+    if optimize:
+        optimize_plan(planned, config, cache=ParamCache())
+    df = pd.json_normalize(plan_records(planned))
+    print(df.drop(columns=[column for column in df.columns if column.endswith('gt_fpath')]).to_string())
+    if output_file:
+        save_plan(output_file, planned)
+
+
+@evaluate.command()
+@click.option('-i', '--input-file', type=click.Path(), default=DEFAULT_TEST_FILE, callback=resolve_point_file)
+@click.option('-gt', '--gt-file', type=click.Path(exists=True), default=None,
+              help="Ground truth geojson, defaults to the gt shape named by the point file ({shape}_{n})")
+@click.option('-a', '--alphas', cls=PythonLiteralOption, default="[0.5, 4.0, 36]",
+              help="Alphas as np.linspace arguments in multiples of the nominal alpha")
+@click.option('-f', '--factors', cls=PythonLiteralOption, default="None",
+              help="Optional spatialite factors as np.linspace arguments, e.g. [0.5, 4.0, 15]")
+@click.option('-o', '--output-file', type=click.Path(exists=False), default=None, help="Save the curves as csv")
+def sweep_alpha(input_file, gt_file, alphas, factors, output_file):
+    """Accuracy vs alpha curve of a point file from a single Delaunay triangulation"""
+    if gt_file is None:
+        gt_file = path.join(DEFAULT_GT_DIR, Path(input_file).stem.split('_')[0] + '.geojson')
+    points = load_points(input_file)
+    gt = load_ground_truth(gt_file)
+    sweep = TriangleSweep(points, gt)
+    nominal = gt.alpha(points.shape[0])
+    df = sweep.alpha_curve(np.linspace(*alphas) * nominal)
+    print("Nominal alpha: {:.3f}".format(nominal))
+    print(df.to_string())
+    if factors is not None:
+        factor_df = sweep.factor_curve(np.linspace(*factors))
+        print(factor_df.to_string())
+        df = pd.concat([df.assign(parameter='alpha'), factor_df.assign(parameter='factor')], ignore_index=True)
+    if output_file:
+        df.to_csv(output_file, index=False)
+
+
+@evaluate.command()
+@click.option('-i', '--input-file', type=click.Path(), default=DEFAULT_TEST_FILE, callback=resolve_point_file)
+@click.option('-gt', '--gt-file', type=click.Path(exists=True), default=None,
+              help="Ground truth geojson, defaults to the gt shape named by the point file ({shape}_{n})")
+@click.option('-a', '--algs', type=click.Choice(['polylidar', 'cgal', 'spatialite', 'postgis']), multiple=True,
+              default=['polylidar', 'cgal', 'spatialite', 'postgis'])
+@click.option('-nc', '--no-cache', default=False, is_flag=True, help="Ignore and do not update the disk cache")
+def optimize(input_file, gt_file, algs, no_cache):
+    """Searches the parameter of each algorithm minimizing l2 on a point file"""
+    if gt_file is None:
+        gt_file = path.join(DEFAULT_GT_DIR, Path(input_file).stem.split('_')[0] + '.geojson')
+    results = optimize_params(input_file, gt_file, algs=algs, cache=None if no_cache else ParamCache())
+    print(pd.DataFrame.from_dict(results, orient='index'))
+
+
+@evaluate.command()
+@click.option('-i', '--input-file', type=click.Path(exists=True), default=None,
+              help="Record an existing timing csv (e.g. all_timings.csv) with the current environment")
+@click.option('-rn', '--run-name', default=None, help="Label of the recorded run")
+def history(input_file, run_name):
+    """Lists the runs of the benchmark history, or records a timing csv"""
+    if input_file is not None:
+        df = pd.read_csv(input_file)
+        save_run(df, collect_environment(algs=sorted(df['alg'].unique())), name=run_name)
+    print(list_runs().to_string())
+
+
+@evaluate.command()
+@click.option('-b', '--base', default='previous', help="Baseline run id or directory, 'previous' by default")
+@click.option('-n', '--new', default='latest', help="New run id or directory, 'latest' by default")
+@click.option('-a', '--alpha', default=0.01, help="Family wise significance level of the slowdown tests")
+@click.option('-ms', '--min-slowdown', default=0.05, help="Relative median increase below which nothing is flagged")
+@click.option('-o', '--output-file', type=click.Path(exists=False), default=None, help="Save the comparison as csv")
+@click.pass_context
+def compare(ctx, base, new, alpha, min_slowdown, output_file):
+    """Flags statistically significant slowdowns between two recorded runs"""
+    base_df, base_env = load_run(base)
+    new_df, new_env = load_run(new)
+    for key, (base_value, new_value) in environment_changes(base_env, new_env).items():
+        print("{}: {} -> {}".format(key, base_value, new_value))
+    df = compare_runs(base_df, new_df, alpha=alpha, min_slowdown=min_slowdown)
+    print(df.to_string())
+    if output_file:
+        df.to_csv(output_file, index=False)
+    regressions = df[df['regression']]
+    if not regressions.empty:
+        logger.warning("%d of %d benchmarks regressed", len(regressions), len(df))
+        # Non zero exit status so scripts (e.g. CI) can fail on a regression
+        ctx.exit(1)
+
+
+@evaluate.command()
+@click.option('-i', '--input-file', type=click.Path(), default=DEFAULT_TEST_FILE, callback=resolve_point_file,
+              help="Point file, .npy fixtures are memory mapped and never fully loaded")
+@click.option('-a', '--alpha', type=float, required=True, help="Triangles of circumradius < alpha form the shape")
+@click.option('-t', '--tiles', cls=PythonLiteralOption, default="[4, 4]", help="Number of tiles along x and y")
+@click.option('-w', '--workers', default=0, help="Processes computing tiles, 0 runs them serially")
+@click.option('-c', '--check', default=False, is_flag=True,
+              help="Compare with the monolithic alpha shape, only meant for small clouds")
+@click.option('-o', '--output-file', type=click.Path(exists=False), default=None, help="Save the polygon as geojson")
+def tiled(input_file, alpha, tiles, workers, check, output_file):
+    """Alpha shape of a point file larger than RAM, computed tile by tile"""
+    polygon, timings = benchmark(lambda: tiled_concave_hull(input_file, alpha, tiles=tuple(tiles), workers=workers))
+    print("Tiled alpha shape: {:.1f} ms, area {:.3f}".format(timings[0], polygon.area))
+    if check:
+        print(check_tiled(input_file, alpha, tiles=tuple(tiles), workers=workers))
+    if output_file:
+        save_shapely(polygon, output_file, alg='polylidar_tiled')
+
+
 def create_records(timings, shape_name, num_points, l2_norm, alg='polylidar', section='all', has_hole=False, **kwargs):
     records = []
     # backwards compatability to previous function, if only 1 timing for this poly, integrate timing and accuracy into one record
@@ -122,46 +269,32 @@ def create_records(timings, shape_name, num_points, l2_norm, alg='polylidar', se
     return records
 
 
-def run_tests(point_fpath, config):
+def run_tests(point_fpath, config=None, algs=None, plan=None):
+    """Runs algorithms on a {shape}_{num_points} point fixture
+    Parameters are looked up in plan ({alg: params}, see planner), else planned from config.
+    """
     records = []
     file_name = Path(point_fpath).stem
     shape_name, num_points = file_name.split('_')
-    gt_fpath = config['common_alg_params']['gt_fpath']
     num_points = int(num_points)
 
-    # Global algorithm parameters
-    alg_params = dict(config['alg_params'])
-
-    # Check if there are individual alg parameters for this test params, if so then update
-    if config['tests'].get(shape_name):
-        test_alg_params = config['tests'].get(shape_name)
-        alg_params.update(**test_alg_params)
-
-    # Skip if number of points not requested for a test
-    if not num_points in config['n_points'] or not shape_name in config['shapes']:
-        logger.info("Skipping file %r", file_name)
-        return records
+    if plan is None:
+        # Skip if number of points not requested for a test
+        if not num_points in config['n_points'] or not shape_name in config['shapes']:
+            logger.info("Skipping file %r", file_name)
+            return records
+        plan = plan_test_params(config, shape_name, num_points, algs=algs)
+    algs = list(plan) if algs is None else algs
 
-    global_kwargs = config['common_alg_params']
-    # Final params for this test
-    polylidar_kwargs = dict(**global_kwargs, **alg_params['polylidar'])
-    cgal_kwargs = dict(**global_kwargs, **alg_params['cgal'])
-    spatialite_kwargs = dict(**global_kwargs, **alg_params['spatialite'])
-    postgis_kwargs = dict(**global_kwargs, **alg_params['postgis'])
-
-    # alpha can be smaller for cgal and polylidar when the point density is higher
-    # spatialite and postgis parameters are already normalized with point density
-    # The magic parameters are not what concern us. Only if we can get reasonable results.
-    gt_shape, _ = load_polygon(gt_fpath)
-    point_density = gt_shape.area / num_points
-    alpha = math.sqrt(point_density) * 2
-    cgal_kwargs['alpha'] = alpha ** 2
-    polylidar_kwargs['alpha'] = alpha
+    polylidar_kwargs = plan.get('polylidar')
+    cgal_kwargs = plan.get('cgal')
+    spatialite_kwargs = plan.get('spatialite')
+    postgis_kwargs = plan.get('postgis')
 
     has_hole = 'holes' in point_fpath
 
     # Polylidar Timings, has more fine grain timings provided
-    if 'polylidar' in config['algs']:
+    if 'polylidar' in algs:
         _, timings, l2_norm = run_test_polylidar(
             point_fpath, **polylidar_kwargs)
         logger.info("Running Polylidar")
@@ -174,19 +307,19 @@ def run_tests(point_fpath, config):
             records.extend(create_records(timings_section, shape_name,
                                           num_points, l2_norm, alg='polylidar', section=section, has_hole=has_hole))
     # CGAL Timings
-    if 'cgal' in config['algs']:
+    if 'cgal' in algs:
         logger.info("Running CGAL")
         _, timings, l2_norm = run_test_cgal(point_fpath, **cgal_kwargs)
         records.extend(create_records(timings, shape_name,
                                       num_points, l2_norm, alg='cgal', has_hole=has_hole))
     # PostGIS Timings
-    if 'postgis' in config['algs']:
+    if 'postgis' in algs:
         logger.info("Running PostGIS")
         _, timings, l2_norm = run_test_postgis(point_fpath, **postgis_kwargs)
         records.extend(create_records(timings, shape_name,
                                       num_points, l2_norm, alg='postgis', has_hole=has_hole))
     # Spatialite Timings
-    if 'spatialite' in config['algs']:
+    if 'spatialite' in algs:
         logger.info("Running Spatialite")
         _, timings, l2_norm = run_test_spatialite(
             point_fpath, **spatialite_kwargs)
@@ -196,7 +329,11 @@ def run_tests(point_fpath, config):
 
 
 @evaluate.command()
-def polylidar_montecarlo():
+@click.option('-w', '--workers', default=0, help="Worker processes, 0 runs serially in this process")
+@click.option('-r', '--resume', default=False, is_flag=True, help="Skip polygons already completed in the results csv")
+@click.option('-bs', '--batch-size', default=0, help="Polygons run as one polylidar batch, 0 runs them one by one")
+@click.option('-t', '--threads', default=0, help="Threads running the clouds of a batch, 0 runs them back to back")
+def polylidar_montecarlo(workers, resume, batch_size, threads):
     """Runs montecarlo sims on polylidar.  All options are hardcoded"""
     polys_fpath = path.join(GENERATED_DIR, "polygons.pkl")
     polys_holes_fpath = path.join(GENERATED_DIR, "polygons_holes.pkl")
@@ -208,21 +345,21 @@ def polylidar_montecarlo():
     save_path = path.join(DEFAULT_RESULTS_SAVE_DIR, "polylidar_montecarlo.csv")
 
     total_execs = int(9800 * 4)
-    all_records = []
 
-    with tqdm(total=total_execs) as pbar:
+    # Records are written incrementally, a preempted run can be resumed
+    with tqdm(total=total_execs) as pbar, CheckpointWriter(save_path, resume=resume) as checkpoint:
         for points, polys in zip(points_list, poly_list):
             # print(points, polys)
-            records_ = run_montecarlo(points, polys, algs=['polylidar'], pbar=pbar)
-            all_records.extend(records_)
-
-    df = pd.DataFrame.from_records(all_records)
-    df.to_csv(save_path, index=False)
+            run_montecarlo(points, polys, algs=['polylidar'], pbar=pbar, processes=workers, checkpoint=checkpoint,
+                           batch_size=batch_size, threads=threads)
 
 
 @evaluate.command()
 @click.option('-po', '--polylidar-only', default=False, is_flag=True, required=False, help="Only Polylidar")
-def alphabet(polylidar_only):
+@click.option('-w', '--workers', default=0, help="Worker processes, 0 runs serially in this process")
+@click.option('-r', '--resume', default=False, is_flag=True, help="Skip letters already completed in the results csv")
+@click.option('-bs', '--batch-size', default=0, help="With --polylidar-only, letters run as one polylidar batch")
+def alphabet(polylidar_only, workers, resume, batch_size):
     """Evaluates all algorithms on an alphabet set.  Saves results in results/alphabets_results.csv"""
     points_list = [path.join(ALPHABET_DIR, "polygons_2000.pkl")]
     poly_list = [path.join(ALPHABET_DIR, "polygons.pkl")]
@@ -231,29 +368,26 @@ def alphabet(polylidar_only):
     save_path = path.join(DEFAULT_RESULTS_SAVE_DIR, fname)
 
     total_execs = int(26)
-    all_records = []
     algs = ['polylidar', 'cgal', 'spatialite', 'postgis'] if not polylidar_only else ['polylidar']
-    with tqdm(total=total_execs) as pbar:
+    with tqdm(total=total_execs) as pbar, CheckpointWriter(save_path, resume=resume) as checkpoint:
         for points, polys in zip(points_list, poly_list):
             # print(points, polys)
-            records_ = run_montecarlo(points, polys, algs=algs, pbar=pbar)
-            all_records.extend(records_)
+            run_montecarlo(points, polys, algs=algs, pbar=pbar, processes=workers, checkpoint=checkpoint,
+                           batch_size=batch_size)
 
-    df = pd.DataFrame.from_records(all_records)
-    df.to_csv(save_path, index=False)
+    if not path.exists(save_path):
+        logger.warning("No alphabet results were written to %r", save_path)
+        return
+    df = pd.read_csv(save_path)
     print(df)
 
 
 def setup_run_polylidar(poly, shape_name, has_hole, convexity, points, num_points, run_kwargs):
     polylidar_kwargs = dict(**run_kwargs)
-    point_density = poly.area / num_points
-    alpha = math.sqrt(point_density) * 2
-    polylidar_kwargs.update(dict(alpha=alpha, gt_fpath=poly))
 
     # logger.info("Running Polylidar")
     concave_poly, timings, l2_norm = run_test_polylidar(points, **polylidar_kwargs)
     is_valid = concave_poly.is_valid
-    convexity = measure_convexity_simple(poly)
     timings = np.array(timings)
     timings_section = np.sum(timings, axis=1)
 
@@ -262,10 +396,8 @@ def setup_run_polylidar(poly, shape_name, has_hole, convexity, points, num_point
 
 def setup_run_cgal(poly, shape_name, has_hole, convexity, points, num_points, run_kwargs):
     kwargs = dict(**run_kwargs)
-    point_density = poly.area / num_points
-    alpha = math.sqrt(point_density) * 2
-    alpha = alpha ** 2
-    kwargs.update(dict(alpha=alpha, gt_fpath=poly))
+    # Reuse one long lived CGAL process for the thousands of monte carlo polygons
+    kwargs.update(dict(persistent=True))
 
     # logger.info("Running Polylidar")
     concave_poly, timings, l2_norm = run_test_cgal(points, **kwargs)
@@ -276,7 +408,6 @@ def setup_run_cgal(poly, shape_name, has_hole, convexity, points, num_points, ru
 
 def setup_run_spatialite(poly, shape_name, has_hole, convexity, points, num_points, run_kwargs):
     kwargs = dict(**run_kwargs)
-    kwargs.update(dict(factor=3.0, gt_fpath=poly))
 
     # logger.info("Running Polylidar")
     concave_poly, timings, l2_norm = run_test_spatialite(points, **kwargs)
@@ -287,8 +418,6 @@ def setup_run_spatialite(poly, shape_name, has_hole, convexity, points, num_poin
 
 def setup_run_postgis(poly, shape_name, has_hole, convexity, points, num_points, run_kwargs):
     kwargs = dict(**run_kwargs)
-    target_percent = poly.area / poly.convex_hull.area
-    kwargs.update(dict(target_percent=target_percent, gt_fpath=poly))
 
     # logger.info("Running Polylidar")
     concave_poly, timings, l2_norm = run_test_postgis(points, **kwargs)
@@ -297,37 +426,180 @@ def setup_run_postgis(poly, shape_name, has_hole, convexity, points, num_points,
     return create_records(timings, shape_name, num_points, l2_norm, 'postgis', 'all', has_hole=has_hole, convexity=convexity)
 
 
-def run_montecarlo(points_dict_fpath, polygon_fpath, algs=['polylidar', 'cgal', 'spatialite', 'postgis'], pbar=None):
-    poly_list, poly_params = pickle.load(open(polygon_fpath, 'rb'))
-    points_dict = pickle.load(open(points_dict_fpath, 'rb'))
+def iter_montecarlo(points_dict_fpath, polygon_fpath, indices=None):
+    """Yields (index, polygon, points, polygon params) for every polygon of a monte carlo dataset
+    Datasets (see test_generation.dataset) are read lazily, one polygon at a time. indices optionally
+    restricts the iteration to a subset (e.g. Dataset.shard) of the polygons.
+    """
+    if has_dataset(polygon_fpath) and has_dataset(points_dict_fpath):
+        polygons, points = Dataset(polygon_fpath), Dataset(points_dict_fpath)
+        for i in range(len(polygons)) if indices is None else indices:
+            yield i, polygons.polygon(i), points.points(i), points.params(i)
+        return
+
+    poly_list, poly_params = load_polygons(polygon_fpath)
+    points_dict = load_points_records(points_dict_fpath)
+    if indices is not None:
+        indices = set(indices)
+    for i, (poly, point_dict) in enumerate(zip(poly_list, points_dict)):
+        if indices is None or i in indices:
+            yield i, poly, point_dict['points'], point_dict.get('poly_param')
+
+
+MONTECARLO_RUN_KWARGS = dict(n=1, save_poly=False)
+
+
+def montecarlo_run_kwargs(gt, num_points, algs):
+    """Planned run_test keyword arguments of every algorithm for a monte carlo polygon, without the ground truth"""
+    plan = plan_polygon_params(gt, num_points, algs=algs)
+    return {alg: dict(MONTECARLO_RUN_KWARGS, **params) for alg, params in plan.items()}
 
+
+def polygon_info(i, poly, poly_param):
+    """Name, holes and convexity of a monte carlo polygon as reported in its records"""
+    poly_name = poly_param.get('name') if poly_param.get('name') else str(i)
+    return poly_name, len(poly.interiors) > 0, measure_convexity_simple(poly)
+
+
+def run_montecarlo_polygon(i, poly, points, poly_param, algs):
+    """Runs every algorithm on a single monte carlo polygon"""
     records = []
+    num_points = points.shape[0]
+    poly_name, has_hole, convexity = polygon_info(i, poly, poly_param)
+    # Prepared once and shared by every algorithm's l2 evaluation
+    gt = ground_truth(poly)
+    run_kwargs = {alg: dict(params, gt_fpath=gt) for alg, params in montecarlo_run_kwargs(gt, num_points, algs).items()}
+    if 'polylidar' in algs:
+        record = setup_run_polylidar(poly, poly_name, has_hole, convexity, points, num_points, run_kwargs['polylidar'])
+        records.extend(record)
+    if 'cgal' in algs:
+        record = setup_run_cgal(poly, poly_name, has_hole, convexity, points, num_points, run_kwargs['cgal'])
+        records.extend(record)
+    if 'spatialite' in algs:
+        record = setup_run_spatialite(poly, poly_name, has_hole, convexity, points, num_points, run_kwargs['spatialite'])
+        records.extend(record)
+    if 'postgis' in algs:
+        record = setup_run_postgis(poly, poly_name, has_hole, convexity, points, num_points, run_kwargs['postgis'])
+        records.extend(record)
+    return records
 
-    run_kwargs = dict(n=1, save_poly=False)
-    for i, (poly, point_dict) in enumerate(zip(poly_list, points_dict)):
-        points = point_dict['points']
-        num_points = points.shape[0]
-        poly_name = point_dict.get('poly_param').get('name') if point_dict.get('poly_param').get('name') else str(i)
-        has_hole = len(poly.interiors) > 0
-        convexity = measure_convexity_simple(poly)
-        if 'polylidar' in algs:
-            record = setup_run_polylidar(poly, poly_name, has_hole, convexity, points, num_points, run_kwargs)
-            records.extend(record)
-        if 'cgal' in algs:
-            record = setup_run_cgal(poly, poly_name, has_hole, convexity, points, num_points, run_kwargs)
-            records.extend(record)
-        if 'spatialite' in algs:
-            record = setup_run_spatialite(poly, poly_name, has_hole, convexity, points, num_points, run_kwargs)
-            records.extend(record)
-        if 'postgis' in algs:
-            record = setup_run_postgis(poly, poly_name, has_hole, convexity, points, num_points, run_kwargs)
-            records.extend(record)
 
+def run_montecarlo_task(i, *args):
+    return i, run_montecarlo_polygon(i, *args)
+
+
+def run_montecarlo_polylidar_batch(tasks, threads=0):
+    """Runs polylidar on a chunk of monte carlo polygons as one batch (see polylidar_evaluation.get_polygons)
+    The point clouds are concatenated and their shapely polygons built together, records match the
+    per polygon run.
+
+    Returns:
+        List[Tuple[int, List[dict]]] -- Index and records of every polygon
+    """
+    gts = [ground_truth(poly) for _, poly, _, _, _ in tasks]
+    num_points = [points.shape[0] for _, _, points, _, _ in tasks]
+    alphas = [montecarlo_run_kwargs(gt, n, ['polylidar'])['polylidar']['alpha'] for gt, n in zip(gts, num_points)]
+    points = np.concatenate([points for _, _, points, _, _ in tasks])
+    polygons, timings = get_polygons(points, np.r_[0, np.cumsum(num_points)], alpha=alphas,
+                                     n=MONTECARLO_RUN_KWARGS['n'], workers=threads)
+    results = []
+    for (i, poly, _, poly_param, _), gt, n, concave_poly, cloud_timings in zip(tasks, gts, num_points, polygons, timings):
+        poly_name, has_hole, convexity = polygon_info(i, poly, poly_param)
+        if concave_poly is None:
+            logger.error("No polygons returned for polylidar on polygon %s", poly_name)
+            l2_norm = np.nan
+        else:
+            l2_norm = evaluate_l2(gt, concave_poly)
+        # Rows of NaN pad calls of other clouds of the batch
+        cloud_timings = cloud_timings[~np.isnan(cloud_timings).all(axis=1)]
+        timings_section = np.nansum(cloud_timings, axis=1)
+        results.append((i, create_records(timings_section, poly_name, n, l2_norm, 'polylidar', 'all',
+                                          has_hole=has_hole, convexity=convexity)))
+    return results
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def init_montecarlo_worker(algs, core_queue):
+    """Pins the worker and opens its algorithm sessions (CGAL worker, DB connections) once"""
+    pin_worker(core_queue)
+    if 'cgal' in algs:
+        get_cgal_worker()
+    if 'spatialite' in algs:
+        get_spatialite_session()
+    if 'postgis' in algs:
+        get_postgis_pool()
+
+
+def run_montecarlo(points_dict_fpath, polygon_fpath, algs=['polylidar', 'cgal', 'spatialite', 'postgis'], pbar=None,
+                   processes=0, max_in_flight=None, checkpoint=None, batch_size=0, threads=0):
+    """Runs algs on every polygon of a monte carlo dataset
+    With processes > 0 the (polygon, points) pairs are streamed to a pool of workers, at most max_in_flight
+    (default 2 per worker) are pending at once. Records are identical to the serial run apart from row order.
+    With a checkpoint the records are written to it as they finish (and not returned) and (polygon, algorithm)
+    pairs it already completed are skipped.
+    Polylidar only runs with batch_size > 0 process chunks of batch_size polygons as one batch, each run on
+    threads threads (see run_montecarlo_polylidar_batch).
+    """
+    dataset = Path(points_dict_fpath).stem
+    batched = batch_size > 0 and list(algs) == ['polylidar']
+    # Parameter hash and algorithms of every submitted polygon, a job is keyed by the parameters it actually ran with
+    submitted = dict()
+
+    def pending_tasks():
+        for i, poly, points, poly_param in iter_montecarlo(points_dict_fpath, polygon_fpath):
+            algs_ = algs
+            if checkpoint is not None:
+                run_kwargs = montecarlo_run_kwargs(ground_truth(poly), points.shape[0], algs)
+                phashes = {alg: params_hash(dict(run_kwargs[alg], batched=batched)) for alg in algs}
+                algs_ = [alg for alg in algs if not checkpoint.is_done(dataset, i, alg, phashes[alg])]
+                if algs_:
+                    submitted[i] = phashes, algs_
+            if algs_:
+                yield i, poly, points, poly_param, algs_
+            elif pbar:
+                pbar.update(1)
+
+    records = []
+
+    def collect(i, records_):
+        if checkpoint is None:
+            records.extend(records_)
+        else:
+            phashes, algs_ = submitted.pop(i)
+            for alg in algs_:
+                checkpoint.write([record for record in records_ if record['alg'] == alg], dataset, i, phashes[alg],
+                                 algs=[alg])
         if pbar:
             pbar.update(1)
 
-        # if i > 1:
-        #     break;
+    if processes < 1:
+        if batched:
+            for chunk in chunked(pending_tasks(), batch_size):
+                for i, records_ in run_montecarlo_polylidar_batch(chunk, threads):
+                    collect(i, records_)
+            return records
+        for task in pending_tasks():
+            collect(task[0], run_montecarlo_polygon(*task))
+        return records
+
+    max_in_flight = processes * 2 if max_in_flight is None else max_in_flight
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_montecarlo_worker,
+                             initargs=(algs, create_core_queue(processes))) as executor:
+        if batched:
+            chunks = ((chunk, threads) for chunk in chunked(pending_tasks(), batch_size))
+            for results in imap_bounded(executor, run_montecarlo_polylidar_batch, chunks, max_in_flight):
+                for i, records_ in results:
+                    collect(i, records_)
+            return records
+        for i, records_ in imap_bounded(executor, run_montecarlo_task, pending_tasks(), max_in_flight):
+            collect(i, records_)
 
     return records
 
@@ -337,24 +609,68 @@ def run_montecarlo(points_dict_fpath, polygon_fpath, algs=['polylidar', 'cgal',
 #     run_realsense_tests()
 
 
-def run_as_config(config_file):
+def run_test_job(alg, point_fpath, params):
+    """A single (file, algorithm) job executed by the scheduler"""
+    logger.info("Processing file %r with %s", Path(point_fpath).name, alg)
+    return run_tests(point_fpath, algs=[alg], plan={alg: params})
+
+
+def run_as_config(config_file, cpu_workers=1, db_workers=1, resume=False, plan_file=None, history=False, run_name=None):
     with open(config_file) as f:
         config = json.load(f)
 
+    # Parameters of every (shape, num_points) test are planned up front, or reused from a saved plan
+    plan = load_plan(plan_file) if plan_file else plan_config(config)
+
     directory_name = config['points_dir']
-    gt_dir = config['gt_dir']
     filenames = listdir(directory_name)
-    point_files = [
-        filename for filename in filenames if filename.endswith('.csv')]
-    all_records = []
-    for point_file in point_files:
+    # Binary (.npy) fixtures are preferred over their text (.csv) counterparts
+    point_files = [filename for filename in filenames if filename.endswith('.npy')]
+    point_files.extend([filename for filename in filenames if filename.endswith('.csv') and
+                        Path(filename).stem + '.npy' not in filenames])
+    # Only {shape}_{num_points} fixtures of the configured shapes, the monte carlo point records (e.g.
+    # polygons_2000) live in the same directory
+    def is_shape_fixture(filename):
+        parts = Path(filename).stem.split('_')
+        return len(parts) == 2 and parts[0] in config['shapes'] and parts[1].isdigit()
+    point_files = [filename for filename in point_files if is_shape_fixture(filename)]
+    tests = [(shape_name, int(num_points)) for shape_name, num_points in
+             (Path(point_file).stem.split('_') for point_file in point_files)]
+    # A saved plan may not cover every configured algorithm, fail before any job runs
+    missing = missing_plan_params(plan, [test for test in tests if test in plan], config['algs'])
+    if missing:
+        raise ValueError("Plan {} has no parameters for {} (shape, points, alg) tests, e.g. {}. Replan with "
+                         "'evaluate plan'".format(plan_file, len(missing), missing[:3]))
+    # Fan out every planned (file, algorithm) pair as its own job
+    jobs = []
+    for point_file, test in zip(point_files, tests):
         # if 'caholes_64000' not in point_file:
         #     continue
-        logger.info("Processing file %r", point_file)
+        test_plan = plan.get(test)
+        if test_plan is None:
+            logger.info("Skipping file %r", point_file)
+            continue
         point_fpath = path.join(directory_name, point_file)
-        gt_fpath = path.join(gt_dir, point_file.split('_')[0] + '.geojson')
-        config['common_alg_params']['gt_fpath'] = gt_fpath
-        all_records.extend(run_tests(point_fpath, config))
+        for alg in config['algs']:
+            jobs.append((alg, point_fpath, test_plan[alg]))
+
+    # Records are written to save_csv as jobs finish, a rerun with resume skips completed jobs
+    def job_key(job):
+        alg, point_fpath, params = job
+        return Path(point_fpath).stem, 0, alg, params_hash(params)
+
+    with CheckpointWriter(config['save_csv'], resume=resume) as checkpoint:
+        jobs = [job for job in jobs if not checkpoint.is_done(*job_key(job))]
+
+        def write_job(job, records):
+            dataset, poly_idx, alg, phash = job_key(job)
+            checkpoint.write(records, dataset, poly_idx, phash, algs=[alg])
+
+        with tqdm(total=len(jobs)) as pbar:
+            run_jobs(run_test_job, jobs, cpu_workers=cpu_workers, db_workers=db_workers, pbar=pbar,
+                     on_result=write_job)
 
-    df = pd.DataFrame.from_records(all_records)
-    df.to_csv(config['save_csv'], index=False)
+        if history:
+            # Only the records measured by this invocation, not those of resumed sessions
+            save_run(checkpoint.session_records(), collect_environment(config['algs'], config['alg_params']),
+                     name=run_name)
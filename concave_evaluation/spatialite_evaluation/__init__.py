@@ -1,12 +1,13 @@
 
-import time
 from os import path
 import sqlite3
+import atexit
 import numpy as np
 from shapely.geometry import asMultiPoint, asPoint
 from shapely.wkb import dumps, loads
 
-from concave_evaluation.helpers import save_shapely, modified_fname, load_polygon, evaluate_l2
+from concave_evaluation.helpers import save_shapely, modified_fname, ground_truth, evaluate_l2, load_points
+from concave_evaluation.helpers.benchmark import benchmark
 from concave_evaluation import (DEFAULT_SPATIALITE_DB, DEFAULT_TEST_FILE, DEFAULT_SL_SAVE_DIR)
 INIT_TABLE = """
 SELECT DropGeoTable('concave');
@@ -20,43 +21,50 @@ SELECT AddGeometryColumn('concave', 'Geometry', -1, 'MultiPoint', 'XY');
 SELECT CreateSpatialIndex('concave', 'Geometry');
 """
 
+# Sessions skip the spatial index, extract_concave_hull never uses it
+INIT_SESSION_TABLE = INIT_TABLE.replace("SELECT CreateSpatialIndex('concave', 'Geometry');", "")
 
-def insert_multipoint(conn, points, test_name='test'):
-    multipoint = asMultiPoint(points)
+CLEAR_TABLE = "DELETE FROM concave;"
 
-    wkb = multipoint.wkb
-    # print(wkb)
-    query = """
+# Query text is kept constant so sqlite3 reuses its cached prepared statements
+INSERT_QUERY = """
     INSERT INTO concave
     (test_name, Geometry)
     VALUES (?, MPointFromWKB(?, -1))
     """
-    conn.execute(query, (test_name, wkb))
-    conn.commit()
 
-
-def extract_concave_hull(conn, test_name, n=1, factor=1.0):
-    query = """
+CONCAVE_QUERY = """
     SELECT ST_AsBinary(ST_ConcaveHull(Geometry, ?, 1)) as polygon
     FROM concave
     WHERE test_name == ?
     """
-    # Start Timing here
-    timings = []
-    for i in range(n):
-        t0 = time.time()
-        cursor = conn.execute(query, (factor, test_name))
-        result = cursor.fetchone()
-        t1 = time.time()
-        time_ms = (t1 - t0) * 1000
-        timings.append(time_ms)
+
+
+def insert_multipoint(conn, points, test_name='test'):
+    multipoint = asMultiPoint(points)
+
+    wkb = multipoint.wkb
+    # print(wkb)
+    conn.execute(INSERT_QUERY, (test_name, wkb))
+    conn.commit()
+
+
+def extract_concave_hull(conn, test_name, n=1, factor=1.0):
+    # Only the query and fetching its result are timed
+    result, timings = benchmark(lambda: conn.execute(CONCAVE_QUERY, (factor, test_name)).fetchone(), n=n)
     polygon = loads(result['polygon'])
 
     return polygon, timings
 
 
+def measure_latency(conn, n=10):
+    """Median round trip (ms) of a trivial query, the floor of any per test overhead"""
+    _, timings = benchmark(lambda: conn.execute("SELECT 1").fetchone(), n=n)
+    return float(np.median(timings))
+
+
 class DBConn(object):
-    def __init__(self, db_path, use_row=True, extension_path=None):
+    def __init__(self, db_path, use_row=True, extension_path=None, init_table=INIT_TABLE):
         """ Sets up Database connection and loads in the spatialite extension """
         self.conn = sqlite3.connect(db_path, check_same_thread=False)
         self.conn.enable_load_extension(True)
@@ -67,10 +75,54 @@ class DBConn(object):
         # Initialize if this is a new database
         if db_path == ':memory:' or not path.exists(db_path):
             self.conn.execute("SELECT InitSpatialMetaData(1);")
-        self.conn.executescript(INIT_TABLE)
+        self.conn.executescript(init_table)
         self.conn.row_factory = sqlite3.Row if use_row else dict_factory
         self.cursor = self.conn.cursor()
 
+    def close(self):
+        self.cursor.close()
+        self.conn.close()
+
+
+class SpatialiteSession(object):
+    def __init__(self, db_path=DEFAULT_SPATIALITE_DB, extension_path=None):
+        """A spatialite connection initialized once per process
+        The extension stays loaded, the spatial metadata and concave table are created once and
+        the rows are cleared between tests. Use as a context manager around each test.
+        """
+        self.db = DBConn(db_path, use_row=True, extension_path=extension_path, init_table=INIT_SESSION_TABLE)
+        self.conn = self.db.conn
+
+    def clear(self):
+        self.conn.execute(CLEAR_TABLE)
+        self.conn.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *args):
+        self.clear()
+
+
+_SESSIONS = dict()
+
+
+def get_spatialite_session(db_path=DEFAULT_SPATIALITE_DB):
+    """Returns the spatialite session of this process for db_path, created on first use"""
+    if db_path not in _SESSIONS:
+        _SESSIONS[db_path] = SpatialiteSession(db_path)
+        atexit.register(_SESSIONS[db_path].close)
+    return _SESSIONS[db_path]
+
+
+def library_versions(db_path=DEFAULT_SPATIALITE_DB):
+    """Versions of spatialite and the GEOS it links against"""
+    row = get_spatialite_session(db_path).conn.execute("SELECT spatialite_version(), geos_version()").fetchone()
+    return dict(spatialite=row[0], spatialite_geos=row[1])
+
 
 def run_test(point_fpath, save_dir=DEFAULT_SL_SAVE_DIR, db_path=DEFAULT_SPATIALITE_DB, n=1,
              factor=3.0, save_poly=True, gt_fpath=None, **kwargs):
@@ -78,13 +130,12 @@ def run_test(point_fpath, save_dir=DEFAULT_SL_SAVE_DIR, db_path=DEFAULT_SPATIALI
         points = point_fpath
         point_fpath = path.join(save_dir, 'temp_points.csv')
     else:
-        points = np.loadtxt(point_fpath)
-    db = DBConn(db_path, use_row=True)
-
+        points = load_points(point_fpath)
     save_fname, test_name = modified_fname(point_fpath, save_dir)
-    insert_multipoint(db.conn, points, test_name=test_name)
-    polygon, timings = extract_concave_hull(
-        db.conn, test_name, factor=factor, n=n)
+    with get_spatialite_session(db_path) as conn:
+        insert_multipoint(conn, points, test_name=test_name)
+        polygon, timings = extract_concave_hull(
+            conn, test_name, factor=factor, n=n)
 
     if save_poly:
         save_fname, _ = path.join(save_dir, save_poly + '.geojson'), None if isinstance(save_poly, str) else modified_fname(point_fpath, save_dir)
@@ -92,12 +143,8 @@ def run_test(point_fpath, save_dir=DEFAULT_SL_SAVE_DIR, db_path=DEFAULT_SPATIALI
 
     l2_norm = np.NaN
     # Evaluate L2 Norm if we have the ground truth data
-    # if the path is a string (nominal) then load the polygon
-    if isinstance(gt_fpath, str):
-        gt_shape, _ = load_polygon(gt_fpath)
-        l2_norm = evaluate_l2(gt_shape, polygon)
-    elif gt_fpath is not None:
-        gt_shape = gt_fpath
-        l2_norm = evaluate_l2(gt_shape, polygon)
+    # gt_fpath may be a geojson path (parsed once per process), a polygon or a GroundTruth
+    if gt_fpath is not None:
+        l2_norm = evaluate_l2(ground_truth(gt_fpath), polygon)
 
     return polygon, timings, l2_norm
@@ -1,11 +1,26 @@
 import random
+import math
+from functools import lru_cache
 from multiprocessing import Pool
+import shapely
+import shapely.wkb
 from shapely.affinity import scale, translate
 from shapely.geometry import Point
+from shapely.prepared import prep
 import numpy as np
 
 import logging
 
+from concave_evaluation.helpers import SHAPELY_2
+
+# Upper bound of candidate points drawn at once by the rejection sampler
+MAX_BATCH = 1_000_000
+# Points per independently seeded chunk of the parallel sampler
+DEFAULT_CHUNK_SIZE = 4000
+
+# Polygon shared with the sampler pool workers, set by init_poly_worker
+_WORKER_POLY = None
+
 def distance_to(point, geom):
     all_rings = []
     if geom.geom_type == 'Polygon':
@@ -22,60 +37,209 @@ def distance_to(point, geom):
     distances = [point.distance(ring) for ring in all_rings]
     return min(distances)
 
-def random_points_within_mp(poly, num_points, min_distance=0.0, processes=4):
-    points_per_processor = num_points / processes
-    num_points_list = [points_per_processor] * 4
-    args = [[poly, num_points_, min_distance, i]for i, num_points_ in enumerate(num_points_list)]
+def init_poly_worker(poly_wkb):
+    """Pool initializer, every worker deserializes the shared polygon once"""
+    global _WORKER_POLY
+    _WORKER_POLY = shapely.wkb.loads(poly_wkb)
 
-    with Pool(processes=processes) as pool:
-        points = pool.starmap(random_points_within, args)
-    
-    return np.vstack(points)
+
+def sample_chunk(poly, num_points, seed_seq, min_distance=0.0, distribution='uniform'):
+    """Samples one chunk of points from its own random stream"""
+    rng = np.random.Generator(np.random.PCG64(seed_seq))
+    if distribution == 'triangulated':
+        return random_points_triangulated(poly, num_points, rng=rng)
+    return sample_points_within(poly, num_points, rng, min_distance=min_distance)
+
+
+def sample_chunk_worker(args):
+    return sample_chunk(_WORKER_POLY, *args)
+
+
+def random_points_within_mp(poly, num_points, min_distance=0.0, processes=4, chunk_size=DEFAULT_CHUNK_SIZE, seed=0,
+                            distribution='uniform'):
+    """Generates num_points random points inside poly using a pool of processes
+    The points are split in fixed size chunks, each drawn from its own stream derived from a SeedSequence.
+    The output only depends on seed and chunk_size, it is identical for any number of processes.
+
+    Arguments:
+        poly {Polygon} -- Polygon to sample
+        num_points {int} -- Number of points
+
+    Keyword Arguments:
+        min_distance {float} -- Minimum distance of points to any ring of the polygon (default: {0.0})
+        processes {int} -- Number of worker processes, 1 or less samples in this process (default: {4})
+        chunk_size {int} -- Points per chunk, at least 1 (default: {DEFAULT_CHUNK_SIZE})
+        seed {int|Sequence[int]} -- Root seed (SeedSequence entropy) of the chunk streams (default: {0})
+        distribution {str} -- 'uniform' (rejection) or 'triangulated' sampling (default: {'uniform'})
+
+    Returns:
+        ndarray -- NX2 point array
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1, got {}".format(chunk_size))
+    num_points = int(math.ceil(num_points))
+    chunk_sizes = [chunk_size] * (num_points // chunk_size)
+    if num_points % chunk_size:
+        chunk_sizes.append(num_points % chunk_size)
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    args = [(size, seed_seq, min_distance, distribution) for size, seed_seq in zip(chunk_sizes, seed_seqs)]
+
+    if processes <= 1 or len(args) <= 1:
+        points = [sample_chunk(poly, *args_) for args_ in args]
+    else:
+        # The polygon is shipped once per worker (as WKB) instead of once per chunk
+        with Pool(processes=processes, initializer=init_poly_worker, initargs=(poly.wkb,)) as pool:
+            points = pool.map(sample_chunk_worker, args)
+
+    return np.vstack(points) if points else np.empty((0, 2))
+
+def random_points_polygon_worker(args):
+    """Samples one polygon of a list in this process, see random_points_within_mp"""
+    poly, num_points, chunk_size, seed, distribution = args
+    return random_points_within_mp(poly, num_points, processes=1, chunk_size=chunk_size, seed=seed,
+                                   distribution=distribution)
 
 def random_points_map(args):
     return random_points_within(args[0], args[1], 0.0, None)
 
+def python_random_state():
+    """Returns a numpy RandomState continuing the exact MT19937 stream of the python random module"""
+    _, internal_state, _ = random.getstate()
+    rng = np.random.RandomState()
+    rng.set_state(('MT19937', np.array(internal_state[:-1], dtype=np.uint32), internal_state[-1]))
+    return rng
+
+
+def sync_python_random(rng):
+    """Writes the state of a numpy RandomState back into the python random module"""
+    _, key, pos, _, _ = rng.get_state()
+    version, _, gauss_next = random.getstate()
+    random.setstate((version, tuple(int(k) for k in key) + (int(pos),), gauss_next))
+
+
+def get_rng_state(rng):
+    return rng.get_state() if isinstance(rng, np.random.RandomState) else rng.bit_generator.state
+
+
+def set_rng_state(rng, state):
+    if isinstance(rng, np.random.RandomState):
+        rng.set_state(state)
+    else:
+        rng.bit_generator.state = state
+
+
+def points_within_mask(poly, x, y, min_distance=0.0):
+    """Mask of the candidate points strictly inside poly (and at least min_distance from its boundary)"""
+    if SHAPELY_2:
+        mask = shapely.contains_xy(poly, x, y)
+        if min_distance > 0.0 and mask.any():
+            candidates = shapely.points(x[mask], y[mask])
+            mask[mask] = shapely.distance(poly.boundary, candidates) >= min_distance
+        return mask
+    prepared_poly = prep(poly)
+    return np.array([prepared_poly.contains(Point(x_, y_)) and
+                     (min_distance == 0.0 or distance_to(Point(x_, y_), poly) >= min_distance)
+                     for x_, y_ in zip(x, y)], dtype=bool)
+
+
+def sample_points_within(poly, num_points, rng, min_distance=0.0, max_batch=MAX_BATCH):
+    """Vectorized rejection sampler of points uniformly distributed inside a polygon
+    Candidate blocks are drawn as interleaved (x, y) uniforms over the bounding box, the same order as
+    drawing one point at a time. The block size adapts to the polygon/bounding box area ratio. The random
+    stream is rewound to just after the last accepted candidate so rng ends in the same state as the scalar loop.
+
+    Arguments:
+        poly {Polygon} -- Polygon to sample
+        num_points {int} -- Number of points
+        rng {RandomState, Generator} -- Numpy random number generator
+
+    Keyword Arguments:
+        min_distance {float} -- Minimum distance of points to any ring of the polygon (default: {0.0})
+        max_batch {int} -- Maximum number of candidates drawn at once (default: {MAX_BATCH})
+
+    Returns:
+        ndarray -- NX2 point array
+    """
+    num_points = int(math.ceil(num_points))
+    min_x, min_y, max_x, max_y = poly.bounds
+    bbox_area = (max_x - min_x) * (max_y - min_y)
+    accept_ratio = max(poly.area / bbox_area, 1e-6) if bbox_area > 0 else 1.0
+    points = []
+    count = 0
+    while count < num_points:
+        remaining = num_points - count
+        batch = int(min(max_batch, max(64, remaining / accept_ratio * 1.2)))
+        state = get_rng_state(rng)
+        uniforms = rng.random((batch, 2))
+        x = min_x + (max_x - min_x) * uniforms[:, 0]
+        y = min_y + (max_y - min_y) * uniforms[:, 1]
+        accepted = np.flatnonzero(points_within_mask(poly, x, y, min_distance))
+        if accepted.size >= remaining:
+            accepted = accepted[:remaining]
+            # Only consume the random numbers up to the last accepted candidate
+            set_rng_state(rng, state)
+            rng.random((accepted[-1] + 1, 2))
+        points.append(np.column_stack([x[accepted], y[accepted]]))
+        count += accepted.size
+    return np.vstack(points) if points else np.empty((0, 2))
+
+
 def random_points_within(poly, num_points=2000, min_distance=0.0, seed=1):
+    """Generates num_points random points inside poly
+    Seeding and the python random stream are identical to drawing (and rejecting) one point at a time,
+    existing fixtures are reproduced exactly.
+    """
     if seed is not None:
         np.random.seed(seed)
         random.seed(seed)
-    min_x, min_y, max_x, max_y = poly.bounds
-    points = []
-    count = 0
-    while len(points) < num_points:
-        if count > 100:
-            pass
-            # logging.warn("Could not find a point after 100 iterations!")
-            # break
-        random_point = Point([random.uniform(min_x, max_x), random.uniform(min_y, max_y)])
-        if (random_point.within(poly) and (min_distance == 0.0 or distance_to(random_point, poly) >= min_distance)):
-            points.append([random_point.x, random_point.y])
-        count += 1
-    return np.array(points)
+    rng = python_random_state()
+    points = sample_points_within(poly, num_points, rng, min_distance=min_distance)
+    sync_python_random(rng)
+    return points
+
+@lru_cache(maxsize=128)
+def _triangle_table(poly_wkb):
+    if not hasattr(shapely, 'constrained_delaunay_triangles'):
+        raise RuntimeError("Triangulated sampling requires shapely >= 2.1 (constrained delaunay triangulation)")
+    poly = shapely.from_wkb(poly_wkb)
+    triangles = shapely.get_parts(shapely.constrained_delaunay_triangles(poly))
+    # Each triangle is a closed ring of 4 coordinates, drop the closing one
+    vertices = shapely.get_coordinates(triangles).reshape(-1, 4, 2)[:, :3]
+    edge_1 = vertices[:, 1] - vertices[:, 0]
+    edge_2 = vertices[:, 2] - vertices[:, 0]
+    areas = 0.5 * np.abs(edge_1[:, 0] * edge_2[:, 1] - edge_1[:, 1] * edge_2[:, 0])
+    return vertices, np.cumsum(areas)
+
+
+def triangle_table(poly):
+    """Constrained triangulation of poly (holes respected), cached per polygon
+
+    Returns:
+        Tuple[ndarray, ndarray] -- Tx3x2 triangle vertices and the cumulative triangle areas
+    """
+    return _triangle_table(poly.wkb)
+
+
+def random_points_triangulated(poly, num_points=2000, seed=1, rng=None):
+    """Generates num_points random points uniformly distributed inside poly
+    The polygon is triangulated once, then triangles are picked proportional to their area and a point is drawn
+    uniformly inside each picked triangle. Fully vectorized, no candidate is ever rejected so the cost does not
+    depend on how convex the polygon is. Draws from rng if given, else from a RandomState seeded with seed
+    (the global numpy stream if seed is None).
+    """
+    if rng is None:
+        rng = np.random if seed is None else np.random.RandomState(seed)
+    vertices, cum_areas = triangle_table(poly)
+    num_points = int(math.ceil(num_points))
+    tri_idx = np.searchsorted(cum_areas, rng.random(num_points) * cum_areas[-1], side='right')
+    tri_idx = np.minimum(tri_idx, cum_areas.shape[0] - 1)
+    # Uniform barycentric coordinates, samples outside the triangle are reflected back inside
+    uv = rng.random((num_points, 2))
+    outside = uv.sum(axis=1) > 1.0
+    uv[outside] = 1.0 - uv[outside]
+    tri = vertices[tri_idx]
+    return tri[:, 0] + uv[:, :1] * (tri[:, 1] - tri[:, 0]) + uv[:, 1:] * (tri[:, 2] - tri[:, 0])
 
-import random
-from shapely.affinity import affine_transform
-from shapely.geometry import Point, Polygon
-from shapely.ops import triangulate
-
-# def random_points_in_polygon_smarter(poly, num_points=2000, min_distance=0.0, seed=1):
-#     "Return list of num_points points chosen uniformly at random inside the polygon."
-#     areas = []
-#     transforms = []
-#     for t in triangulate(poly):
-#         areas.append(t.area)
-#         (x0, y0), (x1, y1), (x2, y2), _ = t.exterior.coords
-#         transforms.append([x1 - x0, x2 - x0, y2 - y0, y1 - y0, x0, y0])
-#     points = []
-#     for transform in random.choices(transforms, weights=areas, k=num_points):
-#         x, y = [random.random() for _ in range(2)]
-#         if x + y > 1:
-#             p = Point(1 - x, 1 - y)
-#         else:
-#             p = Point(x, y)
-#         point = affine_transform(p, transform)
-#         points.append([point.x, point.y])
-#     return np.array(points)
 
 def scale_poly(poly, max_size=200):
     bounds = poly.bounds
@@ -0,0 +1,234 @@
+"""Chunked, pickle free dataset container for generated polygons and points
+A dataset is a directory (suffix .ds) holding any of the following columns for N items:
+
+    polygons.wkb          -- concatenated WKB of every polygon
+    polygon_offsets.npy   -- int64 (N + 1) byte offsets into polygons.wkb
+    points.f64            -- concatenated float64 (num_points, dim) point clouds
+    point_offsets.npy     -- int64 (N + 1) row offsets into points.f64
+    params.json           -- parameters as columns, {name: [value of item 0, value of item 1, ...]}
+    meta.json             -- number of items, point dimension, format version
+
+Items are appended in chunks by DatasetWriter. Dataset memory maps the binary files so any item can be read
+by index without loading (or unpickling) the rest of the file.
+"""
+import os
+import json
+import pickle
+import logging
+from os import path
+
+import numpy as np
+import shapely.wkb
+
+logger = logging.getLogger("Concave")
+
+DATASET_SUFFIX = '.ds'
+DATASET_VERSION = 1
+
+
+def dataset_fpath(fpath):
+    """Returns the dataset sibling of a (pickle) fixture path"""
+    return path.splitext(str(fpath).rstrip(os.sep))[0] + DATASET_SUFFIX
+
+
+def is_dataset(fpath):
+    return path.isfile(path.join(str(fpath), 'meta.json'))
+
+
+def has_dataset(fpath):
+    """True if fpath is a dataset or an up to date dataset sibling exists"""
+    ds_fpath = dataset_fpath(fpath)
+    if not is_dataset(ds_fpath):
+        return False
+    return not path.isfile(str(fpath)) or path.getmtime(path.join(ds_fpath, 'meta.json')) >= path.getmtime(str(fpath))
+
+
+class DatasetWriter(object):
+    def __init__(self, fpath, chunk_size=1000):
+        """Appends polygons, point clouds and parameters to a dataset directory
+
+        Arguments:
+            fpath {str} -- Dataset directory, created (or replaced) on open
+
+        Keyword Arguments:
+            chunk_size {int} -- Number of buffered items that triggers a write (default: {1000})
+        """
+        self.fpath = dataset_fpath(fpath)
+        self.chunk_size = chunk_size
+        os.makedirs(self.fpath, exist_ok=True)
+        for fname in os.listdir(self.fpath):
+            os.remove(path.join(self.fpath, fname))
+        self.polygon_file = None
+        self.point_file = None
+        self.polygon_offsets = [0]
+        self.point_offsets = [0]
+        self.params = []
+        self.point_dim = None
+        self.polygons_buffer = []
+        self.points_buffer = []
+
+    def __len__(self):
+        return len(self.params)
+
+    def append(self, polygon=None, points=None, params=None):
+        """Appends one item, every item of a dataset must provide the same columns"""
+        has_polygon, has_points = polygon is not None, points is not None
+        if len(self) > 0 and (has_polygon != (self.polygon_file is not None) or has_points != (self.point_file is not None)):
+            raise ValueError("Every item of a dataset must have the same columns")
+        if has_polygon:
+            if self.polygon_file is None:
+                self.polygon_file = open(path.join(self.fpath, 'polygons.wkb'), 'wb')
+            self.polygons_buffer.append(polygon.wkb)
+            self.polygon_offsets.append(self.polygon_offsets[-1] + len(self.polygons_buffer[-1]))
+        if has_points:
+            points = np.ascontiguousarray(points, dtype=np.float64)
+            if self.point_file is None:
+                self.point_file = open(path.join(self.fpath, 'points.f64'), 'wb')
+                self.point_dim = points.shape[1]
+            if points.ndim != 2 or points.shape[1] != self.point_dim:
+                raise ValueError("Expected points of shape (N, {}), got {}".format(self.point_dim, points.shape))
+            self.points_buffer.append(points)
+            self.point_offsets.append(self.point_offsets[-1] + points.shape[0])
+        self.params.append(dict(params) if params else {})
+        if max(len(self.polygons_buffer), len(self.points_buffer)) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.polygons_buffer:
+            self.polygon_file.write(b''.join(self.polygons_buffer))
+            self.polygon_file.flush()
+            self.polygons_buffer = []
+        if self.points_buffer:
+            self.point_file.write(np.concatenate(self.points_buffer).tobytes())
+            self.point_file.flush()
+            self.points_buffer = []
+
+    def close(self):
+        """Flushes remaining items and writes the offsets, parameters and meta data"""
+        self.flush()
+        if self.polygon_file is not None:
+            self.polygon_file.close()
+            np.save(path.join(self.fpath, 'polygon_offsets.npy'), np.array(self.polygon_offsets, dtype=np.int64))
+        if self.point_file is not None:
+            self.point_file.close()
+            np.save(path.join(self.fpath, 'point_offsets.npy'), np.array(self.point_offsets, dtype=np.int64))
+        columns = sorted(set(key for params in self.params for key in params))
+        params = {column: [params.get(column) for params in self.params] for column in columns}
+        with open(path.join(self.fpath, 'params.json'), 'w') as f:
+            # numpy scalars (e.g. from np.arange) are not json serializable
+            json.dump(params, f, default=lambda value: value.item())
+        # meta.json is written last, a dataset without it is incomplete
+        with open(path.join(self.fpath, 'meta.json'), 'w') as f:
+            json.dump(dict(version=DATASET_VERSION, size=len(self), point_dim=self.point_dim), f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Dataset(object):
+    def __init__(self, fpath):
+        """Lazy, randomly addressable reader of a dataset directory (see DatasetWriter)
+
+        Arguments:
+            fpath {str} -- Dataset directory or a fixture path with a dataset sibling
+        """
+        self.fpath = str(fpath) if is_dataset(fpath) else dataset_fpath(fpath)
+        with open(path.join(self.fpath, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] > DATASET_VERSION:
+            raise ValueError("Dataset {} has unsupported version {}".format(self.fpath, self.meta['version']))
+        with open(path.join(self.fpath, 'params.json')) as f:
+            self.param_columns = json.load(f)
+        self.polygon_bytes, self.polygon_offsets = None, None
+        self.point_array, self.point_offsets = None, None
+        if path.exists(path.join(self.fpath, 'polygon_offsets.npy')):
+            self.polygon_offsets = np.load(path.join(self.fpath, 'polygon_offsets.npy'))
+            self.polygon_bytes = self.open_memmap('polygons.wkb', np.uint8, (self.polygon_offsets[-1],))
+        if path.exists(path.join(self.fpath, 'point_offsets.npy')):
+            self.point_offsets = np.load(path.join(self.fpath, 'point_offsets.npy'))
+            self.point_array = self.open_memmap('points.f64', np.float64,
+                                                (self.point_offsets[-1], self.meta['point_dim']))
+
+    def open_memmap(self, fname, dtype, shape):
+        # np.memmap can not map empty files
+        if shape[0] == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(path.join(self.fpath, fname), dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return self.meta['size']
+
+    def polygon(self, i):
+        start, end = self.polygon_offsets[i], self.polygon_offsets[i + 1]
+        return shapely.wkb.loads(self.polygon_bytes[start:end].tobytes())
+
+    def points(self, i):
+        """Read only view of the points of item i"""
+        return self.point_array[self.point_offsets[i]:self.point_offsets[i + 1]]
+
+    def params(self, i):
+        return {column: values[i] for column, values in self.param_columns.items() if values[i] is not None}
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("Dataset index {} out of range".format(i))
+        item = dict(params=self.params(i))
+        if self.polygon_offsets is not None:
+            item['polygon'] = self.polygon(i)
+        if self.point_offsets is not None:
+            item['points'] = self.points(i)
+        return item
+
+    def shard(self, index, count):
+        """Indices of the items of shard index (of count contiguous shards)"""
+        bounds = np.linspace(0, len(self), count + 1).astype(int)
+        return range(bounds[index], bounds[index + 1])
+
+    def iter(self, indices=None):
+        for i in range(len(self)) if indices is None else indices:
+            yield self[i]
+
+    def __iter__(self):
+        return self.iter()
+
+
+def save_polygons_dataset(fpath, polygons, poly_params):
+    """Saves the generated polygons and their parameters (see polygon command) as a dataset"""
+    with DatasetWriter(fpath) as writer:
+        for polygon, poly_param in zip(polygons, poly_params):
+            writer.append(polygon=polygon, params=poly_param)
+    return writer.fpath
+
+
+def save_points_dataset(fpath, records):
+    """Saves point records (see points_pkl command) as a dataset, the point clouds may differ in size"""
+    with DatasetWriter(fpath) as writer:
+        for record in records:
+            writer.append(points=record['points'], params=dict(record['poly_param'], np=record['np']))
+    return writer.fpath
+
+
+def load_polygons(fpath):
+    """Loads (polygons, polygon params) from a dataset if available, else from the pickle file"""
+    if has_dataset(fpath):
+        dataset = Dataset(fpath)
+        return [dataset.polygon(i) for i in range(len(dataset))], [dataset.params(i) for i in range(len(dataset))]
+    with open(fpath, 'rb') as f:
+        return pickle.load(f)
+
+
+def convert_pickle_dataset(fpath):
+    """Converts a polygon or point record pickle into its dataset sibling, returns the new path or None"""
+    with open(str(fpath), 'rb') as f:
+        data = pickle.load(f)
+    if isinstance(data, tuple) and len(data) == 2:
+        return save_polygons_dataset(fpath, *data)
+    elif isinstance(data, list) and data and 'points' in data[0]:
+        return save_points_dataset(fpath, data)
+    logger.info("Skipping %r, not a polygon or point record pickle", fpath)
+    return None
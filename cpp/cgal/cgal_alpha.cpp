@@ -5,6 +5,11 @@
 #include <CGAL/Delaunay_triangulation_2.h>
 #include <CGAL/algorithm.h>
 #include <CGAL/assertions.h>
+#include <CGAL/version.h>
+#include <algorithm>
+#include <cstdint>
+#include <cstdio>
+#include <exception>
 #include <fstream>
 #include <iostream>
 #include <list>
@@ -89,6 +94,8 @@ bool file_input(std::list<Point> &points, std::string file_path)
 std::vector<double> calculate_alpha_shape(std::list<Point> &points, std::vector<Segment> &segments, double alpha=1.0, int n=1)
 {
   std::vector<double> time_list;
+  // At least one alpha shape is built, its edges are returned
+  n = std::max(n, 1);
   // This loop repetitively calls alpha shape to time it
   // Note that CGAL returns only an unordered set of edges (we filter for only boundary edges)
   // It does not return a (multi)polygon with holes, which is what we desire.
@@ -105,23 +112,112 @@ std::vector<double> calculate_alpha_shape(std::list<Point> &points, std::vector<
     time_taken *= 1e-3; 
 
     time_list.push_back(time_taken);
+    // The edges of the last timed alpha shape are returned, no extra (untimed) alpha shape is built
+    if (i == n - 1)
+      segments.swap(segments_temp);
   }
-  // Here we actually push back the alpha shape to segments vector for later use
-  // this is not timed
-  Alpha_shape_2 A(points.begin(), points.end(),
-                  FT(alpha),
-                  Alpha_shape_2::GENERAL);
-  alpha_edges(A, std::back_inserter(segments));
 
   return time_list;
 }
 
+// Read exactly count items from stdin, false on EOF or error
+template <typename T>
+bool read_exact(T *data, size_t count)
+{
+  return std::fread(data, sizeof(T), count, stdin) == count;
+}
+
+template <typename T>
+void write_exact(const T *data, size_t count)
+{
+  std::fwrite(data, sizeof(T), count, stdout);
+}
+
+// Long lived worker mode, avoids process startup and text I/O for every test
+// Speaks a binary length prefixed protocol (native byte order) over stdin/stdout
+// Request:  uint64 num_points, float64 alpha, uint32 n, float64[num_points * 2] points (x, y interleaved)
+// Response: uint32 status, uint64 num_timings, float64[num_timings] timings (ms),
+//           uint64 num_edges, float64[num_edges * 4] edges (x0, y0, x1, y1)
+// A request with num_points == 0 shuts the worker down. A failed request is answered with a nonzero status only
+int serve()
+{
+  std::vector<double> buffer;
+  while (true)
+  {
+    uint64_t num_points = 0;
+    double alpha = 0.0;
+    uint32_t n = 1;
+    if (!read_exact(&num_points, 1) || num_points == 0)
+      break;
+    if (!read_exact(&alpha, 1) || !read_exact(&n, 1))
+      return -1;
+    buffer.resize(num_points * 2);
+    if (!read_exact(buffer.data(), buffer.size()))
+      return -1;
+
+    std::list<Point> points;
+    for (size_t i = 0; i < num_points; i++)
+      points.emplace_back(buffer[2 * i], buffer[2 * i + 1]);
+
+    std::vector<Segment> segments;
+    std::vector<double> time_list;
+    uint32_t status = 0;
+    try
+    {
+      time_list = calculate_alpha_shape(points, segments, alpha, n);
+    }
+    catch (const std::exception & e)
+    {
+      std::cerr << "Alpha shape failed: " << e.what() << std::endl;
+      status = 1;
+    }
+    catch (...)
+    {
+      std::cerr << "Alpha shape failed" << std::endl;
+      status = 1;
+    }
+    if (status != 0)
+    {
+      write_exact(&status, 1);
+      std::fflush(stdout);
+      continue;
+    }
+
+    uint64_t num_timings = time_list.size();
+    uint64_t num_edges = segments.size();
+    std::vector<double> edges;
+    edges.reserve(num_edges * 4);
+    for (auto & seg : segments)
+    {
+      edges.push_back(CGAL::to_double(seg.source().x()));
+      edges.push_back(CGAL::to_double(seg.source().y()));
+      edges.push_back(CGAL::to_double(seg.target().x()));
+      edges.push_back(CGAL::to_double(seg.target().y()));
+    }
+    write_exact(&status, 1);
+    write_exact(&num_timings, 1);
+    write_exact(time_list.data(), time_list.size());
+    write_exact(&num_edges, 1);
+    write_exact(edges.data(), edges.size());
+    std::fflush(stdout);
+  }
+  return 0;
+}
+
 // This function will read a list of points and compute the alpha shape
 int main(int argc, char* argv[])
 {
   // Parse arguments
   // file_path, output_edge_file, alpha, n=samples
+  // or --server to launch as a long lived worker, --version prints the CGAL version
   std::vector<std::string> argList(argv, argv + argc);
+  if (argList.size() == 2 && argList[1] == "--server") {
+    return serve();
+  }
+  if (argList.size() == 2 && argList[1] == "--version") {
+    std::cout << CGAL_VERSION_STR << std::endl;
+    return 0;
+  }
   if (argList.size() < 4) {
     std::cerr << "Incorrect number of arguments. Need input file, output file, alpha, n (optional)" << std::endl;
     return -1;
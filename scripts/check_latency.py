@@ -1,7 +1,10 @@
 import time
 import numpy as np
-from concave_evaluation.spatialite_evaluation import DBConn
-from concave_evaluation.postgis_evaluation import DBConnPostGIS
+from concave_evaluation.spatialite_evaluation import DBConn, get_spatialite_session, measure_latency
+from concave_evaluation.spatialite_evaluation import insert_multipoint as insert_multipoint_sp
+from concave_evaluation.postgis_evaluation import DBConnPostGIS, get_postgis_pool, insert_multipoint, latency_split
+from concave_evaluation.helpers import load_points
+from concave_evaluation import DEFAULT_TEST_FILE
 
 spatialite_query = "SELECT ST_AsBinary(ST_ConcaveHull(ST_GeomFromText('MULTIPOINT ((10 40), (40 30), (20 20), (30 10))'), 3, 1)) as polygon"
 postgis_query = "SELECT ST_AsBinary(ST_ConcaveHull(ST_GeomFromText('MULTIPOINT ((10 40), (40 30), (20 20), (30 10))'), .98, true)) as polygon"
@@ -27,6 +30,16 @@ def main(n=10):
     mean, std = test_latency(db_sp, query=base_query)
     print("Spatialite Basic Latency (ms) - Mean:{:.3f}, Std: {:.3f}".format(mean, std))
 
+    # Per test overhead of the reused session: insert a tiny cloud and clear it again
+    session_conn = get_spatialite_session().conn
+    t0 = time.time()
+    for i in range(n):
+        with get_spatialite_session() as conn:
+            insert_multipoint_sp(conn, np.array([[10.0, 40.0], [40.0, 30.0], [20.0, 20.0]]), 'latency')
+    overhead = (time.time() - t0) * 1000 / n
+    print("Spatialite Session Overhead (ms) - Per Test: {:.3f}, Round Trip: {:.3f}".format(
+        overhead, measure_latency(session_conn)))
+
     db_post = DBConnPostGIS()
     mean, std = test_latency(db_post, query=base_query)
     print("PostGIS Basic Latency (ms) - Mean: {:.3f}, Std: {:.3f}".format(mean, std))
@@ -36,6 +49,14 @@ def main(n=10):
 
     mean, std = test_latency(db_post, query=postgis_query)
     print("PostGIS Concave Hull Latency (ms) - Mean: {:.3f}, Std: {:.3f}".format(mean, std))
+    db_post.close()
+
+    # Client vs server side split of a real concave hull query
+    with get_postgis_pool().session() as conn:
+        insert_multipoint(conn, load_points(DEFAULT_TEST_FILE), test_name='latency')
+        split = latency_split(conn, 'latency', target_percent=0.9, n=n)
+    print("PostGIS Concave Hull Split (ms) - Client: {client_ms:.3f}, Server: {server_ms:.3f}, "
+          "Overhead: {overhead_ms:.3f}, Round Trip: {latency_ms:.3f}".format(**split))
 
 
 if __name__ == "__main__":
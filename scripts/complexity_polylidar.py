@@ -1,7 +1,11 @@
 import math
+import time
+import tempfile
+from os import path
 import numpy as np
 import pandas as pd
 from polylidar import extractPlanesAndPolygons, extractPolygonsAndTimings
+from concave_evaluation.polylidar_evaluation.tiled import tiled_concave_hull
 
 def gen_points(xmin=0, xmax=10, xstep=1, ymin=0, ymax=10, ystep=1):
     X, Y = np.mgrid[xmin:xmax:xstep, ymin:ymax:ystep]
@@ -31,6 +35,24 @@ def polylidar_timings(reps=3, n_val=n_val_good):
     return records
 
 
+def tiled_timings(reps=3, n_val=n_val_good_giant, tiles=(8, 8), workers=4):
+    """Times the tiled alpha shape, the points are memory mapped so only one tile is triangulated at a time"""
+    records = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n in n_val:
+            valmax = int(math.sqrt(n))
+            point_fpath = path.join(tmp_dir, 'points_{}.npy'.format(n))
+            np.save(point_fpath, gen_points(xmax=valmax, ymax=valmax).astype(np.float64))
+            true_n = valmax * valmax
+            for j in range(reps):
+                t0 = time.perf_counter()
+                tiled_concave_hull(point_fpath, 2.0, tiles=tiles, workers=workers)
+                record = dict(n=true_n, tiled=(time.perf_counter() - t0) * 1000)
+                records.append(record)
+                print(record)
+    return records
+
+
 def main():
     records = polylidar_timings(reps=3, n_val=n_val_large_range)
     df = pd.DataFrame.from_records(records)
@@ -1,6 +1,5 @@
 from os import path, listdir
-import math
-from concave_evaluation.helpers import load_polygon
+from concave_evaluation.helpers import load_ground_truth, nominal_alpha
 from concave_evaluation import DEFAULT_GT_DIR
 
 import pandas as pd
@@ -12,11 +11,10 @@ def main():
     records = []
     for gt_file in gt_files:
         gt_fpath = path.join(DEFAULT_GT_DIR, gt_file)
-        gt_poly, _ = load_polygon(gt_fpath)
-        gt_area = gt_poly.area
+        gt_area = load_ground_truth(gt_fpath).area
         for n_points in num_points:
             point_density = gt_area / n_points
-            alpha = math.sqrt(point_density) * 2
+            alpha = nominal_alpha(gt_area, n_points)
             records.append(dict(shape=gt_file, n=n_points, point_density=point_density, alpha=alpha))
     df = pd.DataFrame.from_records(records)
     print(df)
@@ -0,0 +1,82 @@
+import os
+import sys
+import stat
+import textwrap
+
+import numpy as np
+import pytest
+
+from concave_evaluation import CGAL_BIN
+from concave_evaluation.cgal_evaluation import CGALWorker
+
+# Speaks the --server protocol of cgal_alpha.cpp, the edges are the bounding box of the points
+# and a negative alpha fails with a nonzero status
+FAKE_SERVER = textwrap.dedent('''\
+    import struct
+    import sys
+    import numpy as np
+
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    while True:
+        header = stdin.read(8)
+        if len(header) < 8 or struct.unpack('=Q', header)[0] == 0:
+            break
+        num_points = struct.unpack('=Q', header)[0]
+        alpha, n = struct.unpack('=dI', stdin.read(12))
+        points = np.frombuffer(stdin.read(num_points * 16), dtype=np.float64).reshape(-1, 2)
+        if alpha < 0:
+            stdout.write(struct.pack('=I', 1))
+        else:
+            (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+            edges = np.array([[x0, y0, x1, y0], [x1, y0, x1, y1], [x1, y1, x0, y1], [x0, y1, x0, y0]])
+            stdout.write(struct.pack('=IQ', 0, n))
+            stdout.write(np.full(n, 1.5).tobytes())
+            stdout.write(struct.pack('=Q', edges.shape[0]))
+            stdout.write(edges.tobytes())
+        stdout.flush()
+''')
+
+
+@pytest.fixture
+def fake_cgal_bin(tmp_path):
+    fpath = tmp_path / 'cgal_alpha'
+    fpath.write_text("#!{}\n{}".format(sys.executable, FAKE_SERVER))
+    fpath.chmod(fpath.stat().st_mode | stat.S_IXUSR)
+    return str(fpath)
+
+
+def test_compute_round_trip(fake_cgal_bin):
+    points = np.array([[0.0, 0.0], [2.0, 0.0], [2.0, 1.0], [0.0, 1.0], [1.0, 0.5]])
+    with CGALWorker(fake_cgal_bin) as worker:
+        edges, timings = worker.compute(points, alpha=1.0, n=3)
+        assert timings == [1.5, 1.5, 1.5]
+        np.testing.assert_array_equal(edges[0], [0.0, 0.0, 2.0, 0.0])
+        assert edges.shape == (4, 4)
+    assert not worker.is_alive()
+
+
+def test_compute_error_status(fake_cgal_bin):
+    points = np.random.default_rng(0).random((10, 2))
+    with CGALWorker(fake_cgal_bin) as worker:
+        with pytest.raises(ValueError):
+            worker.compute(points, alpha=-1.0)
+        # The worker stays in sync and answers the next request
+        edges, timings = worker.compute(points, alpha=1.0)
+        assert edges.shape == (4, 4) and len(timings) == 1
+
+
+def test_compute_empty_cloud(fake_cgal_bin):
+    with CGALWorker(fake_cgal_bin) as worker:
+        edges, timings = worker.compute(np.empty((0, 2)))
+        assert edges.shape == (0, 4) and timings == []
+        # An empty cloud is not sent, so it does not shut the worker down
+        assert worker.is_alive()
+
+
+@pytest.mark.skipif(not os.path.exists(CGAL_BIN), reason="cgal_alpha is not built")
+def test_cgal_alpha_square():
+    points = np.array([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0]])
+    with CGALWorker() as worker:
+        edges, timings = worker.compute(points, alpha=10.0, n=2)
+    assert len(timings) == 2
+    assert edges.shape == (4, 4)
@@ -0,0 +1,60 @@
+import pandas as pd
+
+from concave_evaluation.scripts.checkpoint import CheckpointWriter, params_hash, KEY_COLUMNS
+
+
+def record(alg, time, **kwargs):
+    return dict(alg=alg, shape='miglove', points=2000, time=time, **kwargs)
+
+
+def test_resume_skips_completed_jobs(tmp_path):
+    fpath = str(tmp_path / 'timings.csv')
+    phash = params_hash(dict(alpha=1.0))
+    with CheckpointWriter(fpath) as checkpoint:
+        checkpoint.write([record('cgal', 1.0)], 'polygons_2000', 0, phash)
+        checkpoint.write([], 'polygons_2000', 1, phash, algs=['cgal'])
+    checkpoint = CheckpointWriter(fpath, resume=True)
+    assert checkpoint.is_done('polygons_2000', 0, 'cgal', phash)
+    # A job without records is complete as well
+    assert checkpoint.is_done('polygons_2000', 1, 'cgal', phash)
+    assert not checkpoint.is_done('polygons_2000', 2, 'cgal', phash)
+
+
+def test_resume_with_changed_params_hash(tmp_path):
+    fpath = str(tmp_path / 'timings.csv')
+    old_hash, new_hash = params_hash(dict(alpha=1.0)), params_hash(dict(alpha=2.0))
+    with CheckpointWriter(fpath) as checkpoint:
+        checkpoint.write([record('polylidar', 1.0)], 'polygons_2000', 0, old_hash)
+    with CheckpointWriter(fpath, resume=True) as checkpoint:
+        assert not checkpoint.is_done('polygons_2000', 0, 'polylidar', new_hash)
+        checkpoint.write([record('polylidar', 2.0)], 'polygons_2000', 0, new_hash)
+        assert len(checkpoint.session_records()) == 1
+    df = pd.read_csv(fpath, dtype={'params_hash': str})
+    assert sorted(df['params_hash']) == sorted([old_hash, new_hash])
+
+
+def test_resume_drops_partial_job(tmp_path):
+    fpath = str(tmp_path / 'timings.csv')
+    with CheckpointWriter(fpath) as checkpoint:
+        checkpoint.write([record('cgal', 1.0)], 'polygons_2000', 0, 'h')
+    # Killed while writing the records of job 1, before its completion marker
+    with open(fpath, 'a') as f:
+        f.write('polygons_2000,1,cgal,h,miglove,2000,3.0\npolygons_2000,1,cgal,h,migl')
+    checkpoint = CheckpointWriter(fpath, resume=True)
+    assert not checkpoint.is_done('polygons_2000', 1, 'cgal', 'h')
+    assert pd.read_csv(fpath)['poly_idx'].tolist() == [0]
+
+
+def test_heterogeneous_columns_extend_header(tmp_path):
+    fpath = str(tmp_path / 'timings.csv')
+    with CheckpointWriter(fpath, flush_every=1) as checkpoint:
+        checkpoint.write([record('polylidar', 1.0)], 'polygons_2000', 0, 'h')
+        checkpoint.write([record('cgal', 2.0, holes=3)], 'polygons_2000', 0, 'h')
+        checkpoint.write([record('spatialite', 3.0, section='db')], 'polygons_2000', 0, 'h')
+    df = pd.read_csv(fpath)
+    assert list(df.columns[:len(KEY_COLUMNS)]) == KEY_COLUMNS
+    assert df['alg'].tolist() == ['polylidar', 'cgal', 'spatialite']
+    assert df['holes'].isna().tolist() == [True, False, True]
+    assert df.loc[1, 'holes'] == 3
+    assert df.loc[2, 'section'] == 'db'
+    assert df['time'].tolist() == [1.0, 2.0, 3.0]
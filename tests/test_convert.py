@@ -0,0 +1,61 @@
+import pickle
+
+import click
+import numpy as np
+import pytest
+
+from concave_evaluation.helpers import convert_points_file, load_points_records, resolve_point_file
+from concave_evaluation.test_generation.dataset import Dataset, is_dataset
+
+
+def point_records(sizes):
+    rng = np.random.default_rng(0)
+    return [dict(points=rng.random((size, 2)), poly_param=dict(nv=i), np=size) for i, size in enumerate(sizes)]
+
+
+def write_pickle(tmp_path, records):
+    fpath = tmp_path / 'polygons_2000.pkl'
+    with open(fpath, 'wb') as f:
+        pickle.dump(records, f)
+    return fpath
+
+
+def test_convert_uniform_pickle(tmp_path):
+    records = point_records([50, 50, 50])
+    out = convert_points_file(write_pickle(tmp_path, records))
+    assert out.endswith('.npy')
+    loaded = load_points_records(out)
+    assert len(loaded) == 3
+    for record, loaded_record in zip(records, loaded):
+        np.testing.assert_array_equal(record['points'], loaded_record['points'])
+        assert loaded_record['poly_param'] == record['poly_param']
+
+
+def test_convert_ragged_pickle(tmp_path):
+    records = point_records([50, 80, 20])
+    out = convert_points_file(write_pickle(tmp_path, records))
+    assert is_dataset(out)
+    assert not (tmp_path / 'polygons_2000.npy').exists()
+    dataset = Dataset(out)
+    assert len(dataset) == 3
+    for i, record in enumerate(records):
+        np.testing.assert_array_equal(dataset.points(i), record['points'])
+
+
+def test_convert_skips_polygon_pickle(tmp_path):
+    fpath = tmp_path / 'polygons.pkl'
+    with open(fpath, 'wb') as f:
+        pickle.dump(([], []), f)
+    assert convert_points_file(fpath) is None
+
+
+def test_resolve_point_file(tmp_path):
+    csv_fpath = tmp_path / 'miglove_2000.csv'
+    np.savetxt(csv_fpath, np.zeros((3, 2)))
+    assert resolve_point_file(None, None, str(csv_fpath)) == str(csv_fpath)
+    # A checkout converted with 'concave convert' may only hold the .npy sibling
+    csv_fpath.unlink()
+    np.save(tmp_path / 'miglove_2000.npy', np.zeros((3, 2)))
+    assert resolve_point_file(None, None, str(csv_fpath)) == str(tmp_path / 'miglove_2000.npy')
+    with pytest.raises(click.BadParameter):
+        resolve_point_file(None, None, str(tmp_path / 'missing_2000.csv'))
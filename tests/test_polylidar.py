@@ -0,0 +1,53 @@
+import logging
+
+import numpy as np
+import pytest
+
+pytest.importorskip('polylidar')
+import concave_evaluation.polylidar_evaluation as polylidar_evaluation  # noqa: E402
+
+
+@pytest.fixture
+def fake_polylidar(monkeypatch):
+    calls = []
+
+    def extract(cloud, **kwargs):
+        calls.append(np.array(cloud))
+        return [], [0.5]
+
+    converted = {}
+
+    def convert(results, points, offsets):
+        converted['points'] = np.array(points)
+        return np.array([None] * (len(offsets) - 1), dtype=object)
+
+    monkeypatch.setattr(polylidar_evaluation, 'extractPolygonsAndTimings', extract)
+    monkeypatch.setattr(polylidar_evaluation, 'convert_to_shapely_polygons_batch', convert)
+    return calls, converted
+
+
+def test_get_polygons_adds_noise(fake_polylidar):
+    calls, converted = fake_polylidar
+    points = np.zeros((10, 3))
+    _, timings = polylidar_evaluation.get_polygons(points, [0, 4, 10], n=2, add_noise=True, noise=1.0)
+    assert timings.shape == (2, 2, 1)
+    assert len(calls) == 4
+    np.testing.assert_array_equal(points, 0.0)
+    assert not np.allclose(converted['points'][:, :2], 0.0)
+    np.testing.assert_array_equal(converted['points'][:, 2], 0.0)
+    # Polygons are built from the cloud of the last call
+    np.testing.assert_array_equal(converted['points'][4:], calls[-1])
+
+
+def test_get_polygons_without_noise(fake_polylidar):
+    calls, converted = fake_polylidar
+    points = np.arange(20, dtype=np.float64).reshape(10, 2)
+    polylidar_evaluation.get_polygons(points, [0, 10], n=1)
+    np.testing.assert_array_equal(calls[-1], points)
+    np.testing.assert_array_equal(converted['points'], points)
+
+
+def test_get_polygons_warns_on_unknown_options(fake_polylidar, caplog):
+    with caplog.at_level(logging.WARNING, logger='Concave'):
+        polylidar_evaluation.get_polygons(np.zeros((5, 2)), [0, 5], minTriangles=1)
+    assert 'minTriangles' in caplog.text
@@ -0,0 +1,50 @@
+import os
+import time
+
+import pytest
+
+from concave_evaluation.scripts.scheduler import run_jobs
+
+
+def echo_job(alg, value, delay=0.0):
+    time.sleep(delay)
+    return alg, value, os.getpid(), time.time()
+
+
+def failing_job(alg, value, delay=0.0):
+    if value == 'fail':
+        raise ValueError("job failed")
+    time.sleep(delay)
+    return alg, value
+
+
+def test_run_jobs_keeps_job_order():
+    jobs = [('polylidar', 0, 0.05), ('postgis', 1), ('cgal', 2), ('spatialite', 3), ('polylidar', 4)]
+    collected = []
+    results = run_jobs(echo_job, jobs, cpu_workers=2, db_workers=1, pin_cpu=False,
+                       on_result=lambda job, result: collected.append(job))
+    assert [result[:2] for result in results] == [job[:2] for job in jobs]
+    assert sorted(collected) == sorted(jobs)
+
+
+def test_run_jobs_db_pool_starts_after_cpu_pool():
+    jobs = [('polylidar', 0, 0.2), ('spatialite', 1), ('cgal', 2, 0.2)]
+    results = run_jobs(echo_job, jobs, cpu_workers=2, db_workers=1, pin_cpu=False)
+    assert results[1][3] >= max(results[0][3], results[2][3])
+
+
+def test_run_jobs_inline_after_pools():
+    jobs = [('spatialite', 0), ('polylidar', 1, 0.2)]
+    results = run_jobs(echo_job, jobs, cpu_workers=1, db_workers=0, pin_cpu=False)
+    assert results[0][2] == os.getpid()
+    assert results[1][2] != os.getpid()
+    assert results[0][3] >= results[1][3]
+
+
+def test_run_jobs_error_terminates_pool():
+    jobs = [('polylidar', 'fail')] + [('polylidar', i, 1.0) for i in range(8)]
+    start = time.time()
+    with pytest.raises(ValueError):
+        run_jobs(failing_job, jobs, cpu_workers=2, db_workers=0, pin_cpu=False)
+    # The queued jobs (4 s of work per worker) are not waited for
+    assert time.time() - start < 3.0